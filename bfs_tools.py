@@ -2,9 +2,11 @@
 Breadth-first search tools for enumerating connections or relatives of a person.
 """
 import collections
-from collections.abc import Set
-from typing import Iterator
+from collections.abc import Iterable, Iterator, Mapping, Set
 
+import numpy as np
+
+import csr_tools
 import data_reader
 from data_reader import UserNum
 
@@ -26,6 +28,10 @@ def ConnectionBfs(db : data_reader.Database,
                   start : UserNum,
                   ignore_people : Set[UserNum] = frozenset()
                   ) -> Iterator[BfsNode]:
+  if db.adjacency:
+    yield from _ArrayConnectionBfs(db.adjacency, start, ignore_people)
+    return
+
   todos : collections.deque[UserNum] = collections.deque()
   todos.append(start)
   nodes = {start: BfsNode(start, [], 0)}
@@ -43,3 +49,193 @@ def ConnectionBfs(db : data_reader.Database,
         else:
           todos.append(neigh)
           nodes[neigh] = BfsNode(neigh, [person], dist + 1)
+
+
+# Vectorized level-synchronous BFS over a csr_tools.Adjacency.
+#
+# Instead of visiting one person at a time, each step expands the whole
+# frontier with NumPy gathers. Distances are stored in a dense array indexed
+# by person index (-1 = not reached).
+
+# Temporary marker in dists for people to skip.
+_IGNORED = -2
+
+def _DistDtype(max_dist : int | None) -> type:
+  if max_dist is not None and max_dist < np.iinfo(np.int8).max:
+    return np.int8
+  return np.int16
+
+def FrontierLevels(adjacency : csr_tools.Adjacency,
+                   start_indexes : Iterable[int],
+                   dists : np.ndarray,
+                   rel_mask : np.ndarray | None = None,
+                   max_dist : int | None = None
+                   ) -> Iterator[tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+  """Enumerate BFS levels. Fills in dists (which must be initialized to -1
+  for all unvisited people) as it goes.
+
+  Yields tuples (dist, frontier, sources, targets) where frontier is the
+  sorted array of indexes at dist and (sources, targets) are all edges from
+  the previous level into frontier (empty for the start level).
+  """
+  frontier = np.unique(np.asarray(start_indexes, dtype=np.int64))
+  dists[frontier] = 0
+  sources = targets = np.empty(0, dtype=np.int64)
+  dist = 0
+  while frontier.size:
+    yield dist, frontier, sources, targets
+    if max_dist is not None and dist >= max_dist:
+      return
+    sources, targets = adjacency.expand(frontier, rel_mask)
+    keep = (dists[targets] == -1)
+    sources, targets = sources[keep], targets[keep]
+    frontier = np.unique(targets)
+    dist += 1
+    dists[frontier] = dist
+
+def _UniqueEdges(sources : np.ndarray, targets : np.ndarray, num_nodes : int
+                 ) -> tuple[np.ndarray, np.ndarray]:
+  """Remove duplicate (source, target) pairs (Ex: spouse & coparent).
+  Result is sorted by target."""
+  keys = np.unique(targets.astype(np.int64) * num_nodes + sources)
+  return keys % num_nodes, keys // num_nodes
+
+def BfsDistances(adjacency : csr_tools.Adjacency,
+                 start_index : int,
+                 ignore_indexes : Iterable[int] = (),
+                 rel_mask : np.ndarray | None = None,
+                 max_dist : int | None = None,
+                 count_preds : bool = False
+                 ) -> tuple[np.ndarray, np.ndarray | None]:
+  """Compute distance from start to every person reachable (within max_dist).
+
+  Returns pair (dists, pred_counts). dists is a dense int8/int16 array
+  (-1 = unreached). If count_preds, pred_counts[i] is the number of
+  neighbors of i on a shortest path to start (otherwise it is None).
+  """
+  dists : np.ndarray = np.full(adjacency.num_people, -1, dtype=_DistDtype(max_dist))
+  ignore_indexes = np.asarray(list(ignore_indexes), dtype=np.int64)
+  dists[ignore_indexes] = _IGNORED
+  pred_counts = np.zeros(adjacency.num_people if count_preds else 0,
+                         dtype=np.int32)
+
+  for _, _, sources, targets in FrontierLevels(
+      adjacency, [start_index], dists, rel_mask, max_dist):
+    if count_preds and targets.size:
+      _, targets = _UniqueEdges(sources, targets, adjacency.num_people)
+      people, counts = np.unique(targets, return_counts=True)
+      pred_counts[people] = counts
+
+  dists[ignore_indexes] = -1
+  return dists, (pred_counts if count_preds else None)
+
+# Max number of sources MultiBfsHistograms can search from at once
+# (one bit per source).
+MULTI_BFS_WIDTH = 64
+
+def _BitCounts(bits : np.ndarray, chunk_size : int = 1_000_000) -> np.ndarray:
+  """Count number of set bits at each of the 64 bit positions in bits."""
+  counts = np.zeros(MULTI_BFS_WIDTH, dtype=np.int64)
+  for start in range(0, len(bits), chunk_size):
+    chunk = bits[start:start + chunk_size].astype("<u8")
+    counts += np.unpackbits(chunk.view(np.uint8).reshape(-1, 8), axis=1,
+                            bitorder="little").sum(axis=0, dtype=np.int64)
+  return counts
+
+def MultiBfsHistograms(adjacency : csr_tools.Adjacency,
+                       start_indexes : Iterable[int],
+                       ignore_indexes : Iterable[int] = (),
+                       rel_mask : np.ndarray | None = None,
+                       max_dist : int | None = None) -> np.ndarray:
+  """Run BFS from up to MULTI_BFS_WIDTH starts at once (bit-parallel
+  MS-BFS): Each person has a uint64 with one bit per start, so a single
+  frontier expansion advances all of the searches together.
+
+  Returns hist[i, dist] = number of people at dist from start_indexes[i].
+  """
+  start_indexes = np.asarray(list(start_indexes), dtype=np.int64)
+  num_starts = len(start_indexes)
+  assert 0 < num_starts <= MULTI_BFS_WIDTH, num_starts
+  start_bits = np.left_shift(np.uint64(1), np.arange(num_starts, dtype=np.uint64))
+  # seen[i] has bit j set if person i has been reached from start j.
+  seen = np.zeros(adjacency.num_people, dtype=np.uint64)
+  seen[np.asarray(list(ignore_indexes), dtype=np.int64)] = ~np.uint64(0)
+
+  # Combine bits of duplicate starts.
+  frontier, inverse = np.unique(start_indexes, return_inverse=True)
+  bits = np.zeros(len(frontier), dtype=np.uint64)
+  np.bitwise_or.at(bits, inverse, start_bits)
+  seen[frontier] |= bits
+
+  hists = []
+  while frontier.size:
+    hists.append(_BitCounts(bits)[:num_starts])
+    if max_dist is not None and len(hists) > max_dist:
+      break
+    sources, targets = adjacency.expand(frontier, rel_mask)
+    edge_bits = bits[np.searchsorted(frontier, sources)]
+    # OR together the bits reaching each target.
+    order = np.argsort(targets, kind="stable")
+    targets, edge_bits = targets[order], edge_bits[order]
+    frontier, group_starts = np.unique(targets, return_index=True)
+    if not frontier.size:
+      break
+    bits = np.bitwise_or.reduceat(edge_bits, group_starts)
+    bits &= ~seen[frontier]
+    keep = bits != 0
+    frontier, bits = frontier[keep], bits[keep]
+    seen[frontier] |= bits
+
+  return np.array(hists, dtype=np.int64).reshape(-1, num_starts).T
+
+def _ArrayConnectionBfs(adjacency : csr_tools.Adjacency,
+                        start : UserNum,
+                        ignore_people : Set[UserNum]) -> Iterator[BfsNode]:
+  """ConnectionBfs implemented on top of FrontierLevels. Nodes within the
+  same distance are yielded in user_num order."""
+  try:
+    start_index = adjacency.index_of(start)
+  except KeyError:
+    # Person with no relationships.
+    yield BfsNode(start, [], 0)
+    return
+
+  dists = np.full(adjacency.num_people, -1, dtype=np.int16)
+  ignore_indexes = adjacency.indexes_of(list(ignore_people))
+  dists[ignore_indexes[ignore_indexes >= 0]] = _IGNORED
+
+  for dist, frontier, sources, targets in FrontierLevels(
+      adjacency, [start_index], dists):
+    if dist == 0:
+      yield BfsNode(start, [], 0)
+      continue
+    sources, targets = _UniqueEdges(sources, targets, adjacency.num_people)
+    prevs = adjacency.user_nums[sources].tolist()
+    # Edges are sorted by target, so prevs for frontier[i] are a contiguous
+    # slice of prevs.
+    bounds = np.searchsorted(targets, frontier, side="right").tolist()
+    start_bound = 0
+    for person, end_bound in zip(adjacency.user_nums[frontier].tolist(), bounds):
+      yield BfsNode(person, prevs[start_bound:end_bound], dist)
+      start_bound = end_bound
+
+
+class DistanceMap(Mapping[UserNum, int]):
+  """Read-only {user_num: dist} view over a dense BfsDistances array
+  (so that we do not need to build a dict for the whole graph)."""
+  def __init__(self, adjacency : csr_tools.Adjacency, dists : np.ndarray) -> None:
+    self.adjacency = adjacency
+    self.dists = dists
+    self.visited = np.flatnonzero(dists >= 0)
+
+  def __getitem__(self, user_num : UserNum) -> int:
+    dist = int(self.dists[self.adjacency.index_of(user_num)])
+    if dist < 0:
+      raise KeyError(user_num)
+    return dist
+
+  def __iter__(self) -> Iterator[UserNum]:
+    return iter(self.adjacency.user_nums[self.visited].tolist())
+
+  def __len__(self) -> int:
+    return len(self.visited)
@@ -1,17 +1,21 @@
 import argparse
 import datetime
+import functools
 import webbrowser
 
+import pyarrow.compute as pc
+
 import category_tools
 import csv_iterate
 import data_reader
 
 
-def is_residence(location, places):
-  for name in places:
-    if name.lower() in location.lower():
-      return True
-  return False
+def is_residence(locations, places):
+  """Which locations (an Arrow array) contain any of places (ignoring case).
+  Null locations are False."""
+  matches = [pc.match_substring(locations, name, ignore_case=True)
+             for name in places]
+  return pc.fill_null(functools.reduce(pc.or_, matches), False)
 
 
 def category_check(version, args, *, target_places, category_name=None):
@@ -19,21 +23,27 @@ def category_check(version, args, *, target_places, category_name=None):
   category_db = category_tools.CategoryDb(version)
 
   residents = set()
-  for user in csv_iterate.iterate_users(version=version):
-    for place in (user.birth_location(), user.death_location()):
-      if place and is_residence(place, target_places):
-        residents.add(user.user_num())
-  for marriage in csv_iterate.iterate_marriages(version=version):
-    if marriage.marriage_location() and \
-       is_residence(marriage.marriage_location(), target_places):
-      for user_num in marriage.user_nums():
-        residents.add(user_num)
+  for batch in csv_iterate.iterate_users_batches(
+      version=version, columns=["User ID", "Birth Location", "Death Location"]):
+    is_resident = pc.or_(
+      is_residence(batch.column("Birth Location"), target_places),
+      is_residence(batch.column("Death Location"), target_places))
+    residents.update(batch.column("User ID").filter(is_resident).to_pylist())
+  for batch in csv_iterate.iterate_marriages_batches(
+      version=version, columns=["User ID1", "UserID2", "Marriage Location"]):
+    is_resident = is_residence(batch.column("Marriage Location"),
+                                     target_places)
+    for column in ("User ID1", "UserID2"):
+      residents.update(batch.column(column).filter(is_resident).to_pylist())
   print(f"# Residents = {len(residents):_}")
+  residents_list = list(residents)
+  privacy_levels = db.get_mult(residents_list, ["privacy_level"])["privacy_level"]
+  birth_dates = db.birth_dates_of(residents_list)
   editable_residents = {
-    user_num for user_num in residents
-    if db.get(user_num, "privacy_level") >= 60
-    and (not db.birth_date_of(user_num)
-         or db.birth_date_of(user_num) >= datetime.date(1500, 1, 1))}
+    user_num for user_num, privacy_level, birth_date
+    in zip(residents_list, privacy_levels, birth_dates)
+    if privacy_level is not None and privacy_level >= 60
+    and (not birth_date or birth_date >= datetime.date(1500, 1, 1))}
   print(f"# Editable residents = {len(editable_residents):_}")
 
   if category_name:
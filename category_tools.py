@@ -1,17 +1,134 @@
+"""
+Memory-mapped category <-> person index.
+
+Built once per dump from categories.parquet. Category names are dictionary
+encoded (category id = index into a StringTable) and membership is stored as
+CSR arrays in both directions, so lookups only touch their own results.
+
+Files (in data/version/{version}/categories/):
+ * names.*.npy: StringTable of category name by category id.
+ * category_offsets.npy: int64 [num_categories + 1]. Members of category c are
+   category_user_nums[category_offsets[c]:category_offsets[c+1]].
+ * category_user_nums.npy: int32 user_nums (sorted within each category).
+ * person_user_nums.npy: sorted int32 user_nums of everyone in any category.
+ * person_offsets.npy: int64 [num_people + 1]. Categories of
+   person_user_nums[i] are person_categories[person_offsets[i]:person_offsets[i+1]].
+ * person_categories.npy: int32 category ids (sorted within each person).
+"""
+
+import argparse
 from pathlib import Path
 
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
+import index_tools
+from sqlite_reader import UserNum
 import utils
 
 
+def category_index_dir(data_dir : Path) -> Path:
+  return Path(data_dir, "categories")
+
+
+def _csr_offsets(rows : np.ndarray, num_rows : int) -> np.ndarray:
+  """Offsets for values already sorted by rows."""
+  offsets = np.zeros(num_rows + 1, dtype=np.int64)
+  np.cumsum(np.bincount(rows, minlength=num_rows), out=offsets[1:])
+  return offsets
+
+
+def build_category_index(data_dir : Path) -> None:
+  utils.log("Loading categories")
+  table = pq.read_table(Path(data_dir, "categories.parquet"),
+                        columns=["user_num", "category"]).drop_null()
+  utils.log(f"  Loaded {table.num_rows:_} rows of categories")
+  encoded = pc.dictionary_encode(table.column("category").combine_chunks())
+  assert isinstance(encoded, pa.DictionaryArray), type(encoded)
+  names = encoded.dictionary
+  category_ids = encoded.indices.to_numpy().astype(np.int32)
+  user_nums = table.column("user_num").to_numpy()
+  del table, encoded
+  assert len(user_nums) == 0 or user_nums.max() < 2**31, user_nums.max()
+  user_nums = user_nums.astype(np.int32)
+
+  # Category -> people (dropping duplicate rows).
+  order = np.lexsort((user_nums, category_ids))
+  category_ids, user_nums = category_ids[order], user_nums[order]
+  keep = np.ones(len(order), dtype=bool)
+  keep[1:] = ((category_ids[1:] != category_ids[:-1]) |
+              (user_nums[1:] != user_nums[:-1]))
+  category_ids, user_nums = category_ids[keep], user_nums[keep]
+  del order, keep
+  category_offsets = _csr_offsets(category_ids, len(names))
+
+  # Person -> categories.
+  order = np.lexsort((category_ids, user_nums))
+  person_user_nums, person_rows = np.unique(user_nums[order], return_inverse=True)
+  person_offsets = _csr_offsets(person_rows, len(person_user_nums))
+  utils.log(f"Indexed {len(names):_} categories of {len(person_user_nums):_} people")
+
+  out_dir = category_index_dir(data_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  index_tools.StringTable.write(out_dir, "names", names)
+  np.save(out_dir / "category_offsets.npy", category_offsets)
+  np.save(out_dir / "category_user_nums.npy", user_nums)
+  np.save(out_dir / "person_user_nums.npy", person_user_nums)
+  np.save(out_dir / "person_offsets.npy", person_offsets)
+  # Written last so that readers only see complete indexes.
+  np.save(out_dir / "person_categories.npy", category_ids[order])
+  utils.log(f"Wrote category index to {str(out_dir)}")
+
+
 class CategoryDb:
-  def __init__(self, version):
-    self.filename = Path(utils.data_version_dir(version), "categories.parquet")
-    self.data = pd.read_parquet(self.filename)
+  """Memory-mapped read-only view of the category index (built on first use
+  if needed)."""
+  def __init__(self, version : str) -> None:
+    data_dir = utils.data_version_dir(version)
+    self.directory = category_index_dir(data_dir)
+    if not (self.directory / "person_categories.npy").exists():
+      build_category_index(data_dir)
+    self.names = index_tools.StringTable(self.directory, "names")
+    self.category_offsets = self._load("category_offsets")
+    self.category_user_nums = self._load("category_user_nums")
+    self.person_user_nums = self._load("person_user_nums")
+    self.person_offsets = self._load("person_offsets")
+    self.person_categories = self._load("person_categories")
+
+  def _load(self, name : str) -> np.ndarray:
+    return np.load(self.directory / f"{name}.npy", mmap_mode="r")
+
+  def category_user_nums_of(self, category_name : str) -> np.ndarray:
+    """Sorted array of user_nums in category (empty if unknown)."""
+    try:
+      category_id = self.names.index_of(category_name)
+    except KeyError:
+      return np.empty(0, dtype=np.int32)
+    return self.category_user_nums[self.category_offsets[category_id]:
+                                   self.category_offsets[category_id + 1]]
+
+  def list_categories_for_person(self, user_num : UserNum) -> frozenset[str]:
+    i = int(np.searchsorted(self.person_user_nums, user_num))
+    if i >= len(self.person_user_nums) or self.person_user_nums[i] != user_num:
+      return frozenset()
+    category_ids = self.person_categories[self.person_offsets[i]:
+                                          self.person_offsets[i + 1]]
+    return frozenset(name for name in self.names.get_mult(category_ids.tolist())
+                     if name is not None)
+
+  def list_people_in_category(self, category_name : str) -> frozenset[UserNum]:
+    return frozenset(self.category_user_nums_of(category_name).tolist())
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  args = parser.parse_args()
 
-  def list_categories_for_person(self, user_num):
-    return frozenset(self.data.loc[self.data.user_num == user_num, "category"])
+  data_dir = utils.data_version_dir(args.version)
+  build_category_index(data_dir)
 
-  def list_people_in_category(self, category_name):
-    return frozenset(self.data.loc[self.data.category == category_name, "user_num"])
+if __name__ == "__main__":
+  main()
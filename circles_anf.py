@@ -0,0 +1,159 @@
+"""
+Estimate cumulative circle sizes for everyone at once with HyperANF.
+
+N(v, r) = number of people within distance r of v. Exact values need one BFS
+per person. Instead, every person gets a HyperLogLog counter (2^log2m
+uint8 registers) approximating the set of people within distance r. Since
+the set within r + 1 is the union of the neighbors' sets within r, and the
+union of HyperLogLog counters is just the elementwise max of registers, all
+N(v, r + 1) come from one linear sweep over the CSR adjacency. Relative
+error is about 1.04 / sqrt(2^log2m).
+
+Output (in data/version/{version}/circles_anf.npy): float32
+[num_people, max_circles + 1] array of N(v, r) estimates indexed by dense
+person index (see index_tools).
+
+Ex:
+  python3 circles_anf.py --max-circles=10 --top-n=10 \
+    --save-distribution-json=results/circles/anf_top.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+import csr_tools
+import index_tools
+import utils
+
+
+# Number of rows (people) to process at once (bounds temporary memory).
+CHUNK_SIZE = 1_000_000
+
+def _splitmix64(values : np.ndarray) -> np.ndarray:
+  """Well mixed 64-bit hash of each value."""
+  z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+  z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+  z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+  return z ^ (z >> np.uint64(31))
+
+def init_counters(num_nodes : int, log2m : int) -> np.ndarray:
+  """HyperLogLog counters each containing only their own node."""
+  counters = np.zeros((num_nodes, 1 << log2m), dtype=np.uint8)
+  for start in range(0, num_nodes, CHUNK_SIZE):
+    nodes = np.arange(start, min(start + CHUNK_SIZE, num_nodes))
+    hashes = _splitmix64(nodes)
+    registers = (hashes & np.uint64((1 << log2m) - 1)).astype(np.int64)
+    rest = hashes >> np.uint64(log2m)
+    # Register value = position of lowest set bit in rest (1-based).
+    lowest_bit = (rest & (~rest + np.uint64(1))).astype(np.float64)
+    ranks = np.where(rest == 0, 64 - log2m + 1,
+                     np.log2(np.maximum(lowest_bit, 1)) + 1)
+    counters[nodes, registers] = ranks.astype(np.uint8)
+  return counters
+
+def _alpha(num_registers : int) -> float:
+  return {16: 0.673, 32: 0.697, 64: 0.709}.get(
+    num_registers, 0.7213 / (1 + 1.079 / num_registers))
+
+def estimate_sizes(counters : np.ndarray) -> np.ndarray:
+  """HyperLogLog estimate of the size of each counter's set."""
+  num_registers = counters.shape[1]
+  sizes = np.empty(len(counters), dtype=np.float64)
+  for start in range(0, len(counters), CHUNK_SIZE):
+    chunk = counters[start:start + CHUNK_SIZE]
+    raw = (_alpha(num_registers) * num_registers**2 /
+           np.ldexp(1.0, -chunk.astype(np.int32)).sum(axis=1))
+    num_zeros = (chunk == 0).sum(axis=1)
+    # Small range correction (linear counting).
+    small = (raw <= 2.5 * num_registers) & (num_zeros > 0)
+    raw[small] = num_registers * np.log(num_registers / num_zeros[small])
+    sizes[start:start + CHUNK_SIZE] = raw
+  return sizes
+
+def expand_counters(counters : np.ndarray, offsets : np.ndarray,
+                    neighbors : np.ndarray) -> np.ndarray:
+  """One HyperANF sweep: Union each counter with all of its neighbors'."""
+  new_counters = counters.copy()
+  num_nodes = len(counters)
+  for start in range(0, num_nodes, CHUNK_SIZE):
+    end = min(start + CHUNK_SIZE, num_nodes)
+    counts = np.diff(offsets[start:end + 1])
+    rows = np.flatnonzero(counts)
+    if not len(rows):
+      continue
+    gathered = counters[neighbors[offsets[start]:offsets[end]]]
+    # Start of each (non-empty) row's slots within gathered.
+    row_starts = (offsets[start:end] - offsets[start])[rows]
+    unions = np.maximum.reduceat(gathered, row_starts, axis=0)
+    rows += start
+    new_counters[rows] = np.maximum(new_counters[rows], unions)
+  return new_counters
+
+def hyper_anf(offsets : np.ndarray, neighbors : np.ndarray, max_circles : int,
+              log2m : int) -> np.ndarray:
+  """Returns float32 [num_nodes, max_circles + 1] estimates of N(v, r)."""
+  num_nodes = len(offsets) - 1
+  sizes = np.empty((num_nodes, max_circles + 1), dtype=np.float32)
+  sizes[:, 0] = 1
+  counters = init_counters(num_nodes, log2m)
+  for circle in range(1, max_circles + 1):
+    new_counters = expand_counters(counters, offsets, neighbors)
+    if np.array_equal(new_counters, counters):
+      # Every component has been fully covered.
+      sizes[:, circle:] = sizes[:, circle - 1:circle]
+      utils.log(f"Converged after {circle - 1} circles")
+      break
+    counters = new_counters
+    sizes[:, circle] = estimate_sizes(counters)
+    utils.log(f"Estimated circle {circle}: Mean N(v, {circle}) = {sizes[:, circle].mean():_.1f}")
+  return sizes
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  parser.add_argument("--max-circles", "-n", type=int, default=10)
+  parser.add_argument("--log2m", type=int, default=5,
+                      help="Log2 of # registers per counter (memory vs. accuracy).")
+  parser.add_argument("--top-n", type=int, default=10,
+                      help="Number of people with largest circles to list for each circle.")
+  parser.add_argument("--save-distribution-json", type=Path,
+                      help="Save (estimated) circle sizes of the top people to file "
+                           "(same format as distances.py for circles_plot.py).")
+  args = parser.parse_args()
+
+  data_dir = utils.data_version_dir(args.version)
+  index = index_tools.load_index(args.version)
+  adjacency = csr_tools.load_adjacency(args.version, index)
+  assert adjacency, "Requires adjacency snapshot (run csr_tools.py)"
+  utils.log(f"Loaded adjacency for {adjacency.num_people:_} people")
+
+  sizes = hyper_anf(adjacency.offsets, adjacency.neighbors,
+                    args.max_circles, args.log2m)
+  filename = Path(data_dir, "circles_anf.npy")
+  np.save(filename, sizes)
+  utils.log(f"Saved estimates to {str(filename)}")
+
+  top_indexes = set()
+  for circle in range(1, args.max_circles + 1):
+    top = np.argsort(sizes[:, circle])[::-1][:args.top_n]
+    top_indexes.update(top.tolist())
+    print("Circle", circle)
+    for index_num in top.tolist():
+      print(f" * {index.wikitree_ids.get(index_num) or index.user_nums[index_num]:40} : {sizes[index_num, circle]:_.0f}")
+
+  if args.save_distribution_json:
+    top_indexes = sorted(top_indexes)
+    circle_sizes = np.diff(np.round(sizes[top_indexes]), axis=1, prepend=0)
+    with open(args.save_distribution_json, "w") as f:
+      json.dump({
+        index.wikitree_ids.get(index_num) or str(index.user_nums[index_num]):
+          circle_sizes[i].astype(int).tolist()
+        for i, index_num in enumerate(top_indexes)}, f)
+    utils.log(f"Saved circle sizes to {str(args.save_distribution_json)}")
+
+if __name__ == "__main__":
+  main()
@@ -22,16 +22,26 @@ def main():
   parser.add_argument("--num-circles", "-n", type=int, default=7)
   parser.add_argument("--list", "-l", action="store_true")
   parser.add_argument("--load-connections", "--load", action="store_true")
+  parser.add_argument("--no-cache", action="store_true",
+                      help="Do not use (or update) circles cache.")
   parser.add_argument("--version", help="Data version (defaults to most recent).")
   args = parser.parse_args()
 
   db = data_reader.Database(args.version)
   if args.load_connections:
     db.load_connections()
+  cache = None
+  if not args.no_cache:
+    cache = circles_tools.CirclesCache(args.version)
 
   for id in args.focus_id:
-    circles = circles_tools.load_circles(db, id, args.num_circles)
-    sizes = [len(circle) for circle in circles]
+    if args.list or not cache:
+      circles = circles_tools.load_circles(db, id, args.num_circles)
+      sizes = [len(circle) for circle in circles]
+      if cache:
+        cache.put(db.get_person_num(id), args.num_circles, sizes)
+    else:
+      sizes = circles_tools.cached_circle_sizes(db, cache, id, args.num_circles)
     print(f"{id:15s} : {sum(sizes):7d} :", sizes)
 
     if args.list:
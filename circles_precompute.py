@@ -0,0 +1,57 @@
+"""
+Precompute circle sizes for popular people into the circles cache
+(see circles_tools.CirclesCache), so that circles_count.py answers them
+instantly.
+
+Popular people are the ones most requested from the cache (in any version)
+plus any given explicitly or in a watchlist.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import circles_tools
+import data_reader
+import utils
+
+
+def load_watchlist(filename : Path) -> list[int]:
+  """user_nums from watchlist JSON (see watchlist_filter.py)."""
+  with open(filename) as f:
+    js = json.load(f)
+  return [x["Id"] for x in js[0]["watchlist"]]
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("focus_id", nargs="*")
+  parser.add_argument("--top", type=int, default=1_000,
+                      help="Number of most requested people to precompute.")
+  parser.add_argument("--watchlist", type=Path,
+                      help="Also precompute everyone on this watchlist JSON.")
+  parser.add_argument("--num-circles", "-n", type=int, default=7)
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  args = parser.parse_args()
+
+  db = data_reader.Database(args.version)
+  cache = circles_tools.CirclesCache(args.version)
+
+  focus_nums = [db.get_person_num(id) for id in args.focus_id]
+  focus_nums += cache.popular(args.top)
+  if args.watchlist:
+    focus_nums += load_watchlist(args.watchlist)
+  # Skip duplicates, people already cached and people not in this version.
+  focus_nums = [num for num in dict.fromkeys(focus_nums)
+                if not cache.contains(num, args.num_circles)
+                and db.num2id(num)]
+  utils.log(f"Computing circles for {len(focus_nums):_} people")
+
+  all_sizes = circles_tools.circle_sizes_mult(db, focus_nums, args.num_circles)
+  for focus_num, sizes in zip(focus_nums, all_sizes):
+    # Note: Precomputing is not a request, so does not count as a hit.
+    cache.put(focus_num, args.num_circles, sizes, hits=0)
+  utils.log(f"Cached circles for {len(focus_nums):_} people")
+
+if __name__ == "__main__":
+  main()
@@ -2,8 +2,16 @@
 Tools for working with circles around a person.
 """
 
+from collections.abc import Sequence
+from pathlib import Path
+import sqlite3
+import time
+
+import numpy as np
+
 import bfs_tools
 from data_reader import UserNum
+import utils
 
 
 def load_circles(db, focus : UserNum, num_circles : int
@@ -11,9 +19,131 @@ def load_circles(db, focus : UserNum, num_circles : int
   focus_num = db.get_person_num(focus)
 
   circles : list[list[UserNum]] = [[] for dist in range(num_circles + 1)]
+  if db.adjacency:
+    dists = np.full(db.adjacency.num_people, -1, dtype=np.int16)
+    for dist, frontier, _, _ in bfs_tools.FrontierLevels(
+        db.adjacency, [db.adjacency.index_of(focus_num)], dists,
+        max_dist=num_circles):
+      circles[dist] = db.adjacency.user_nums[frontier].tolist()
+    return circles
+
   for node in bfs_tools.ConnectionBfs(db, focus_num):
     if node.dist > num_circles:
       break
     circles[node.dist].append(node.person)
 
   return circles
+
+
+def circle_sizes(db, focus : UserNum, num_circles : int) -> list[int]:
+  """Number of people in each circle 0..num_circles around focus."""
+  focus_num = db.get_person_num(focus)
+  if db.adjacency:
+    dists, _ = bfs_tools.BfsDistances(
+      db.adjacency, db.adjacency.index_of(focus_num), max_dist=num_circles)
+    sizes = np.bincount(dists[dists >= 0], minlength=num_circles + 1)
+    return sizes.tolist()
+  return [len(circle) for circle in load_circles(db, focus_num, num_circles)]
+
+def circle_sizes_mult(db, focus_nums : Sequence[UserNum], num_circles : int
+                      ) -> list[list[int]]:
+  """circle_sizes() for many people. Uses multi-source BFS if possible."""
+  if not db.adjacency:
+    return [circle_sizes(db, focus_num, num_circles) for focus_num in focus_nums]
+  all_sizes = []
+  for start in range(0, len(focus_nums), bfs_tools.MULTI_BFS_WIDTH):
+    batch = focus_nums[start:start + bfs_tools.MULTI_BFS_WIDTH]
+    hists = bfs_tools.MultiBfsHistograms(
+      db.adjacency, [db.adjacency.index_of(num) for num in batch],
+      max_dist=num_circles)
+    for hist in hists:
+      sizes = np.zeros(num_circles + 1, dtype=np.int64)
+      sizes[:len(hist)] = hist[:num_circles + 1]
+      all_sizes.append(sizes.tolist())
+  return all_sizes
+
+
+# Shared between all versions, so that we know which people are popular.
+CIRCLES_CACHE_FILENAME = Path("data", "circles_cache.db")
+
+def resolve_version(version : str | None) -> str:
+  """Actual version name (Ex: follow "default" symlink)."""
+  return utils.data_version_dir(version).resolve().name
+
+class CirclesCache:
+  """LRU cache of circle sizes keyed by (version, user_num, num_circles).
+
+  Sizes are stored as compact int64 per-circle counts. An entry for more
+  circles also answers requests for fewer circles.
+  """
+  def __init__(self, version : str | None,
+               filename : Path = CIRCLES_CACHE_FILENAME,
+               max_entries : int = 1_000_000) -> None:
+    self.version = resolve_version(version)
+    self.max_entries = max_entries
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    self.conn = sqlite3.connect(filename)
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS circles (
+      version STRING, user_num INT, num_circles INT, sizes BLOB,
+      last_used REAL, hits INT,
+      PRIMARY KEY (version, user_num, num_circles))""")
+    self.conn.execute("""CREATE INDEX IF NOT EXISTS idx_circles_last_used
+      ON circles(last_used)""")
+    self.conn.commit()
+
+  def _lookup(self, user_num : UserNum, num_circles : int) -> tuple | None:
+    return self.conn.execute(
+      """SELECT num_circles, sizes FROM circles
+         WHERE version=? AND user_num=? AND num_circles>=?
+         ORDER BY num_circles LIMIT 1""",
+      (self.version, user_num, num_circles)).fetchone()
+
+  def contains(self, user_num : UserNum, num_circles : int) -> bool:
+    """Like get() is not None, but does not count as a use."""
+    return self._lookup(user_num, num_circles) is not None
+
+  def get(self, user_num : UserNum, num_circles : int) -> list[int] | None:
+    row = self._lookup(user_num, num_circles)
+    if not row:
+      return None
+    self.conn.execute(
+      """UPDATE circles SET last_used=?, hits=hits+1
+         WHERE version=? AND user_num=? AND num_circles=?""",
+      (time.time(), self.version, user_num, row[0]))
+    self.conn.commit()
+    return np.frombuffer(row[1], dtype="<i8")[:num_circles + 1].tolist()
+
+  def put(self, user_num : UserNum, num_circles : int,
+          sizes : Sequence[int], hits : int = 1) -> None:
+    self.conn.execute(
+      "INSERT OR REPLACE INTO circles VALUES (?,?,?,?,?,?)",
+      (self.version, user_num, num_circles,
+       np.asarray(sizes, dtype="<i8").tobytes(), time.time(), hits))
+    self.evict()
+    self.conn.commit()
+
+  def evict(self) -> None:
+    """Delete least recently used entries beyond max_entries."""
+    (num_entries,) = self.conn.execute("SELECT COUNT(*) FROM circles").fetchone()
+    if num_entries > self.max_entries:
+      self.conn.execute(
+        """DELETE FROM circles WHERE rowid IN (
+             SELECT rowid FROM circles ORDER BY last_used LIMIT ?)""",
+        (num_entries - self.max_entries,))
+
+  def popular(self, num_people : int) -> list[UserNum]:
+    """Most requested people (across all versions)."""
+    rows = self.conn.execute(
+      """SELECT user_num FROM circles GROUP BY user_num
+         ORDER BY SUM(hits) DESC LIMIT ?""", (num_people,)).fetchall()
+    return [user_num for (user_num,) in rows]
+
+def cached_circle_sizes(db, cache : CirclesCache, focus : UserNum,
+                        num_circles : int) -> list[int]:
+  """circle_sizes() answered from cache if possible."""
+  focus_num = db.get_person_num(focus)
+  sizes = cache.get(focus_num, num_circles)
+  if sizes is None:
+    sizes = circle_sizes(db, focus_num, num_circles)
+    cache.put(focus_num, num_circles, sizes)
+  return sizes
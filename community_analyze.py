@@ -22,11 +22,10 @@ def name2users(node_name):
 
   return [db.get_person_num(id_or_num) for id_or_num in names]
 
-def get_locations(user_num):
+def get_locations(locations):
   """Return set of locations referenced by user's birth and death fields."""
   locs = set()
-  for attribute in ["birth_location", "death_location"]:
-    loc = db.get(user_num, attribute)
+  for loc in locations:
     # Note: occationally loc is an int ... skip
     if loc and isinstance(loc, str):
       # Break loc up into sections so that we can count country, state, county, etc.
@@ -51,15 +50,17 @@ def summarize_community(index):
     "manager": collections.Counter(),
   }
   birth_years = []
-  for node_index in subset:
-    node_name = names_db.index2name(node_index)
-    for user_num in name2users(node_name):
-      counts["category"].update(category_db.list_categories_for_person(user_num))
-      counts["location"].update(get_locations(user_num))
-      counts["manager"][db.get(user_num, "manager_num")] += 1
-      birth_date = db.birth_date_of(user_num)
-      if birth_date:
-        birth_years.append(birth_date.year)
+  user_nums = [user_num for node_name in names_db.index2names(subset)
+               for user_num in name2users(node_name)]
+  info = db.get_mult(user_nums, ["birth_location", "death_location", "manager_num"])
+  birth_dates = db.birth_dates_of(user_nums)
+  for i, user_num in enumerate(user_nums):
+    counts["category"].update(category_db.list_categories_for_person(user_num))
+    counts["location"].update(get_locations(
+      [info["birth_location"][i], info["death_location"][i]]))
+    counts["manager"][info["manager_num"][i]] += 1
+    if birth_dates[i]:
+      birth_years.append(birth_dates[i].year)
 
   for type in counts.keys():
     utils.log(f"Most common {type}:")
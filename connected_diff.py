@@ -9,6 +9,8 @@ import partition_tools
 from pathlib import Path
 import random
 
+import numpy as np
+
 
 def load_connection_status(use_dump_conn, version, debug_limit_read=None):
   connected = set()
@@ -16,14 +18,13 @@ def load_connection_status(use_dump_conn, version, debug_limit_read=None):
   if use_dump_conn:
     # Use computed network connectivity from data dump
     p_db = partition_tools.PartitionDb(version)
-    main_component_rep = p_db.main_component_rep("connected")
-    for row in p_db.enum_all("connected"):
-      if row["rep"] == main_component_rep:
-        connected.add(row["user_num"])
-      else:
-        unconnected.add(row["user_num"])
-      if debug_limit_read and len(unconnected) + len(connected) >= debug_limit_read:
-        return connected, unconnected
+    in_main = p_db.partition_mask("connected", p_db.main_component_rep("connected"))
+    indexes = np.flatnonzero(np.asarray(p_db.partition("connected").rep) >= 0)
+    if debug_limit_read:
+      indexes = indexes[:debug_limit_read]
+    user_nums = p_db.index.user_nums
+    connected.update(user_nums[indexes[in_main[indexes]]].tolist())
+    unconnected.update(user_nums[indexes[~in_main[indexes]]].tolist())
   else:
     # Use boolean in the data dump
     with open(Path("data", "version", version, "dump_people_users.csv"), "r") as f:
@@ -5,18 +5,66 @@ Find all of the shortest length connections between two people.
 
 import argparse
 import collections
+import contextlib
+import csv
+import itertools
+import json
 import random
 import sys
 import time
 
 import graphviz
+import numpy as np
 
 import category_tools
+import csr_tools
 import data_reader
 import partition_tools
 
 
-class Bfs(object):
+class BfsPaths(object):
+  """Path enumeration over the DAG of shortest paths found by a BFS.
+
+  Subclasses provide self.start, preds(person) (neighbors of person on
+  shortest paths to start) and count_paths(person).
+  """
+  def get_out_paths(self, person):
+    """Lazily enumerate paths self.start -> person (not including person)."""
+    if person == self.start:
+      yield []
+      return
+    # Depth-first walk back towards start. back[k] is at dist(person) - 1 - k.
+    back = []
+    stack = [iter(self.preds(person))]
+    while stack:
+      prev = next(stack[-1], None)
+      if prev is None:
+        stack.pop()
+        if back:
+          back.pop()
+      elif prev == self.start:
+        yield [prev] + back[::-1]
+      else:
+        back.append(prev)
+        stack.append(iter(self.preds(prev)))
+
+  def get_in_paths(self, person):
+    """Get a path from person -> self.start (not including person)."""
+    for path in self.get_out_paths(person):
+      yield list(reversed(path))
+
+  def sample_out_path(self, person, rng=random):
+    """Uniformly random path self.start -> person (not including person)."""
+    back = []
+    while person != self.start:
+      preds = self.preds(person)
+      # Weight each predecessor by the number of paths through it.
+      person = rng.choices(preds, [self.count_paths(prev) for prev in preds])[0]
+      back.append(person)
+    return back[::-1]
+
+
+class Bfs(BfsPaths):
   def __init__(self, db, start, rel_types):
     self.db = db
     self.start = start
@@ -24,6 +72,8 @@ class Bfs(object):
     self.dists = {start: 0}
     # Dict { person : [list of neighbors of person on shortest paths to start] }
     self.paths = {start: []}
+    # Dict { person : # shortest paths start -> person } (filled in lazily)
+    self.num_paths = {start: 1}
     self.todo = [start]
     self.num_steps = 0
 
@@ -45,31 +95,193 @@ class Bfs(object):
           yield neigh
     self.todo = next_todo
 
-  def get_out_paths(self, person):
-    """Get a path from self.start -> person (not including person)."""
-    if person == self.start:
-      yield []
-    else:
-      for next in self.paths[person]:
-        for path in self.get_out_paths(next):
-          yield path + [next]
-
+  def preds(self, person):
+    return self.paths[person]
+
+  def count_paths(self, person):
+    """Number of shortest paths self.start -> person (DP over self.paths)."""
+    if person not in self.num_paths:
+      self.num_paths[person] = sum(self.count_paths(prev)
+                                   for prev in self.paths[person])
+    return self.num_paths[person]
+
+
+class ArrayBfs(BfsPaths):
+  """Bfs over the memory-mapped csr_tools.Adjacency (no SQLite queries).
+
+  People are tracked by dense index. Only dense distance and path count arrays
+  are stored, predecessors on shortest paths are looked up lazily (neighbors
+  at dist - 1) when enumerating paths.
+  """
+  def __init__(self, adjacency, start, rel_types):
+    self.adjacency = adjacency
+    self.start = adjacency.index_of(start)
+    self.rel_mask = adjacency.rel_mask(rel_types)
+    # p is a predecessor of x if p -> x is an allowed relationship, which is
+    # stored in the adjacency as x -> p with the reverse relationship type.
+    self.pred_mask = adjacency.rel_mask(
+      [csr_tools.REVERSE_RELATIONSHIP[rel] for rel in rel_types])
+    self.dists = np.full(adjacency.num_people, -1, dtype=np.int16)
+    self.dists[self.start] = 0
+    # Number of shortest paths start -> each person. Note: float since counts
+    # can overflow int64 in densely intermarried trees.
+    self.num_paths = np.zeros(adjacency.num_people, dtype=np.float64)
+    self.num_paths[self.start] = 1
+    self.todo = np.array([self.start])
+    self.num_steps = 0
+    self.num_visited = 1
 
-  def get_in_paths(self, person):
-    """Get a path from person -> self.start (not including person)."""
-    for path in self.get_out_paths(person):
-      yield list(reversed(path))
+  def next_gen(self):
+    """Expand next generation of connections. Returns array of new indexes."""
+    self.num_steps += 1
+    sources, targets = self.adjacency.expand(self.todo, self.rel_mask)
+    is_new = self.dists[targets] == -1
+    sources, targets = sources[is_new], targets[is_new]
+    self.todo = np.unique(targets)
+    self.dists[self.todo] = self.num_steps
+    self.num_visited += len(self.todo)
+    # Path count DP: Sum counts over distinct predecessors of each new person.
+    edges = np.unique(np.stack([targets, sources], axis=1), axis=0)
+    np.add.at(self.num_paths, edges[:, 0], self.num_paths[edges[:, 1]])
+    return self.todo
+
+  def preds(self, person):
+    """Neighbors of person on shortest paths to self.start."""
+    neighbors = self.adjacency.neighbor_indexes(person, self.pred_mask)
+    return np.unique(neighbors[self.dists[neighbors] == self.dists[person] - 1]).tolist()
+
+  def count_paths(self, person):
+    """Number of shortest paths self.start -> person."""
+    return int(self.num_paths[person])
+
+
+class Connections(object):
+  """All shortest paths found by a search, stored as the meeting points of
+  the search (not as a list of paths, since there can be millions).
+
+  Iterating lazily enumerates paths (as lists of user_nums) in depth-first
+  order. sample() returns uniformly random paths instead.
+  """
+  def __init__(self, meetings, user_nums=None):
+    # List of (out_bfs, person, in_bfs) where paths are
+    # out_bfs.start -> person -> in_bfs.start. in_bfs is None for searches
+    # to a group.
+    self.meetings = meetings
+    # If set, paths are of indexes into user_nums (ArrayBfs).
+    self.user_nums = user_nums
+
+  def _path(self, path):
+    if self.user_nums is None:
+      return path
+    return self.user_nums[path].tolist()
+
+  def _meeting_counts(self):
+    return [out_bfs.count_paths(person) *
+            (in_bfs.count_paths(person) if in_bfs else 1)
+            for out_bfs, person, in_bfs in self.meetings]
+
+  @property
+  def num_paths(self):
+    """Total number of shortest paths (without enumerating them)."""
+    return sum(self._meeting_counts())
+
+  def __iter__(self):
+    for out_bfs, person, in_bfs in self.meetings:
+      for path1 in out_bfs.get_out_paths(person):
+        if in_bfs:
+          for path2 in in_bfs.get_in_paths(person):
+            yield self._path(path1 + [person] + path2)
+        else:
+          yield self._path(path1 + [person])
+
+  def sample(self, num_paths, rng=random):
+    """Lazily generate up to num_paths distinct uniformly random paths."""
+    total = self.num_paths
+    if total <= num_paths:
+      # Cheaper to just list them all.
+      yield from self
+      return
+    counts = self._meeting_counts()
+    seen = set()
+    while len(seen) < num_paths:
+      out_bfs, person, in_bfs = rng.choices(self.meetings, counts)[0]
+      path = out_bfs.sample_out_path(person, rng) + [person]
+      if in_bfs:
+        path += in_bfs.sample_out_path(person, rng)[::-1]
+      if tuple(path) not in seen:
+        seen.add(tuple(path))
+        yield self._path(path)
+
+
+def search_connections_array(db, person1, person2, rel_types, max_dist=None,
+                             verbose=True):
+  """Version of search_connections() over db.adjacency arrays."""
+  bfs1 = ArrayBfs(db.adjacency, person1, rel_types)
+  bfs2 = ArrayBfs(db.adjacency, person2, rel_types)
+  meetings = []
+
+  while not (meetings or len(bfs1.todo) == 0 or len(bfs2.todo) == 0):
+    if max_dist and bfs1.num_steps + bfs2.num_steps > max_dist:
+      if verbose:
+        print("No connection found in", max_dist)
+      return Connections([])
+    if len(bfs1.todo) <= len(bfs2.todo):
+      this = bfs1
+      other = bfs2
+    else:
+      this = bfs2
+      other = bfs1
 
+    new = this.next_gen()
+    # We found paths through each of these people.
+    meetings = [(bfs1, person, bfs2)
+                for person in new[other.dists[new] >= 0].tolist()]
+
+  if verbose:
+    print("Evaluated %d (%d around %s) & %d (%d around %s)" % (
+      bfs1.num_visited, bfs1.num_steps, db.num2id(person1), bfs2.num_visited, bfs2.num_steps, db.num2id(person2)))
+  return Connections(meetings, db.adjacency.user_nums)
+
+
+def check_rel_types(rel_types):
+  """Raises ValueError for unknown relationship types."""
+  unknown = set(rel_types) - set(csr_tools.RELATIONSHIP_TYPES)
+  if unknown:
+    raise ValueError(f"Unknown relationship types: {sorted(unknown)}")
+
+def in_adjacency(db, *people):
+  """Are all people in db.adjacency (so array searches can be used)?"""
+  if not db.adjacency:
+    return False
+  try:
+    for person in people:
+      db.adjacency.index_of(person)
+  except KeyError:
+    return False
+  return True
+
+
+def search_connections(db, person1, person2, rel_types=frozenset(["parent", "child", "sibling", "spouse"]), max_dist=None,
+                       verbose=True):
+  """Find all shortest connections between two people. Returns Connections.
+
+  Progress is printed to stdout unless verbose=False (ex: when called from
+  threads which share stdout)."""
+  check_rel_types(rel_types)
+  if in_adjacency(db, person1, person2):
+    return search_connections_array(db, person1, person2, rel_types, max_dist,
+                                    verbose)
+  # Otherwise, one of the people is not in the adjacency. Fall back to SQLite.
 
-def find_connections(db, person1, person2, rel_types=frozenset(["parent", "child", "sibling", "spouse"]), max_dist=None):
   bfs1 = Bfs(db, person1, rel_types)
   bfs2 = Bfs(db, person2, rel_types)
+  meetings = []
 
-  found = False
-  while not (found or len(bfs1.todo) == 0 == len(bfs2.todo)):
+  while not (meetings or len(bfs1.todo) == 0 or len(bfs2.todo) == 0):
     if max_dist and bfs1.num_steps + bfs2.num_steps > max_dist:
-      print("No connection found in", max_dist)
-      return
+      if verbose:
+        print("No connection found in", max_dist)
+      return Connections([])
     if len(bfs1.todo) <= len(bfs2.todo):
       this = bfs1
       other = bfs2
@@ -80,62 +292,216 @@ def find_connections(db, person1, person2, rel_types=frozenset(["parent", "child
     for person in this.next_gen():
       if person in other.paths:
         # We found a path
-        found = True
-        for path1 in bfs1.get_out_paths(person):
-          for path2 in bfs2.get_in_paths(person):
-            yield path1 + [person] + path2
+        meetings.append((bfs1, person, bfs2))
 
-  print("Evaluated %d (%d around %s) & %d (%d around %s)" % (
-    len(bfs1.paths), bfs1.num_steps, db.num2id(person1), len(bfs2.paths), bfs2.num_steps, db.num2id(person2)))
+  if verbose:
+    print("Evaluated %d (%d around %s) & %d (%d around %s)" % (
+      len(bfs1.paths), bfs1.num_steps, db.num2id(person1), len(bfs2.paths), bfs2.num_steps, db.num2id(person2)))
+  return Connections(meetings)
 
 
-def find_connections_group(db, start, group,
-                           rel_types=frozenset(["parent", "child", "sibling", "spouse"])):
+def find_connections(db, person1, person2, rel_types=frozenset(["parent", "child", "sibling", "spouse"]), max_dist=None,
+                     verbose=True):
+  """Lazily enumerate all shortest connections between two people."""
+  yield from search_connections(db, person1, person2, rel_types, max_dist,
+                                verbose)
+
+
+def search_connections_group_array(db, start, group, rel_types):
+  """Version of search_connections_group() over db.adjacency arrays."""
+  adjacency = db.adjacency
+  bfs = ArrayBfs(adjacency, start, rel_types)
+  if isinstance(group, np.ndarray):
+    group_indexes = adjacency.indexes_of(group)
+  else:
+    group_indexes = adjacency.indexes_of(np.fromiter(group, dtype=np.int64, count=len(group)))
+  in_group = np.zeros(adjacency.num_people, dtype=bool)
+  in_group[group_indexes[group_indexes >= 0]] = True
+  meetings = []
+
+  while not (meetings or len(bfs.todo) == 0):
+    new = bfs.next_gen()
+    # We found paths to each of these people.
+    meetings = [(bfs, person, None) for person in new[in_group[new]].tolist()]
+
+  print("Evaluated %d (%d around %s)" % (
+    bfs.num_visited, bfs.num_steps, db.num2id(start)))
+  return Connections(meetings, adjacency.user_nums)
+
+
+def search_connections_group(db, start, group,
+                             rel_types=frozenset(["parent", "child", "sibling", "spouse"])):
+  """Find all shortest connections from start to any member of group
+  (a set or array of user_nums). Returns Connections."""
+  check_rel_types(rel_types)
+  if in_adjacency(db, start):
+    return search_connections_group_array(db, start, group, rel_types)
+  # Otherwise, start is not in the adjacency. Fall back to SQLite.
+
+  if isinstance(group, np.ndarray):
+    group = frozenset(group.tolist())
   bfs = Bfs(db, start, rel_types)
+  meetings = []
 
-  found = False
-  while not (found or len(bfs.todo) == 0):
+  while not (meetings or len(bfs.todo) == 0):
     for person in bfs.next_gen():
       if person in group:
         # We found a path
-        found = True
-        for path in bfs.get_out_paths(person):
-          yield path + [person]
+        meetings.append((bfs, person, None))
 
   print("Evaluated %d (%d around %s)" % (
     len(bfs.paths), bfs.num_steps, db.num2id(start)))
+  return Connections(meetings)
 
 
-def print_connections(args, db, connections, plot_name=None):
+def find_connections_group(db, start, group,
+                           rel_types=frozenset(["parent", "child", "sibling", "spouse"])):
+  """Lazily enumerate all shortest connections from start to group."""
+  yield from search_connections_group(db, start, group, rel_types)
+
+
+def add_path_arguments(parser):
+  """Arguments controlling which paths print_connections() shows and how."""
+  parser.add_argument("--max-paths", type=int,
+                      help="Maximum number of paths to show (default all).")
+  parser.add_argument("--random-paths", action="store_true",
+                      help="Show uniformly random paths (rather than the first found). "
+                           "Requires --max-paths.")
+  parser.add_argument("--seed", type=int,
+                      help="Random seed for --random-paths.")
+  parser.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                      help="Output format for paths. For json and csv, progress "
+                           "messages are written to stderr.")
+
+
+# Number of paths to fetch attributes for at once.
+PATH_BATCH_SIZE = 1_000
+PERSON_ATTRIBUTES = ["wikitree_id", "birth_name", "birth_date", "death_date"]
+
+class PathTables(object):
+  """In-memory tables of person attributes and relationship types for
+  rendering paths. Filled in bulk for a whole batch of paths at a time
+  (instead of several queries per step of each path)."""
+  def __init__(self, db):
+    self.db = db
+    # Dict { user_num : {attribute : value} }
+    self.people = {}
+    # Dict { (user_num, relative_num) : relationship type }
+    self.rel_types = {}
+
+  def add_paths(self, paths):
+    new_people = list({user_num for path in paths for user_num in path}
+                      - self.people.keys())
+    if new_people:
+      info = self.db.get_mult(new_people, PERSON_ATTRIBUTES)
+      for i, user_num in enumerate(new_people):
+        self.people[user_num] = {attr: info[attr][i] for attr in PERSON_ATTRIBUTES}
+    new_edges = list({edge for path in paths for edge in zip(path, path[1:])}
+                     - self.rel_types.keys())
+    if new_edges:
+      self.rel_types.update(zip(new_edges, self.db.relationship_types(new_edges)))
+
+  def steps(self, path):
+    """List of {relationship, user_num, attributes...} for each person in path."""
+    steps = []
+    prev_user = None
+    for user_num in path:
+      steps.append({
+        "relationship": self.rel_types[prev_user, user_num] if prev_user else None,
+        "user_num": user_num,
+        **self.people[user_num],
+      })
+      prev_user = user_num
+    return steps
+
+
+def iter_steps(db, paths):
+  """Lazily convert paths (lists of user_nums) into lists of steps (see
+  PathTables.steps), looking up a batch of paths at a time."""
+  paths = iter(paths)
+  tables = PathTables(db)
+  while batch := list(itertools.islice(paths, PATH_BATCH_SIZE)):
+    tables.add_paths(batch)
+    for path in batch:
+      yield tables.steps(path)
+
+def connections_json(num_paths, paths, include_paths=True):
+  """JSON output for connections (shared by --format json and query_server).
+  paths is a list of steps for each path shown."""
+  return {
+    "num_paths": num_paths,
+    "distance": len(paths[0]) - 1 if paths else None,
+    "paths": paths if include_paths else [],
+  }
+
+
+def print_connections(args, db, connections, plot_name=None, csv_header=True):
   if args.plot:
     dot = graphviz.Digraph(name=plot_name)
     nodes = set()
     edges = set()
 
-  for i, connection in enumerate(connections):
-    print("Distance", len(connection) - 1)
+  num_paths = connections.num_paths
+  if args.max_paths is None:
+    num_shown = num_paths
+    paths = iter(connections)
+  else:
+    num_shown = min(args.max_paths, num_paths)
+    if args.random_paths:
+      paths = connections.sample(num_shown, random.Random(args.seed))
+    else:
+      paths = itertools.islice(connections, num_shown)
+  if args.distance_only:
+    paths = itertools.islice(paths, 1)
+    num_shown = min(num_shown, 1)
+
+  if args.format == "text":
     if args.distance_only:
-      break
+      print(f"{num_paths:,} shortest paths")
     else:
-      print("Connection", i + 1)
-      prev_user = None
-      for dist, user_num in enumerate(connection):
-        rel_type = db.relationship_type(prev_user, user_num) if prev_user else ""
-        print(" (%3d)  %-8s %-20s %-20s %-11s %-11s" % (dist, rel_type, db.num2id(user_num), db.name_of(user_num), db.get(user_num, "birth_date"), db.get(user_num, "death_date")))
-
-        if args.plot:
-          if user_num not in nodes:
-            nodes.add(user_num)
-            dot.node(str(user_num), label=db.num2id(user_num))
-          if prev_user and (prev_user, user_num) not in edges:
-            edges.add((prev_user, user_num))
-            dot.edge(str(prev_user), str(user_num), label=rel_type)
+      print(f"{num_paths:,} shortest paths, showing {num_shown:,}")
+  elif args.format == "json":
+    results = []
+  elif args.format == "csv":
+    writer = csv.writer(sys.stdout)
+    if csv_header:
+      writer.writerow(["path", "step", "relationship", "user_num"] + PERSON_ATTRIBUTES)
+
+  for i, steps in enumerate(iter_steps(db, paths), 1):
+    if args.format == "json":
+      results.append(steps)
+    elif args.format == "csv":
+      for dist, step in enumerate(steps):
+        writer.writerow([i, dist, step["relationship"], step["user_num"]] +
+                        [step[attr] for attr in PERSON_ATTRIBUTES])
+    else:
+      print("Distance", len(steps) - 1)
+      if args.distance_only:
+        break
+      print("Connection", i)
+      for dist, step in enumerate(steps):
+        print(" (%3d)  %-8s %-20s %-20s %-11s %-11s" % (dist, step["relationship"] or "", step["wikitree_id"], step["birth_name"], step["birth_date"], step["death_date"]))
+      print()
 
+    if args.plot:
+      prev_user = None
+      for step in steps:
+        user_num = step["user_num"]
+        if user_num not in nodes:
+          nodes.add(user_num)
+          dot.node(str(user_num), label=step["wikitree_id"])
+        if prev_user and (prev_user, user_num) not in edges:
+          edges.add((prev_user, user_num))
+          dot.edge(str(prev_user), str(user_num), label=step["relationship"])
         prev_user = user_num
 
-      print()
-
-  print()
+  if args.format == "json":
+    json.dump(connections_json(num_paths, results,
+                               include_paths=not args.distance_only),
+              sys.stdout)
+    print()
+  elif args.format == "text":
+    print()
 
   if args.plot:
     dot.view()
@@ -151,13 +517,14 @@ def main():
   parser.add_argument("--distance-only", action="store_true",
                       help="Only print the distance (not connection sequence).")
   parser.add_argument("--max-dist", type=int)
+  add_path_arguments(parser)
 
   parser.add_argument("--to-category",
                       help="Destination is a category rather than specific person.")
   parser.add_argument("--to-partition",
                       help="Destination is partition rather than specific person.")
 
-  parser.add_argument("--rel-types", nargs='+', default=frozenset(["parent", "child", "sibling", "spouse"]))
+  parser.add_argument("--rel-types", nargs='+', choices=csr_tools.RELATIONSHIP_TYPES, default=frozenset(["parent", "child", "sibling", "spouse"]))
   parser.add_argument("--genetic", dest="rel_types", action="store_const", const=frozenset(["parent", "child"]),
                       help="Only consider genetic connections (exclude marriage).")
   parser.add_argument("--sibling-in-law", dest="rel_types", action="store_const", const=frozenset(["sibling", "spouse"]),
@@ -165,18 +532,21 @@ def main():
   args = parser.parse_args()
 
   db = data_reader.Database(args.version)
+  # Keep stdout parseable for json and csv formats.
+  progress = sys.stdout if args.format == "text" else sys.stderr
 
   if args.to_category:
     # Find shortest connection from person to any member of a category.
     category_db = category_tools.CategoryDb(args.version)
     category_members = category_db.list_people_in_category(args.to_category)
-    for start_id in args.person_id:
+    for i, start_id in enumerate(args.person_id):
       start_num = db.get_person_num(start_id)
-      print("Connections from", db.num2id(start_num), "to category", args.to_category)
+      print("Connections from", db.num2id(start_num), "to category", args.to_category, file=progress)
       plot_name = "results/Connections_%s_%s" % (start_id, args.to_category)
-      connections = find_connections_group(
-        db, start_num, category_members, args.rel_types)
-      print_connections(args, db, connections, plot_name)
+      with contextlib.redirect_stdout(progress):
+        connections = search_connections_group(
+          db, start_num, category_members, args.rel_types)
+      print_connections(args, db, connections, plot_name, csv_header=(i == 0))
 
   elif args.to_partition:
     # Find shortest connection from person to any member of a partition.
@@ -184,26 +554,28 @@ def main():
     partition_type, member_id = args.to_partition.split(":")
     member_num = db.id2num(member_id)
     rep = partition_db.find_partition_rep(partition_type, member_num)
-    partition_members = partition_db.list_partition(partition_type, rep)
-    for start_id in args.person_id:
+    partition_members = partition_db.partition_user_nums(partition_type, rep)
+    for i, start_id in enumerate(args.person_id):
       start_num = db.get_person_num(start_id)
-      print("Connections from", db.num2id(start_num), "to partition", args.to_partition)
+      print("Connections from", db.num2id(start_num), "to partition", args.to_partition, file=progress)
       plot_name = "results/Connections_%s_%s" % (start_id, args.to_partition)
-      connections = find_connections_group(
-        db, start_num, partition_members, args.rel_types)
-      print_connections(args, db, connections, plot_name)
+      with contextlib.redirect_stdout(progress):
+        connections = search_connections_group(
+          db, start_num, partition_members, args.rel_types)
+      print_connections(args, db, connections, plot_name, csv_header=(i == 0))
 
   else:
     # Find shortest connection between two people.
     for i in range(len(args.person_id) - 1):
       start_num = db.get_person_num(args.person_id[i])
       end_num = db.get_person_num(args.person_id[i + 1])
-      print("Connections from", db.num2id(start_num), "to", db.num2id(end_num))
+      print("Connections from", db.num2id(start_num), "to", db.num2id(end_num), file=progress)
       plot_name = "results/Connections_%s_%s" % (db.num2id(start_num), db.num2id(end_num))
-      connections = find_connections(db, start_num, end_num,
-                                     args.rel_types,
-                                     args.max_dist)
-      print_connections(args, db, connections, plot_name)
+      with contextlib.redirect_stdout(progress):
+        connections = search_connections(db, start_num, end_num,
+                                         args.rel_types,
+                                         args.max_dist)
+      print_connections(args, db, connections, plot_name, csv_header=(i == 0))
 
 if __name__ == "__main__":
   main()
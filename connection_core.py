@@ -15,6 +15,7 @@ parser.add_argument("--plot", action="store_true",
                     help="Produce a DOT plot of connections.")
 parser.add_argument("--distance-only", action="store_true",
                     help="Only print the distance (not connection sequence).")
+connection.add_path_arguments(parser)
 args = parser.parse_args()
 
 print("Loading graph", time.process_time())
@@ -33,7 +34,7 @@ for node in graph.nodes:
 
 db = data_reader.Database(args.version)
 print(f"Connections from {args.wikitree_id} to core (size {len(core_people):,})", time.process_time())
-connections = connection.find_connections_group(
+connections = connection.search_connections_group(
   db=db, start=db.id2num(args.wikitree_id), group=core_people)
 connection.print_connections(args, db, connections)
 
@@ -16,34 +16,67 @@ import time
 import utils
 
 
+# Database for each worker process (see init_worker).
+_db : data_reader.Database | None = None
+
+def init_worker(version : str) -> None:
+  global _db
+  # Note: The adjacency snapshot is memory-mapped, so all workers share the
+  # same pages of it.
+  _db = data_reader.Database(version=version)
+
+def find_distance(db : data_reader.Database, start_num : int, end_num : int,
+                  verbose : bool = True) -> tuple[int, int, int, float]:
+  """Returns (start_num, end_num, dist, seconds)."""
+  start_time = time.time()
+  paths = connection.find_connections(db, start_num, end_num, verbose=verbose)
+  dist = len(next(paths)) - 1
+  return start_num, end_num, dist, time.time() - start_time
+
+def sample_distance(pair : tuple[int, int]) -> tuple[int, int, int, float]:
+  """Worker: find_distance() using this worker's DB.
+  Note: Progress is only logged by the parent (so output is not interleaved)."""
+  assert _db is not None, "init_worker() was not called"
+  return find_distance(_db, *pair, verbose=False)
+
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument("--version", help="Data version (defaults to most recent).")
   parser.add_argument("--load-db", action="store_true")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="Number of worker processes to sample distances in.")
   args = parser.parse_args()
 
   utils.log("Load DB")
   db = data_reader.Database(version=args.version)
-  if args.load_db:
+  if args.workers > 1:
+    assert db.adjacency, "--workers requires adjacency snapshot (run csr_tools.py)"
+  elif args.load_db:
     db.load_connections()
   partition_db = partition_tools.PartitionDb(version=args.version)
 
   utils.log("Loading all user_nums in main tree")
   focus_id = db.id2num("Lothrop-29")
   rep = partition_db.find_partition_rep("connected", focus_id)
-  main_nums = list(partition_db.list_partition("connected", rep))
+  main_nums = partition_db.partition_user_nums("connected", rep)
   utils.log(f"Loaded {len(main_nums):_} nodes")
 
+  pairs = ((int(random.choice(main_nums)), int(random.choice(main_nums)))
+           for _ in itertools.count())
+  if args.workers > 1:
+    utils.log(f"Sampling with {args.workers} workers")
+    samples = utils.parallel_imap(sample_distance, pairs, args.workers,
+                                  initializer=init_worker,
+                                  initargs=(args.version,))
+  else:
+    samples = (find_distance(db, *pair) for pair in pairs)
+
   hist = collections.Counter()
   total = 0
   total2 = 0
-  for i in itertools.count():
-    start_time = time.time()
-    start_num = random.choice(main_nums)
-    end_num = random.choice(main_nums)
-    paths = connection.find_connections(db, start_num, end_num)
-    dist = len(next(paths)) - 1
-    utils.log(f"Distance {i}: {start_num} -> {end_num} = {dist} ({time.time() - start_time:.1f}s)")
+  for i, (start_num, end_num, dist, seconds) in enumerate(samples):
+    utils.log(f"Distance {i}: {start_num} -> {end_num} = {dist} ({seconds:.1f}s)")
 
     hist[dist] += 1
     total += dist
@@ -54,4 +87,5 @@ def main():
     utils.log(f"Mean dist = {mean:.1f} ± {stddev:.1f}")
     utils.log("Dist", [hist[i] for i in range(max(hist.keys()) + 1)])
 
-main()
+if __name__ == "__main__":
+  main()
@@ -42,8 +42,7 @@ def main():
   descendants = load_descendants(db, start_num)
 
   descendants_born_in_centuries = collections.Counter()
-  for person in descendants:
-    birth_date = db.birth_date_of(person)
+  for birth_date in db.birth_dates_of(descendants):
     if birth_date:
       birth_year = birth_date.year
       birth_century = (birth_year // 100) * 100
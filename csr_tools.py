@@ -0,0 +1,230 @@
+"""
+Compact CSR (compressed sparse row) snapshot of the relationship graph.
+
+The snapshot is built once per dump from rel_all.parquet and stored as a few
+flat .npy arrays (keyed by the dense person index from index_tools) so that
+readers can memory-map them. This gives any tool whole-graph neighbor access
+in milliseconds without per-person SQLite queries or rebuilding a dict of
+sets from the CSV, and the pages are shared between processes by the OS.
+
+Files (in data/version/{version}/adjacency/):
+ * offsets.npy: int32 [num_people + 1]. Neighbors of index i are stored in
+   neighbors[offsets[i]:offsets[i+1]].
+ * neighbors.npy: int32 dense person indexes of each relative.
+ * rel_types.npy: int8 index into RELATIONSHIP_TYPES for each relative.
+"""
+
+import argparse
+from collections.abc import Container, Iterable
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import index_tools
+from sqlite_reader import UserNum
+import utils
+
+
+# Order matters: rel_types.npy stores indexes into this list.
+RELATIONSHIP_TYPES = ["parent", "child", "sibling", "spouse", "coparent"]
+# If A is B's {type}, then B is A's {REVERSE_RELATIONSHIP[type]}.
+REVERSE_RELATIONSHIP = {
+  "parent": "child",
+  "child": "parent",
+  "sibling": "sibling",
+  "spouse": "spouse",
+  "coparent": "coparent",
+}
+
+
+def expand_slots(offsets : np.ndarray, frontier : np.ndarray
+                 ) -> tuple[np.ndarray, np.ndarray]:
+  """Gather all CSR slots of a whole frontier of rows at once.
+
+  Returns parallel arrays (rows, positions) with one entry per slot, where
+  positions index the CSR value arrays (Ex: neighbors).
+  """
+  starts = offsets[frontier].astype(np.int64)
+  counts = offsets[frontier + 1] - starts
+  # Position of every slot: starts[i] + (0, 1, ..., counts[i] - 1)
+  slot_starts = np.cumsum(counts) - counts
+  positions = (np.arange(counts.sum()) + np.repeat(starts - slot_starts, counts))
+  return np.repeat(frontier, counts), positions
+
+def union_labels(labels : np.ndarray, sources : np.ndarray,
+                 targets : np.ndarray) -> None:
+  """Vectorized union-find: Merge the components of each (source, target)
+  pair, in place.
+
+  labels must start as the identity (or the output of a previous call).
+  Afterwards every labels[i] is the smallest index in i's component.
+  Can be called repeatedly to stream edges through in batches.
+  """
+  while True:
+    source_labels, target_labels = labels[sources], labels[targets]
+    merge = source_labels != target_labels
+    if not merge.any():
+      return
+    source_labels, target_labels = source_labels[merge], target_labels[merge]
+    sources, targets = sources[merge], targets[merge]
+    # Hook larger root onto smaller root.
+    np.minimum.at(labels, np.maximum(source_labels, target_labels),
+                  np.minimum(source_labels, target_labels))
+    # Path compression: Point everyone directly at their root.
+    while True:
+      grand_labels = labels[labels]
+      if np.array_equal(grand_labels, labels):
+        break
+      labels[:] = grand_labels
+
+
+def adjacency_dir(data_dir : Path) -> Path:
+  return Path(data_dir, "adjacency")
+
+
+class Adjacency:
+  """Memory-mapped read-only view of the CSR snapshot."""
+  def __init__(self, directory : Path, index : index_tools.IndexMap) -> None:
+    self.directory = Path(directory)
+    self.index = index
+    self.user_nums = index.user_nums
+    self.offsets = np.load(self.directory / "offsets.npy", mmap_mode="r")
+    self.neighbors = np.load(self.directory / "neighbors.npy", mmap_mode="r")
+    self.rel_types = np.load(self.directory / "rel_types.npy", mmap_mode="r")
+
+  @property
+  def num_people(self) -> int:
+    return len(self.user_nums)
+
+  def index_of(self, user_num : UserNum) -> int:
+    """Dense index of user_num. Raises KeyError if unknown."""
+    return self.index.index_of(user_num)
+
+  def indexes_of(self, user_nums : Iterable[UserNum]) -> np.ndarray:
+    """Vectorized index_of. Unknown user_nums are mapped to -1."""
+    return self.index.indexes_of(user_nums)
+
+  def rel_mask(self, relationship_types : Container[str]) -> np.ndarray:
+    """Boolean mask over RELATIONSHIP_TYPES codes for filtering rel_types."""
+    return np.array([rel in relationship_types for rel in RELATIONSHIP_TYPES])
+
+  def neighbor_indexes(self, index : int,
+                       rel_mask : np.ndarray | None = None) -> np.ndarray:
+    start, end = self.offsets[index], self.offsets[index + 1]
+    neighbors = self.neighbors[start:end]
+    if rel_mask is not None:
+      neighbors = neighbors[rel_mask[self.rel_types[start:end]]]
+    return neighbors
+
+  def expand(self, frontier : np.ndarray, rel_mask : np.ndarray | None = None
+             ) -> tuple[np.ndarray, np.ndarray]:
+    """Gather all relationships out of a whole frontier of indexes at once.
+
+    Returns parallel arrays (sources, targets) with one entry per relationship.
+    """
+    sources, positions = expand_slots(self.offsets, frontier)
+    targets = self.neighbors[positions]
+    if rel_mask is not None:
+      keep = rel_mask[self.rel_types[positions]]
+      sources, targets = sources[keep], targets[keep]
+    return sources, targets
+
+  def relationship_codes(self, sources : np.ndarray, targets : np.ndarray
+                         ) -> np.ndarray:
+    """Vectorized lookup of the RELATIONSHIP_TYPES code of each
+    (source, target) pair of indexes (-1 if not related)."""
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    if not len(self.neighbors):
+      return np.full(len(sources), -1, dtype=np.int8)
+    # Binary search for each target within its (sorted) row of neighbors.
+    lo = self.offsets[sources].astype(np.int64)
+    hi = self.offsets[sources + 1].astype(np.int64)
+    ends = hi.copy()
+    while True:
+      active = lo < hi
+      if not active.any():
+        break
+      mid = (lo + hi) // 2
+      go_right = active & (self.neighbors[np.minimum(mid, len(self.neighbors) - 1)] < targets)
+      lo = np.where(go_right, mid + 1, lo)
+      hi = np.where(active & ~go_right, mid, hi)
+    positions = np.minimum(lo, len(self.neighbors) - 1)
+    found = (lo < ends) & (self.neighbors[positions] == targets)
+    return np.where(found, self.rel_types[positions], -1).astype(np.int8)
+
+  def relatives_of(self, user_num : UserNum,
+                   rel_mask : np.ndarray | None = None) -> frozenset[UserNum]:
+    try:
+      index = self.index_of(user_num)
+    except KeyError:
+      return frozenset()
+    neighbors = self.neighbor_indexes(index, rel_mask)
+    return frozenset(self.user_nums[neighbors].tolist())
+
+  def neighbors_of(self, user_num : UserNum) -> frozenset[UserNum]:
+    return self.relatives_of(user_num)
+
+
+def load_adjacency(version : str,
+                   index : index_tools.IndexMap | None = None) -> Adjacency | None:
+  """Load CSR snapshot for version if it has been built."""
+  directory = adjacency_dir(utils.data_version_dir(version))
+  if index is None:
+    index = index_tools.load_index(version)
+  if index and (directory / "rel_types.npy").exists():
+    return Adjacency(directory, index)
+  return None
+
+
+def build_adjacency(data_dir : Path) -> None:
+  utils.log("Loading relationships")
+  rels = pq.read_table(Path(data_dir, "rel_all.parquet"),
+                       columns=["user_num", "relative_num", "relationship"])
+  utils.log(f"  Loaded {rels.num_rows:_} relationships")
+  rel_users = rels.column("user_num").to_numpy()
+  rel_relatives = rels.column("relative_num").to_numpy()
+  # Note: The index includes everyone mentioned in rels.
+  user_nums = np.asarray(index_tools.build_index(data_dir).user_nums)
+  num_people = len(user_nums)
+
+  rel_codes = pc.index_in(rels.column("relationship"),
+                          value_set=pa.array(RELATIONSHIP_TYPES))
+  assert rel_codes.null_count == 0, "Unexpected relationship type"
+  rel_types = rel_codes.to_numpy().astype(np.int8)
+  del rel_codes
+
+  src = np.searchsorted(user_nums, rel_users)
+  dst = np.searchsorted(user_nums, rel_relatives)
+  del rels, rel_users, rel_relatives
+  order = np.lexsort((dst, src))
+  src, dst, rel_types = src[order], dst[order], rel_types[order]
+  del order
+
+  assert len(dst) < 2**31, len(dst)
+  offsets = np.zeros(num_people + 1, dtype=np.int32)
+  np.cumsum(np.bincount(src, minlength=num_people), out=offsets[1:])
+  utils.log(f"Built CSR with {len(dst):_} relationships")
+
+  out_dir = adjacency_dir(data_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  np.save(out_dir / "offsets.npy", offsets)
+  np.save(out_dir / "neighbors.npy", dst.astype(np.int32))
+  # Written last so that load_adjacency() only sees complete snapshots.
+  np.save(out_dir / "rel_types.npy", rel_types)
+  utils.log(f"Wrote adjacency snapshot to {str(out_dir)}")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  args = parser.parse_args()
+
+  data_dir = utils.data_version_dir(args.version)
+  build_adjacency(data_dir)
+
+if __name__ == "__main__":
+  main()
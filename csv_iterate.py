@@ -3,6 +3,10 @@ import datetime
 from pathlib import Path
 from typing import Iterator
 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+
 import utils
 
 
@@ -226,6 +230,91 @@ def iterate_marriages(*, version : str, only_custom : bool = False) -> Iterator[
     yield marriage
 
 
+# Streaming column-projected batch readers.
+#
+# Instead of wrapping every row in a Row and parsing every field through
+# Python, these parse only the requested columns (in C++, via Arrow) and
+# yield pyarrow.RecordBatch objects. Use batch.column(name).to_numpy() or
+# .to_pylist() to get at values.
+#
+# Note: Unlike the Row accessors, missing values (empty fields) are null,
+# but "0"s are kept as 0 (Ex: for Father/Mother).
+
+# Types for columns which Arrow would not infer correctly. Dates are left as
+# strings (see csv_to_parquet.parse_wikitree_dates).
+COLUMN_TYPES = {
+  "User ID": pa.int64(),
+  "Father": pa.int64(),
+  "Mother": pa.int64(),
+  "Manager": pa.int64(),
+  "Gender": pa.int64(),
+  "Edit Count": pa.int64(),
+  "Privacy": pa.int64(),
+  "No Children": pa.bool_(),
+  "No Siblings": pa.bool_(),
+  "Touched": pa.timestamp("s"),
+  "Registration": pa.timestamp("s"),
+  "Birth Date": pa.string(),
+  "Death Date": pa.string(),
+  "User ID1": pa.int64(),
+  "UserID2": pa.int64(),
+  "Marriage Date": pa.string(),
+}
+
+# Bytes of CSV per batch.
+BATCH_BLOCK_SIZE = 16 << 20
+
+def iterate_batches_file(filename : Path, columns : list[str]
+                         ) -> Iterator[pa.RecordBatch]:
+  """Stream batches of only the requested columns. Columns missing from the
+  file (Ex: in custom_users.csv) are all null."""
+  reader = pa.csv.open_csv(filename,
+    read_options=pa.csv.ReadOptions(block_size=BATCH_BLOCK_SIZE),
+    parse_options=pa.csv.ParseOptions(delimiter="\t", quote_char=False),
+    convert_options=pa.csv.ConvertOptions(
+      include_columns=columns,
+      include_missing_columns=True,
+      column_types={name: COLUMN_TYPES.get(name, pa.string())
+                    for name in columns},
+      # Nonstandard formats used in dump. Like 19991231235959
+      timestamp_parsers=["%Y%m%d%H%M%S"],
+    ))
+  for batch in reader:
+    yield batch
+
+def iterate_users_batches(*, version : str, columns : list[str],
+                          only_custom : bool = False
+                          ) -> Iterator[pa.RecordBatch]:
+  """Batch version of iterate_users()."""
+  read_columns = columns if "User ID" in columns else columns + ["User ID"]
+  custom_user_nums : list[pa.Array] = []
+  # Note: We don't use version dir for custom_users. Just use global one.
+  for batch in iterate_batches_file(Path("data/custom_users.csv"), read_columns):
+    custom_user_nums.append(batch.column("User ID"))
+    yield batch.select(columns)
+
+  if not only_custom:
+    custom_set = pa.concat_arrays(custom_user_nums) if custom_user_nums \
+                 else pa.array([], pa.int64())
+    for batch in iterate_batches_file(Path(utils.data_version_dir(version),
+                                           "dump_people_users.csv"),
+                                      read_columns):
+      # Ignore "official" versions of any custom defined users.
+      batch = batch.filter(pc.invert(pc.is_in(batch.column("User ID"),
+                                              value_set=custom_set)))
+      yield batch.select(columns)
+
+def iterate_marriages_batches(*, version : str, columns : list[str],
+                              only_custom : bool = False
+                              ) -> Iterator[pa.RecordBatch]:
+  """Batch version of iterate_marriages()."""
+  if not only_custom:
+    yield from iterate_batches_file(Path(utils.data_version_dir(version),
+                                         "dump_people_marriages.csv"), columns)
+  # Note: We don't use version dir for custom_users. Just use global one.
+  yield from iterate_batches_file(Path("data/custom_marriages.csv"), columns)
+
+
 if __name__ == "__main__":
   import sys
   import time
@@ -1,61 +1,109 @@
+"""
+Partition people into connected components:
+ * connected: Connected by any relationships (parent, child, sibling, spouse).
+ * sibling_in_law: Connected by only sibling and spouse relationships.
+
+Both are computed in one streaming pass of vectorized union-find over the
+parent columns of people.parquet and the spouse columns of marriages.parquet,
+so no graph of relationships (with its O(siblings^2) edges) is built.
+People with no relationships of the given kind are not in any partition.
+"""
+
 import argparse
-import collections
+from pathlib import Path
+from typing import Iterator
 
-import data_reader
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import csr_tools
+import index_tools
 import partition_tools
+import utils
 
 
-def connected_to(start, connections):
-  """BFS and return set of all people connected to start."""
-  todos = collections.deque()
-  todos.append(start)
-  visited = set([start])
-  while todos:
-    person = todos.popleft()
-    for neigh in connections[person]:
-      if neigh not in visited:
-        todos.append(neigh)
-        visited.add(neigh)
-  return visited
-
-
-def get_connection_partitions(connections):
-  """Partition people into groups based on who is connected to who.
-
-  Returns a map {representative -> set(members)}
-  """
-  partitions = {}
-  visited = set()
-  for person in connections:
-    if person not in visited:
-      partition = connected_to(person, connections)
-      visited.update(partition)
-      rep = min(partition)
-      partitions[rep] = partition
-  return partitions
+# Number of rows to read from Parquet at once (bounds temporary memory).
+BATCH_SIZE = 4_000_000
 
-if __name__ == "__main__":
+def _int64s(array : pa.Array) -> np.ndarray:
+  """int64 numpy array of values (0 for missing)."""
+  return array.fill_null(0).to_numpy().astype(np.int64)
+
+def iterate_columns(filename : Path, columns : list[str]
+                    ) -> Iterator[list[np.ndarray]]:
+  """Yield int64 arrays of columns for each batch of rows (0 for missing)."""
+  for batch in pq.ParquetFile(filename).iter_batches(batch_size=BATCH_SIZE,
+                                                     columns=columns):
+    yield [_int64s(batch.column(column)) for column in columns]
+
+def _edges(index : index_tools.IndexMap, user_nums : np.ndarray,
+           relative_nums : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Dense indexes of (user, relative) pairs, skipping missing relatives and
+  self relationships."""
+  keep = (relative_nums != 0) & (relative_nums != user_nums)
+  sources = index.indexes_of(user_nums[keep])
+  targets = index.indexes_of(relative_nums[keep])
+  keep = (sources >= 0) & (targets >= 0)
+  return sources[keep], targets[keep]
+
+def _reps(labels : np.ndarray, num_people : int) -> np.ndarray:
+  """Rep of each person's component (-1 for people alone)."""
+  reps = labels[:num_people].copy()
+  sizes = np.bincount(reps, minlength=num_people)
+  reps[sizes[reps] < 2] = -1
+  return reps
+
+def compute_partitions(data_dir : Path, index : index_tools.IndexMap
+                       ) -> tuple[np.ndarray, np.ndarray]:
+  """Returns rep index of each person for (connected, sibling_in_law)."""
+  num_people = index.num_people
+  connected = np.arange(num_people, dtype=np.int32)
+  # Siblings are joined through an extra node (num_people + parent) for each
+  # parent, so that the parents themselves are not joined. These nodes have
+  # larger indexes than all people, so they are never reps.
+  sibling_in_law = np.arange(2 * num_people, dtype=np.int32)
+
+  num_rows = 0
+  for user_nums, father_nums, mother_nums in iterate_columns(
+      Path(data_dir, "people.parquet"), ["user_num", "father_num", "mother_num"]):
+    father_children, fathers = _edges(index, user_nums, father_nums)
+    mother_children, mothers = _edges(index, user_nums, mother_nums)
+    children = np.concatenate([father_children, mother_children])
+    parents = np.concatenate([fathers, mothers])
+    csr_tools.union_labels(connected, children, parents)
+    csr_tools.union_labels(sibling_in_law, children, num_people + parents)
+    num_rows += len(user_nums)
+    utils.log(f"  Joined parents of {num_rows:_} people")
+
+  num_rows = 0
+  for spouse1_nums, spouse2_nums in iterate_columns(
+      Path(data_dir, "marriages.parquet"), ["spouse1", "spouse2"]):
+    spouses1, spouses2 = _edges(index, spouse1_nums, spouse2_nums)
+    csr_tools.union_labels(connected, spouses1, spouses2)
+    csr_tools.union_labels(sibling_in_law, spouses1, spouses2)
+    num_rows += len(spouse1_nums)
+    utils.log(f"  Joined {num_rows:_} marriages")
+
+  return _reps(connected, num_people), _reps(sibling_in_law, num_people)
+
+def main():
   parser = argparse.ArgumentParser()
   parser.add_argument("--version", help="Data version (defaults to most recent).")
-  parser.add_argument("--sibling-in-law", action="store_true")
   args = parser.parse_args()
 
+  data_dir = utils.data_version_dir(args.version)
+  index = index_tools.load_index(args.version)
+  assert index, "Requires person index (run csr_tools.py)"
   partition_db = partition_tools.PartitionDb(args.version)
 
-  if args.sibling_in_law:
-    connections = data_reader.load_connections(version=args.version,
-                                               include_parents=False,
-                                               include_children=False,
-                                               include_siblings=True,
-                                               include_spouses=True)
-    partitions = get_connection_partitions(connections)
-    partition_db.write_partition("sibling_in_law", partitions)
-
-  else:
-    connections = data_reader.load_connections(version=args.version,
-                                               include_parents=True,
-                                               include_children=True,
-                                               include_siblings=True,
-                                               include_spouses=True)
-    partitions = get_connection_partitions(connections)
-    partition_db.write_partition("connected", partitions)
+  utils.log("Computing partitions")
+  connected, sibling_in_law = compute_partitions(data_dir, index)
+  for table, reps in [("connected", connected),
+                      ("sibling_in_law", sibling_in_law)]:
+    partition_db.write_partition_reps(table, reps)
+    utils.log(f"Wrote {table}: {len(np.unique(reps[reps >= 0])):_} partitions "
+              f"of {np.count_nonzero(reps >= 0):_} people")
+
+if __name__ == "__main__":
+  main()
@@ -1,19 +1,45 @@
+"""
+Build the SQLite DB (wikitree_dump.db) used by sqlite_reader.
+
+Note: Despite the name, this now reads the already-produced people.parquet
+and rel_all.parquet (from csv_to_parquet.py and pq_compute_relatives.py)
+rather than re-parsing the CSV dump row by row. Rows are converted in Arrow
+batches and inserted with executemany, and indexes are built after loading.
+
+With --workers > 1, Parquet row groups are split into shards which are
+converted into separate temporary DB files in parallel worker processes and
+then copied into the final DB (with INSERT ... SELECT, no Python involved).
+"""
+
 import argparse
+from collections.abc import Iterable, Iterator
+import multiprocessing
 from pathlib import Path
 import sqlite3
-import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 import csv_iterate
 import utils
 
 
-def csv_to_sqlite(args):
-  data_dir = utils.data_version_dir(args.version)
-  conn = sqlite3.connect(Path(data_dir, "wikitree_dump.db"))
-  c = conn.cursor()
+PEOPLE_COLUMNS = [
+  "user_num", "wikitree_id", "birth_name",
+  "father_num", "mother_num",
+  "birth_date", "death_date",
+  "birth_location", "death_location",
+  "gender_code",
+  "no_more_children", "no_more_siblings",
+  "registered_time", "touched_time",
+  "edit_count", "privacy_level",
+  "manager_num",
+]
 
-  # Create output table.
-  c.execute("""CREATE TABLE people (
+CREATE_TABLES = {
+  "people": """CREATE TABLE people (
     user_num INT, wikitree_id STRING, birth_name STRING,
     father_num INT, mother_num INT,
     birth_date DATE, death_date DATE,
@@ -23,94 +49,280 @@ def csv_to_sqlite(args):
     registered_time TIMESTAMP, touched_time TIMESTAMP,
     edit_count INT, privacy_level INT,
     manager_num INT,
-    PRIMARY KEY (user_num))""")
-  c.execute("CREATE TABLE relationships (user_num INT, relative_num INT, relationship_type ENUM)")
-
-  # Iterate CSV
-  i = 0
-  num_rels = 0
-  utils.log("Loading people from CSV")
-  for person in csv_iterate.iterate_users(version=args.version):
-    try:
-      c.execute("INSERT INTO people VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                (person.user_num(), person.wikitree_id(),
-                 person.birth_name(),
-                 person.father_num(), person.mother_num(),
-                 person.birth_date(), person.death_date(),
-                 person.birth_location(), person.death_location(),
-                 person.gender_code(),
-                 person.no_more_children(), person.no_more_siblings(), #person.no_more_spouses(),
-                 person.registered_time(), person.touched_time(),
-                 person.edit_count(), person.privacy_level(),
-                 person.manager_num()))
-    except Exception as e:
-      print("ERROR inserting person:", person.user_num(), person.row)
-      print(e)
-    child_num = person.user_num()
-    for parent_num in (person.father_num(), person.mother_num()):
-      if parent_num:
-        c.execute("INSERT INTO relationships VALUES (?,?,'parent')",
-                  (child_num, parent_num))
-        c.execute("INSERT INTO relationships VALUES (?,?,'child')",
-                  (parent_num, child_num))
-        num_rels += 2
-
-    i += 1
-    if (i % 1000000) == 0:
-      utils.log(f"People: {i:_} Relationships: {num_rels:_}")
-      conn.commit()
-  utils.log(f"People: {i:_} Relationships: {num_rels:_}")
-  conn.commit()
+    PRIMARY KEY (user_num))""",
+  "relationships": "CREATE TABLE relationships (user_num INT, relative_num INT, relationship_type ENUM)",
+}
 
-  utils.log("Loading marriages from CSV")
-  for marriage in csv_iterate.iterate_marriages(version=args.version):
-    user1, user2 = marriage.user_nums()
-    c.execute("INSERT INTO relationships VALUES (?,?,'spouse')",
-              (user1, user2))
-    c.execute("INSERT INTO relationships VALUES (?,?,'spouse')",
-              (user2, user1))
-    num_rels += 2
-    # Note: We are ignoring the marriage dates.
-  utils.log(f"People: {i:_} Relationships: {num_rels:_}")
-  conn.commit()
+INSERT_ROWS = {
+  # Note: Duplicate user_nums are dropped beforehand (see first_rows()).
+  "people": f"INSERT INTO people VALUES ({','.join('?' * len(PEOPLE_COLUMNS))})",
+  "relationships": "INSERT INTO relationships VALUES (?,?,?)",
+}
+
+PARQUET_FILES = {
+  "people": "people.parquet",
+  "relationships": "rel_all.parquet",
+}
+
+# people.parquet columns which custom_users.csv also has.
+CUSTOM_USER_COLUMNS = ["father_num", "mother_num", "gender_code"]
+
+# Parquet columns needed to produce each table.
+PARQUET_COLUMNS = {
+  "people": [
+    "user_num", "wikitree_id", "name_first_birth", "name_first_preferred",
+    "name_last_birth", "father_num", "mother_num", "birth_date", "death_date",
+    "birth_location", "death_location", "gender_code",
+    "no_more_children", "registered_time", "touched_time",
+    "edit_count", "privacy_code", "manager_num"],
+  "relationships": ["user_num", "relative_num", "relationship"],
+}
+
+
+def connect_for_bulk_load(db_path : Path) -> sqlite3.Connection:
+  conn = sqlite3.connect(db_path)
+  # We are building the DB from scratch, if we crash we just start over,
+  # so there is no need for durability.
+  conn.execute("PRAGMA journal_mode = WAL")
+  conn.execute("PRAGMA synchronous = OFF")
+  conn.execute("PRAGMA temp_store = MEMORY")
+  conn.execute("PRAGMA cache_size = -1000000")  # ~1GB
+  return conn
+
+
+def _empty_to_null(array : pa.Array) -> pa.Array:
+  return pc.if_else(pc.equal(array, pa.scalar("")),
+                    pa.scalar(None, pa.string()), array)
+
+def _column(batch : pa.RecordBatch, name : str, type : pa.DataType) -> pa.Array:
+  """Get column, which may be missing (Ex: in custom_users.csv)."""
+  if name in batch.schema.names:
+    return batch.column(name)
+  return pa.nulls(batch.num_rows).cast(type)
+
+# user_nums of custom users (see custom_user_nums()).
+_custom_user_nums : pa.Array | None = None
+
+def custom_user_nums() -> pa.Array:
+  """user_nums from custom_users.csv (loaded once per process)."""
+  global _custom_user_nums
+  if _custom_user_nums is None:
+    # Note: We don't use version dir for custom_users. Just use global one.
+    batches = [batch.column("User ID") for batch in csv_iterate.iterate_batches_file(
+      Path("data", "custom_users.csv"), ["User ID"])]
+    _custom_user_nums = pa.concat_arrays(batches) if batches \
+                        else pa.array([], pa.int64())
+  return _custom_user_nums
+
+def people_rows(batch : pa.RecordBatch) -> Iterator[tuple]:
+  """Convert a batch of people.parquet into rows of the people table.
+  Values match what the old CSV loader (csv_iterate.UserRow) stored."""
+  user_num = batch.column("user_num")
+  is_custom = pc.is_in(user_num, value_set=custom_user_nums())
+  first_name = (
+    _empty_to_null(_column(batch, "name_first_birth", pa.string()))
+    .fill_null(_empty_to_null(_column(batch, "name_first_preferred", pa.string())))
+    .fill_null("(Unlisted)"))
+  last_name = _column(batch, "name_last_birth", pa.string()).fill_null("")
+  birth_name : pa.Array = pc.binary_join_element_wise(first_name, last_name,
+                                                      pa.repeat(" ", batch.num_rows))
+
+  def dump_num(name : str) -> pa.Array:
+    """The dump uses 0 for "none" (Ex: no parent, no manager, blank gender)
+    and csv_to_parquet converts that to null. Keep storing 0 for
+    compatibility with existing DBs. Custom users do not have most of these
+    columns, so those are left NULL."""
+    values = _column(batch, name, pa.int64())
+    if name in CUSTOM_USER_COLUMNS:
+      return values.fill_null(0)
+    return pc.if_else(is_custom, values, values.fill_null(0))
+
+  def parent(name : str) -> pa.Array:
+    parent_num = dump_num(name)
+    # Ignore people listed as their own parents.
+    return pc.if_else(pc.equal(parent_num, user_num),
+                      pa.scalar(None, parent_num.type), parent_num)
+
+  def as_str(name : str, type : pa.DataType) -> pa.Array:
+    """Dates and timestamps are stored as ISO strings."""
+    values = _column(batch, name, type)
+    if pa.types.is_timestamp(values.type):
+      # Drop sub-second precision: "YYYY-MM-DD HH:MM:SS"
+      values = pc.cast(values, pa.timestamp("s"))
+    return pc.cast(values, pa.string())
 
-  utils.log("Computing siblings")
-  # Siblings are two people who are both children of a third person (share a parent).
-  c.execute("""
-    INSERT INTO relationships SELECT a.relative_num, b.relative_num, 'sibling'
-      FROM relationships AS a,
-           relationships AS b
-      WHERE a.relationship_type = 'child'
-        AND b.relationship_type = 'child'
-        AND a.user_num = b.user_num
-        AND a.relative_num <> b.relative_num""")
+  columns = [
+    user_num,
+    _column(batch, "wikitree_id", pa.string()),
+    birth_name,
+    parent("father_num"),
+    parent("mother_num"),
+    as_str("birth_date", pa.date32()),
+    as_str("death_date", pa.date32()),
+    _empty_to_null(_column(batch, "birth_location", pa.string())),
+    _empty_to_null(_column(batch, "death_location", pa.string())),
+    dump_num("gender_code"),
+    _column(batch, "no_more_children", pa.bool_()).fill_null(False),
+    # Note: no_more_siblings has always been read from "No Children" as well
+    # (see connections_complete_of() in sqlite_reader). Keep that for now.
+    _column(batch, "no_more_children", pa.bool_()).fill_null(False),
+    as_str("registered_time", pa.timestamp("s")),
+    as_str("touched_time", pa.timestamp("s")),
+    dump_num("edit_count"),
+    _column(batch, "privacy_code", pa.int64()),
+    dump_num("manager_num"),
+  ]
+  return zip(*(column.to_pylist() for column in columns))
+
+def relationship_rows(batch : pa.RecordBatch) -> Iterator[tuple]:
+  return zip(batch.column("user_num").to_pylist(),
+             batch.column("relative_num").to_pylist(),
+             batch.column("relationship").to_pylist())
+
+TABLE_ROWS = {
+  "people": people_rows,
+  "relationships": relationship_rows,
+}
+
+
+def parquet_columns(table : str, parquet : pq.ParquetFile) -> list[str]:
+  """Columns needed for table which exist in this Parquet file."""
+  return [name for name in PARQUET_COLUMNS[table]
+          if name in parquet.schema_arrow.names]
+
+def first_rows(parquet_path : Path) -> np.ndarray | None:
+  """Mask of rows which are the first with their user_num (None if there are
+  no duplicate user_nums)."""
+  user_nums = pq.read_table(parquet_path, columns=["user_num"]) \
+                .column("user_num").to_numpy()
+  _, first = np.unique(user_nums, return_index=True)
+  if len(first) == len(user_nums):
+    return None
+  utils.log(f"  Dropping {len(user_nums) - len(first):_} rows with duplicate user_nums")
+  keep = np.zeros(len(user_nums), dtype=bool)
+  keep[first] = True
+  return keep
+
+def row_group_mask(parquet : pq.ParquetFile, keep : np.ndarray,
+                   row_groups : list[int]) -> np.ndarray:
+  """Slice of keep for (sorted) row_groups."""
+  offsets = np.cumsum([0] + [parquet.metadata.row_group(i).num_rows
+                             for i in range(parquet.num_row_groups)])
+  return np.concatenate([keep[offsets[i]:offsets[i + 1]] for i in row_groups])
+
+def insert_batches(conn : sqlite3.Connection, table : str,
+                   batches : Iterable[pa.RecordBatch],
+                   keep : np.ndarray | None = None) -> int:
+  """Insert Parquet rows into table (only rows in keep mask, if given).
+  Returns number of rows read."""
+  num_rows = 0
+  for batch in batches:
+    rows = batch
+    if keep is not None:
+      rows = batch.filter(pa.array(keep[num_rows:num_rows + batch.num_rows]))
+    conn.executemany(INSERT_ROWS[table], TABLE_ROWS[table](rows))
+    num_rows += batch.num_rows
+  return num_rows
+
+def load_table(conn : sqlite3.Connection, table : str, parquet_path : Path,
+               row_groups : list[int] | None = None,
+               keep : np.ndarray | None = None) -> int:
+  """Insert rows from (some row groups of) a Parquet file into table.
+  keep is a mask of which of these rows to insert.
+  Returns number of rows read."""
+  parquet = pq.ParquetFile(parquet_path)
+  num_rows = insert_batches(conn, table, parquet.iter_batches(
+    batch_size=100_000, row_groups=row_groups,
+    columns=parquet_columns(table, parquet)), keep)
   conn.commit()
+  return num_rows
+
+def load_shard(table : str, parquet_path : Path, shard_path : Path,
+               row_groups : list[int], keep : np.ndarray | None) -> Path:
+  """Worker: Build a single table shard DB from some Parquet row groups."""
+  shard_path.unlink(missing_ok=True)
+  conn = sqlite3.connect(shard_path)
+  conn.execute("PRAGMA journal_mode = OFF")
+  conn.execute("PRAGMA synchronous = OFF")
+  conn.execute(CREATE_TABLES[table])
+  num_rows = load_table(conn, table, parquet_path, row_groups, keep)
+  conn.close()
+  utils.log(f"  Wrote shard {shard_path.name} with {num_rows:_} rows")
+  return shard_path
+
 
-  utils.log("Computing co-parents")
-  # Co-parents are two people who are both parents of a third person (share a child).
-  # They may or may not be married.
-  c.execute("""
-    INSERT INTO relationships SELECT a.relative_num, b.relative_num, 'coparent'
-      FROM relationships AS a,
-           relationships AS b
-      WHERE a.relationship_type = 'parent'
-        AND b.relationship_type = 'parent'
-        AND a.user_num = b.user_num
-        AND a.relative_num <> b.relative_num""")
+def build_indexes(conn : sqlite3.Connection) -> None:
+  # Note: Adding indexes at the end is the most efficient.
+  conn.execute("CREATE INDEX idx_people_wikitree_id ON people(wikitree_id)")
+  conn.execute("CREATE INDEX idx_relationships_user ON relationships(user_num)")
   conn.commit()
 
+
+def parquet_to_sqlite(data_dir : Path, num_workers : int) -> None:
+  db_path = Path(data_dir, "wikitree_dump.db")
+  for path in (db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm")):
+    path.unlink(missing_ok=True)
+  conn = connect_for_bulk_load(db_path)
+  for table in CREATE_TABLES:
+    conn.execute(CREATE_TABLES[table])
+
+  # Keep only the first version of any duplicate person. This is decided up
+  # front so that the result does not depend on how rows are sharded.
+  keeps : dict[str, np.ndarray | None] = {table: None for table in CREATE_TABLES}
+  keeps["people"] = first_rows(Path(data_dir, PARQUET_FILES["people"]))
+
+  if num_workers <= 1:
+    for table in CREATE_TABLES:
+      utils.log(f"Loading {table}")
+      num_rows = load_table(conn, table, Path(data_dir, PARQUET_FILES[table]),
+                            keep=keeps[table])
+      utils.log(f"  Loaded {num_rows:_} rows")
+
+  else:
+    # Split each Parquet file by row groups into shards.
+    shard_args = []
+    for table in CREATE_TABLES:
+      parquet_path = Path(data_dir, PARQUET_FILES[table])
+      parquet = pq.ParquetFile(parquet_path)
+      num_row_groups = parquet.num_row_groups
+      keep = keeps[table]
+      for shard in range(min(num_workers, num_row_groups)):
+        row_groups = list(range(shard, num_row_groups, num_workers))
+        shard_args.append((table, parquet_path,
+                           Path(data_dir, f"wikitree_dump.{table}.{shard}.db.tmp"),
+                           row_groups,
+                           None if keep is None else row_group_mask(parquet, keep, row_groups)))
+    utils.log(f"Building {len(shard_args)} shards with {num_workers} workers")
+    with multiprocessing.Pool(num_workers) as pool:
+      shard_paths = pool.starmap(load_shard, shard_args)
+
+    for (table, *_), shard_path in zip(shard_args, shard_paths):
+      utils.log(f"Merging {shard_path.name}")
+      conn.execute("ATTACH DATABASE ? AS shard", (str(shard_path),))
+      conn.execute(f"INSERT INTO main.{table} SELECT * FROM shard.{table}")
+      conn.commit()
+      conn.execute("DETACH DATABASE shard")
+      shard_path.unlink()
+
   utils.log("Indexing")
-  # Add indexes for fast lookup. Note: Adding them at the end is the most efficient.
-  c.execute("CREATE INDEX idx_people_wikitree_id ON people(wikitree_id)")
-  c.execute("CREATE INDEX idx_relationships_user ON relationships(user_num)")
+  build_indexes(conn)
 
-  conn.commit()
+  # Leave a single self-contained DB file for readers.
+  conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+  conn.execute("PRAGMA journal_mode = DELETE")
   conn.close()
   utils.log("Done")
 
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--version", help="Data version (defaults to most recent).")
-args = parser.parse_args()
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="Number of worker processes to convert rows with.")
+  args = parser.parse_args()
+
+  data_dir = utils.data_version_dir(args.version)
+  parquet_to_sqlite(data_dir, args.workers)
 
-csv_to_sqlite(args)
+if __name__ == "__main__":
+  main()
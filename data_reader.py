@@ -3,10 +3,12 @@ Single interface for accessing data via either SQLite or CSV into memory.
 """
 
 import collections
-from collections.abc import Mapping, Set
+from collections.abc import Container, Mapping, Sequence, Set
 import time
 
+import csr_tools
 import csv_iterate
+import index_tools
 import sqlite_reader
 from sqlite_reader import UserNum
 
@@ -20,32 +22,42 @@ def load_connections(version : str,
   children_of : Mapping[int, set[int]] = collections.defaultdict(set)
 
   print("Loading people", time.process_time())
+  num_people = 0
   num_conns = 0
-  for i, person in enumerate(csv_iterate.iterate_users(version=version)):
-    person_num = person.user_num()
-    for parent_num in (person.father_num(), person.mother_num()):
-      if parent_num:
-        if include_parents:
-          connections[person_num].add(parent_num)
-          num_conns += 1
-        if include_children:
-          connections[parent_num].add(person_num)
-          num_conns += 1
-        if include_siblings:
-          for sibling_num in children_of[parent_num]:
-            connections[person_num].add(sibling_num)
-            connections[sibling_num].add(person_num)
-            num_conns += 2
-          children_of[parent_num].add(person_num)
-    if i % 1000000 == 0:
-      print(" ... {:,}".format(i), "{:,}".format(num_conns), time.process_time())
+  for batch in csv_iterate.iterate_users_batches(
+      version=version, columns=["User ID", "Father", "Mother"]):
+    # Note: Missing values (null) are converted to 0 and skipped below.
+    person_nums = batch.column("User ID").fill_null(0).to_numpy().tolist()
+    for parents in (batch.column("Father").fill_null(0).to_numpy().tolist(),
+                    batch.column("Mother").fill_null(0).to_numpy().tolist()):
+      for person_num, parent_num in zip(person_nums, parents):
+        # Ignore missing parents and people listed as their own parents.
+        if person_num and parent_num and parent_num != person_num:
+          if include_parents:
+            connections[person_num].add(parent_num)
+            num_conns += 1
+          if include_children:
+            connections[parent_num].add(person_num)
+            num_conns += 1
+          if include_siblings:
+            for sibling_num in children_of[parent_num]:
+              connections[person_num].add(sibling_num)
+              connections[sibling_num].add(person_num)
+              num_conns += 2
+            children_of[parent_num].add(person_num)
+    num_people += batch.num_rows
+    print(" ... {:,}".format(num_people), "{:,}".format(num_conns), time.process_time())
 
   if include_spouses:
     print("Loading marriages", time.process_time())
-    for marriage in csv_iterate.iterate_marriages(version=version):
-      user1, user2 = marriage.user_nums()
-      connections[user1].add(user2)
-      connections[user2].add(user1)
+    for batch in csv_iterate.iterate_marriages_batches(
+        version=version, columns=["User ID1", "UserID2"]):
+      for user1, user2 in zip(batch.column("User ID1").fill_null(0).to_numpy().tolist(),
+                              batch.column("UserID2").fill_null(0).to_numpy().tolist()):
+        if not (user1 and user2):
+          continue
+        connections[user1].add(user2)
+        connections[user2].add(user1)
 
   print("All connections loaded", time.process_time())
   return connections
@@ -55,13 +67,58 @@ class Database(sqlite_reader.Database):
     super(Database, self).__init__(version)
     self.version = version
     self.connections : Mapping[UserNum, Set[UserNum]] = {}
+    # Memory-mapped person index & CSR snapshot (None if not built for this version).
+    self.index = index_tools.load_index(version)
+    self.adjacency = csr_tools.load_adjacency(version, self.index)
+
+  def id2num(self, wikitree_id : str) -> UserNum:
+    if self.index:
+      try:
+        return self.index.id2num(wikitree_id)
+      except KeyError:
+        pass
+    return super(Database, self).id2num(wikitree_id)
+
+  def num2id(self, user_num : UserNum) -> str | None:
+    if self.index:
+      try:
+        return self.index.num2id(user_num)
+      except KeyError:
+        pass
+    return super(Database, self).num2id(user_num)
 
   def neighbors_of(self, person : UserNum):
     if self.connections:
       return self.connections[person]
+    elif self.adjacency:
+      return self.adjacency.neighbors_of(person)
     else:
       return super(Database, self).neighbors_of(person)
 
+  def relative_of(self, user_num : UserNum, relationship_type : str) -> frozenset[int]:
+    if self.adjacency:
+      return self.relative_of_mult(user_num, (relationship_type,))
+    else:
+      return super(Database, self).relative_of(user_num, relationship_type)
+
+  def relative_of_mult(self, user_num : UserNum, relationship_types : Container[str]) -> frozenset[int]:
+    if self.adjacency:
+      return self.adjacency.relatives_of(
+        user_num, self.adjacency.rel_mask(relationship_types))
+    else:
+      return super(Database, self).relative_of_mult(user_num, relationship_types)
+
+  def relationship_types(self, pairs : Sequence[tuple[UserNum, UserNum]]
+                         ) -> list[str | None]:
+    if self.adjacency:
+      sources = self.adjacency.indexes_of([user_num for user_num, _ in pairs])
+      targets = self.adjacency.indexes_of([relative_num for _, relative_num in pairs])
+      if (sources >= 0).all() and (targets >= 0).all():
+        codes = self.adjacency.relationship_codes(sources, targets)
+        return [csr_tools.RELATIONSHIP_TYPES[code] if code >= 0 else None
+                for code in codes.tolist()]
+    return super(Database, self).relationship_types(pairs)
+
   def load_connections(self):
     self.connections = load_connections(version=self.version,
                                         include_parents=True,
@@ -2,9 +2,12 @@
 
 import argparse
 import collections
+import itertools
 import json
 import random
 
+import numpy as np
+
 import bfs_tools
 import data_reader
 import utils
@@ -12,12 +15,16 @@ import utils
 def get_distances(db, start, ignore_people=frozenset(),
                   dist_cutoff=None, verbose=False):
   """Get distances to all other items in graph via breadth-first search."""
+  if db.adjacency:
+    return get_distances_array(db.adjacency, start, ignore_people,
+                               dist_cutoff, verbose)
+
   dists = {}
   total_dist = 0
   max_dist = 0
   hist_dist = collections.defaultdict(int)
   for node in bfs_tools.ConnectionBfs(db, start, ignore_people):
-    if dist_cutoff and node.dist > dist_cutoff:
+    if dist_cutoff is not None and node.dist > dist_cutoff:
       break
     dists[node.person] = node.dist
     hist_dist[node.dist] += 1
@@ -29,6 +36,45 @@ def get_distances(db, start, ignore_people=frozenset(),
   hist_dist_list = [hist_dist[i] for i in range(max(hist_dist.keys()) + 1)]
   return dists, hist_dist_list, mean_dist, max_dist
 
+def get_distances_array(adjacency, start, ignore_people=frozenset(),
+                        dist_cutoff=None, verbose=False):
+  """Vectorized get_distances() using bfs_tools.BfsDistances.
+  Note: dists is returned as a read-only DistanceMap instead of a dict."""
+  ignore_indexes = adjacency.indexes_of(list(ignore_people))
+  dists, _ = bfs_tools.BfsDistances(
+    adjacency, adjacency.index_of(start),
+    ignore_indexes=ignore_indexes[ignore_indexes >= 0],
+    max_dist=dist_cutoff)
+  hist_dist = np.bincount(dists[dists >= 0])
+  if verbose:
+    utils.log(f" ... {hist_dist.sum():_} nodes / Circle {len(hist_dist) - 1}")
+  mean_dist = float(np.dot(np.arange(len(hist_dist)), hist_dist)) / hist_dist.sum()
+  max_dist = len(hist_dist) - 1
+  return (bfs_tools.DistanceMap(adjacency, dists), hist_dist.tolist(),
+          mean_dist, max_dist)
+
+def get_distances_batch(adjacency, starts, ignore_people=frozenset(),
+                        dist_cutoff=None):
+  """Run BFS from each of starts at once (see bfs_tools.MultiBfsHistograms).
+  Returns list of (hist_dist, mean_dist, max_dist) for each start."""
+  ignore_indexes = adjacency.indexes_of(list(ignore_people))
+  ignore_indexes = ignore_indexes[ignore_indexes >= 0]
+  start_indexes = adjacency.indexes_of(starts)
+  # People with no relationships are not in the adjacency.
+  known = np.flatnonzero(start_indexes >= 0)
+  results = [([1], 0.0, 0)] * len(starts)
+  for batch_start in range(0, len(known), bfs_tools.MULTI_BFS_WIDTH):
+    batch = known[batch_start:batch_start + bfs_tools.MULTI_BFS_WIDTH]
+    hists = bfs_tools.MultiBfsHistograms(
+      adjacency, start_indexes[batch], ignore_indexes,
+      max_dist=dist_cutoff)
+    dists = np.arange(hists.shape[1])
+    for i, hist_dist in zip(batch.tolist(), hists):
+      max_dist = int(np.flatnonzero(hist_dist)[-1])
+      mean_dist = float(np.dot(dists, hist_dist)) / hist_dist.sum()
+      results[i] = (hist_dist[:max_dist + 1].tolist(), mean_dist, max_dist)
+  return results
+
 def get_mean_dists(db, start):
   _, _, mean_dist, max_dist = get_distances(db, start)
   return mean_dist, max_dist
@@ -53,6 +99,9 @@ def main():
                       help="Comma separated list of people to ignore in BFS.")
   parser.add_argument("--max-distance", type=int,
                       help="Limit BFS search to a max distance (instead of finding the distance to all people in the connected tree).")
+  parser.add_argument("--batch", action="store_true",
+                      help=f"Run BFS from {bfs_tools.MULTI_BFS_WIDTH} people at once "
+                           "(requires adjacency snapshot, see csr_tools.py).")
   parser.add_argument("wikitree_id", nargs="*")
   args = parser.parse_args()
 
@@ -64,13 +113,26 @@ def main():
   ignore_nums = frozenset(db.id2num(id) for id in ignore_ids)
 
   circle_sizes = {}
-  for user_num in enum_user_nums(db, args):
-    utils.log("Loading distances from", db.num2id(user_num))
-    dists, hist_dist, mean_dist, max_dist = get_distances(
-      db, user_num, ignore_nums, dist_cutoff=args.max_distance, verbose=True)
-    utils.log(db.num2id(user_num), mean_dist, max_dist)
-    circle_sizes[db.num2id(user_num)] = hist_dist
-    utils.log(hist_dist)
+  if args.batch:
+    assert db.adjacency, "--batch requires adjacency snapshot"
+    user_nums = enum_user_nums(db, args)
+    while batch := list(itertools.islice(user_nums, bfs_tools.MULTI_BFS_WIDTH)):
+      utils.log(f"Loading distances from {len(batch)} people")
+      results = get_distances_batch(db.adjacency, batch, ignore_nums,
+                                    dist_cutoff=args.max_distance)
+      for user_num, (hist_dist, mean_dist, max_dist) in zip(batch, results):
+        utils.log(db.num2id(user_num), mean_dist, max_dist)
+        circle_sizes[db.num2id(user_num)] = hist_dist
+        utils.log(hist_dist)
+
+  else:
+    for user_num in enum_user_nums(db, args):
+      utils.log("Loading distances from", db.num2id(user_num))
+      dists, hist_dist, mean_dist, max_dist = get_distances(
+        db, user_num, ignore_nums, dist_cutoff=args.max_distance, verbose=True)
+      utils.log(db.num2id(user_num), mean_dist, max_dist)
+      circle_sizes[db.num2id(user_num)] = hist_dist
+      utils.log(hist_dist)
 
   if args.save_distribution_json:
     utils.log("Writing results")
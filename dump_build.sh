@@ -6,6 +6,12 @@ set -e
 set -x
 
 TIMESTAMP=$1
+# With --incremental, patch the previous version's build instead of
+# rebuilding steps (2), (3) & (5) from scratch. See dump_incremental.py.
+INCREMENTAL=false
+if [ "${2:-}" == "--incremental" ]; then
+  INCREMENTAL=true
+fi
 
 VERSION_DIR="data/version/${TIMESTAMP}/"
 rm -rf $VERSION_DIR
@@ -17,15 +23,27 @@ for x in people_users people_marriages categories; do
   gunzip -c data/dumps/${TIMESTAMP}/dump_${x}.csv.gz > ${VERSION_DIR}/dump_${x}.csv
 done
 
-echo
-echo "(2) Convert to parquet"
-# 2m
-time python3 csv_to_parquet.py --version=${TIMESTAMP}
+if $INCREMENTAL; then
+  echo
+  echo "(2,3,5) Incrementally update parquet, relationships & SQLite DB"
+  # Falls back to a full rebuild if needed.
+  time python3 dump_incremental.py --version=${TIMESTAMP}
+else
+  echo
+  echo "(2) Convert to parquet"
+  # 2m
+  time python3 csv_to_parquet.py --version=${TIMESTAMP}
 
-echo
-echo "(3) Compute relationships"
-# 6m
-time python3 pq_compute_relatives.py --version=${TIMESTAMP}
+  echo
+  echo "(3) Compute relationships"
+  # 6m
+  time python3 pq_compute_relatives.py --version=${TIMESTAMP}
+  # Dense person index (index_tools) & memory-mapped CSR snapshot used by
+  # data_reader.Database for lookups & BFS.
+  time python3 csr_tools.py --version=${TIMESTAMP}
+fi
+# Memory-mapped category <-> person index used by category_tools.CategoryDb.
+time python3 category_tools.py --version=${TIMESTAMP}
 
 echo
 echo "(4) Building Graph"
@@ -33,17 +51,23 @@ echo "(4) Building Graph"
 time python3 graph_make_family.py --version=${TIMESTAMP}
 mkdir -p "results/graphs/family/${TIMESTAMP}"
 # Save copy of network in a more persistent place
-cp "${VERSION_DIR}/graphs/family/all."* "results/graphs/family/${TIMESTAMP}/"
+cp -r "${VERSION_DIR}/graphs/family/all."* "results/graphs/family/${TIMESTAMP}/"
 # 10m
-time python3 graph_core.py ${VERSION_DIR}/graphs/family/all.adj.nx
+time python3 graph_core.py ${VERSION_DIR}/graphs/family/all.csr
+
+if ! $INCREMENTAL; then
+  echo
+  echo "(5) Convert to SQLite DB"
+  # Built from people.parquet & rel_all.parquet produced in (2) & (3).
+  time python3 csv_to_sqlite.py --version=${TIMESTAMP} --workers=4
+fi
 
 echo
-echo "(5) Convert to SQLite DB"
-# 30m
-time python3 csv_to_sqlite.py --version=${TIMESTAMP}
+echo "(6) Precompute circles for popular profiles"
+time python3 circles_precompute.py --version=${TIMESTAMP} --top=1000
 
 echo
-echo "(6) TODO: Compute Stats?"
+echo "(7) TODO: Compute Stats?"
 
 echo
 echo "Done"
@@ -0,0 +1,301 @@
+"""
+Incrementally build a new dump version on top of the previous version.
+
+Between consecutive dumps only a small fraction of profiles change, so
+rather than rebuilding every derived file from scratch (see dump_build.sh):
+ 1. Convert the new CSVs to Parquet (csv_to_parquet.py).
+ 2. Diff the new people.parquet against the old one by user_num and
+    touched_time.
+ 3. Patch the old rel_all.parquet. Only parent/child/sibling relationships of
+    changed people and coparent relationships of their (old & new) parents are
+    recomputed. Spouses are recomputed from marriages.parquet (cheap).
+ 4. Copy the old SQLite DB and replace rows of changed people and of people
+    whose relationships changed.
+ 5. Rebuild the CSR adjacency snapshot from the patched rel_all.parquet.
+ 6. Verify checksums of the patched DB against the Parquet files.
+
+If the old version is missing, too large a fraction of people changed or
+verification fails, we fall back to a full rebuild.
+
+Graphs (dump_build.sh step 4) are still built from the resulting Parquet files.
+"""
+
+import argparse
+from pathlib import Path
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import csr_tools
+import csv_to_parquet
+import csv_to_sqlite
+import pq_compute_relatives
+import utils
+
+
+def previous_version(version : str) -> str | None:
+  """Most recent version before this one which has a complete build."""
+  versions = sorted(
+    path.name for path in Path("data", "version").iterdir()
+    if path.name < version and not path.is_symlink()
+    and Path(path, "wikitree_dump.db").exists()
+    and Path(path, "rel_all.parquet").exists())
+  return versions[-1] if versions else None
+
+
+def diff_people(old_dir : Path, new_dir : Path) -> tuple[np.ndarray, np.ndarray]:
+  """Returns (changed, deleted) user_nums. changed includes new people."""
+  columns = ["user_num", "touched_time"]
+  old = pd.read_parquet(old_dir / "people.parquet", columns=columns) \
+    .drop_duplicates(subset="user_num")
+  new = pd.read_parquet(new_dir / "people.parquet", columns=columns)
+  both = new.merge(old, on="user_num", how="left", suffixes=("", "_old"))
+  # Note: NaT never compares equal, so this includes people not in old and
+  # people without touched_time (Ex: custom users).
+  changed = both.user_num[~(both.touched_time == both.touched_time_old)]
+  deleted = old.user_num[~old.user_num.isin(new.user_num)]
+  return np.unique(changed.to_numpy()), np.unique(deleted.to_numpy())
+
+
+def _rel_users(*rels : pd.DataFrame) -> np.ndarray:
+  return np.unique(np.concatenate(
+    [rel[col].to_numpy(dtype=np.int64) for rel in rels
+     for col in ("user_num", "relative_num")]))
+
+def _touching(rels : pd.DataFrame, user_nums : np.ndarray) -> pd.Series:
+  return rels.user_num.isin(user_nums) | rels.relative_num.isin(user_nums)
+
+def patch_relatives(old_dir : Path, new_dir : Path,
+                    changed : np.ndarray, deleted : np.ndarray
+                    ) -> tuple[pd.DataFrame, np.ndarray]:
+  """Patch old rel_all with changes in people & marriages.
+
+  Returns (rel_all, affected) where affected are user_nums whose relationships
+  may have changed.
+  """
+  gone = np.union1d(changed, deleted)
+  old_rels = pd.read_parquet(old_dir / "rel_all.parquet",
+                             dtype_backend="numpy_nullable")
+  utils.log(f"  Loaded {len(old_rels):_} old relationships")
+  old_by_type = {rel_type: old_rels.loc[old_rels.relationship == rel_type]
+                 for rel_type in ("spouse", "parent", "sibling", "coparent")}
+  del old_rels
+
+  # Spouses: Recompute from scratch.
+  spouse = pq_compute_relatives.load_spouse_rels(new_dir)
+  spouse_diff = old_by_type["spouse"].merge(
+    spouse, on=["user_num", "relative_num"], how="outer", indicator=True)
+  spouse_diff = spouse_diff.loc[spouse_diff._merge != "both"]
+
+  # Parents: Replace parents of changed people.
+  old_parent = old_by_type["parent"]
+  ppl_df = pq_compute_relatives.load_parents(new_dir)
+  new_parent = pq_compute_relatives.parent_rels(
+    ppl_df.loc[ppl_df.user_num.isin(changed)])
+  removed_parent = old_parent.loc[old_parent.user_num.isin(gone)]
+  parent = pd.concat([old_parent.loc[~old_parent.user_num.isin(gone)],
+                      new_parent], ignore_index=True)
+  child = pq_compute_relatives.child_rels(parent)
+  utils.log(f"  Replaced {len(removed_parent):_} parent relationships "
+            f"with {len(new_parent):_}")
+
+  # Siblings: Only relationships involving changed people can differ.
+  # All their siblings are children of their (new) parents.
+  old_sibling = old_by_type["sibling"]
+  sibling = pq_compute_relatives.find_common(
+    parent.loc[parent.relative_num.isin(new_parent.relative_num)], "sibling")
+  sibling = sibling.loc[_touching(sibling, gone)]
+  removed_sibling = old_sibling.loc[_touching(old_sibling, gone)]
+  sibling = pd.concat([old_sibling.loc[~_touching(old_sibling, gone)],
+                       sibling], ignore_index=True)
+
+  # Coparents: Only relationships involving parents who gained or lost
+  # children can differ.
+  changed_parents = np.union1d(removed_parent.relative_num.to_numpy(dtype=np.int64),
+                               new_parent.relative_num.to_numpy(dtype=np.int64))
+  old_coparent = old_by_type["coparent"]
+  children = child.relative_num.loc[child.user_num.isin(changed_parents)]
+  coparent = pq_compute_relatives.find_common(
+    child.loc[child.relative_num.isin(children)], "coparent")
+  coparent = coparent.loc[_touching(coparent, changed_parents)]
+  removed_coparent = old_coparent.loc[_touching(old_coparent, changed_parents)]
+  coparent = pd.concat([old_coparent.loc[~_touching(old_coparent, changed_parents)],
+                        coparent], ignore_index=True)
+
+  # Note: Keep the same order of relationship types as compute_relatives().
+  rels = pd.concat([spouse, parent, child, sibling, coparent], ignore_index=True)
+  assert rels.isna().sum().sum() == 0, rels.isna().sum()
+  affected = np.union1d(gone, _rel_users(
+    spouse_diff, removed_parent, new_parent, removed_sibling,
+    sibling.loc[_touching(sibling, gone)], removed_coparent,
+    coparent.loc[_touching(coparent, changed_parents)]))
+  return rels, affected
+
+
+def _temp_user_nums(conn : sqlite3.Connection, name : str,
+                    user_nums : np.ndarray) -> None:
+  conn.execute(f"CREATE TEMP TABLE {name} (user_num INT PRIMARY KEY)")
+  conn.executemany(f"INSERT INTO {name} VALUES (?)",
+                   ((user_num,) for user_num in user_nums.tolist()))
+
+def patch_sqlite(db_path : Path, new_dir : Path, rels : pd.DataFrame,
+                 changed : np.ndarray, deleted : np.ndarray,
+                 affected : np.ndarray) -> None:
+  conn = sqlite3.connect(db_path)
+  conn.execute("PRAGMA synchronous = OFF")
+  _temp_user_nums(conn, "changed_people", np.union1d(changed, deleted))
+  _temp_user_nums(conn, "affected_people", affected)
+
+  conn.execute("DELETE FROM people WHERE user_num IN (SELECT user_num FROM changed_people)")
+  parquet = pq.ParquetFile(new_dir / "people.parquet")
+  people = pq.read_table(new_dir / "people.parquet",
+                         columns=csv_to_sqlite.parquet_columns("people", parquet),
+                         filters=[("user_num", "in", changed.tolist())])
+  num_people = csv_to_sqlite.insert_batches(
+    conn, "people", people.to_batches(max_chunksize=100_000))
+  utils.log(f"  Replaced {num_people:_} people")
+
+  conn.execute("DELETE FROM relationships WHERE user_num IN (SELECT user_num FROM affected_people)")
+  # Note: Insert in rel_all order so that relationship_type() prefers
+  # spouse over coparent like in a full build.
+  rels = rels.loc[rels.user_num.isin(affected)]
+  conn.executemany(csv_to_sqlite.INSERT_ROWS["relationships"],
+                   zip(rels.user_num.tolist(), rels.relative_num.tolist(),
+                       rels.relationship.tolist()))
+  utils.log(f"  Replaced relationships of {len(affected):_} people "
+            f"({len(rels):_} relationships)")
+  conn.commit()
+  conn.close()
+
+
+# Checksum of relationships: sum(user_num % P * relative_num % P) per type
+# (P chosen so that sums over billions of rows fit in an int64).
+CHECKSUM_PRIME = 65_521
+
+def sqlite_checksum(db_path : Path) -> dict[str, list[int]]:
+  conn = sqlite3.connect(db_path)
+  checksum = {}
+  checksum["people"] = list(conn.execute("""
+    SELECT count(*), total(user_num), total(father_num), total(mother_num)
+    FROM people""").fetchone())
+  for rel_type, count, user_sum, rel_sum, prod_sum in conn.execute(f"""
+      SELECT relationship_type, count(*), sum(user_num), sum(relative_num),
+             sum((user_num % {CHECKSUM_PRIME}) * (relative_num % {CHECKSUM_PRIME}))
+      FROM relationships GROUP BY relationship_type"""):
+    checksum[rel_type] = [count, user_sum, rel_sum, prod_sum]
+  conn.close()
+  checksum["people"] = [int(x) for x in checksum["people"]]
+  return checksum
+
+def parquet_checksum(data_dir : Path,
+                     rels : pd.DataFrame | None = None) -> dict[str, list[int]]:
+  """Expected sqlite_checksum() of a DB built from data_dir."""
+  people = pd.read_parquet(data_dir / "people.parquet",
+                           columns=["user_num", "father_num", "mother_num"],
+                           dtype_backend="numpy_nullable") \
+    .drop_duplicates(subset="user_num")
+  user_nums = people.user_num.to_numpy(dtype=np.int64)
+  checksum = {"people": [len(people), int(user_nums.sum())]}
+  for col in ("father_num", "mother_num"):
+    parents = people[col].fillna(0).to_numpy(dtype=np.int64)
+    # Self-parents are dropped by csv_to_sqlite.
+    checksum["people"].append(int(parents[parents != user_nums].sum()))
+
+  if rels is None:
+    rels = pd.read_parquet(data_dir / "rel_all.parquet")
+  checksum.update(rels_checksum(rels))
+  return checksum
+
+def rels_checksum(rels : pd.DataFrame) -> dict[str, list[int]]:
+  """Order-independent checksum of a relationships table."""
+  checksum : dict[str, list[int]] = {}
+  for rel_type, group in rels.groupby("relationship", sort=False):
+    users = group.user_num.to_numpy(dtype=np.int64)
+    relatives = group.relative_num.to_numpy(dtype=np.int64)
+    checksum[str(rel_type)] = [
+      len(group), int(users.sum()), int(relatives.sum()),
+      # Note: fmod matches SQLite's % for negative (custom) user_nums.
+      int((np.fmod(users, CHECKSUM_PRIME) * np.fmod(relatives, CHECKSUM_PRIME)).sum())]
+  return checksum
+
+
+def full_build(data_dir : Path, num_workers : int) -> None:
+  utils.log("Full rebuild")
+  pq_compute_relatives.compute_relatives(data_dir)
+  csv_to_sqlite.parquet_to_sqlite(data_dir, num_workers)
+  csr_tools.build_adjacency(data_dir)
+
+def incremental_build(old_dir : Path, new_dir : Path,
+                      max_change_fraction : float, verify_full : bool) -> bool:
+  """Returns False if we could not do an incremental build."""
+  utils.log(f"Diffing people against {str(old_dir)}")
+  changed, deleted = diff_people(old_dir, new_dir)
+  num_people = pq.ParquetFile(new_dir / "people.parquet").metadata.num_rows
+  change_fraction = (len(changed) + len(deleted)) / max(num_people, 1)
+  utils.log(f"  {len(changed):_} changed/added and {len(deleted):_} deleted "
+            f"of {num_people:_} people ({change_fraction:.2%})")
+  if change_fraction > max_change_fraction:
+    utils.log(f"  More than {max_change_fraction:.0%} changed")
+    return False
+
+  utils.log("Patching relationships")
+  rels, affected = patch_relatives(old_dir, new_dir, changed, deleted)
+  if verify_full:
+    utils.log("Verifying relationships against full recompute")
+    pq_compute_relatives.compute_relatives(new_dir)
+    expected = pd.read_parquet(new_dir / "rel_all.parquet")
+    if rels_checksum(rels) != rels_checksum(expected):
+      utils.log("  ERROR: Patched relationships differ from full recompute")
+      return False
+  pq_compute_relatives.write_relatives(rels, new_dir)
+  pq_compute_relatives.write_families(
+    pq_compute_relatives.load_parents(new_dir), new_dir)
+
+  utils.log("Patching SQLite DB")
+  db_path = new_dir / "wikitree_dump.db"
+  shutil.copyfile(old_dir / "wikitree_dump.db", db_path)
+  patch_sqlite(db_path, new_dir, rels, changed, deleted, affected)
+
+  utils.log("Verifying checksums")
+  expected_checksum = parquet_checksum(new_dir, rels)
+  actual_checksum = sqlite_checksum(db_path)
+  if actual_checksum != expected_checksum:
+    utils.log(f"  ERROR: Checksum mismatch: {actual_checksum} != {expected_checksum}")
+    return False
+
+  csr_tools.build_adjacency(new_dir)
+  return True
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", required=True, help="New data version.")
+  parser.add_argument("--old-version",
+                      help="Version to patch (defaults to most recent complete build).")
+  parser.add_argument("--max-change-fraction", type=float, default=0.1,
+                      help="Do a full rebuild if more than this fraction of people changed.")
+  parser.add_argument("--verify-full", action="store_true",
+                      help="Also recompute all relationships from scratch to verify patch.")
+  parser.add_argument("--workers", type=int, default=4,
+                      help="Number of worker processes for full rebuild of SQLite DB.")
+  args = parser.parse_args()
+
+  new_dir = utils.data_version_dir(args.version)
+  old_version = args.old_version or previous_version(args.version)
+
+  csv_to_parquet.csv_to_parquet(new_dir)
+
+  if not old_version:
+    utils.log("No previous version to patch")
+    full_build(new_dir, args.workers)
+  elif not incremental_build(utils.data_version_dir(old_version), new_dir,
+                             args.max_change_fraction, args.verify_full):
+    full_build(new_dir, args.workers)
+
+  utils.log("Done")
+
+if __name__ == "__main__":
+  main()
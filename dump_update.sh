@@ -5,10 +5,16 @@ set -u
 set -e
 
 SKIP_DOWNLOAD=false
-if [ "${1:-}" == "--skip-download" ]; then
-  SKIP_DOWNLOAD=true
+BUILD_ARGS=""
+while [ "${1:-}" == "--skip-download" ] || [ "${1:-}" == "--incremental" ]; do
+  if [ "$1" == "--skip-download" ]; then
+    SKIP_DOWNLOAD=true
+  else
+    # Patch previous version instead of rebuilding from scratch.
+    BUILD_ARGS="--incremental"
+  fi
   shift
-fi
+done
 
 if $SKIP_DOWNLOAD; then
   TIMESTAMP=$(ls -1 data/dumps/ | sort -r | head -n 1)
@@ -22,7 +28,7 @@ else
   fi
 fi
 
-time bash dump_build.sh $TIMESTAMP
+time bash dump_build.sh $TIMESTAMP $BUILD_ARGS
 
 echo
 echo "Update default version to $TIMESTAMP"
@@ -1,15 +1,100 @@
+"""
+Monte Carlo weighted betweenness.
+
+Sample pairs of core nodes (weighted by the number of people collapsed into
+each) and count how often each node and edge is on the shortest path between
+them. Pairs are sampled in chunks, each chunk is processed by a worker process
+which returns score arrays for its chunk, and these are merged as they finish.
+
+Each node's score is a sum of per-sample indicators (is the node on this
+sample's path?), so we report a normal approximation confidence interval and
+can stop early once the top nodes are clearly separated.
+"""
+
 import argparse
+import collections
 import csv
-import random
-from collections import defaultdict
 import time
 
-import networkx as nx
 import networkit as nk
+import numpy as np
+import pandas as pd
 
 import graph_tools
 import utils
 
+
+# Graph for each worker process (see init_worker).
+_graph = None
+
+def init_worker(in_graph):
+    global _graph
+    _graph, _ = graph_tools.load_graph_nk_collapsed(in_graph)
+
+def sample_paths(graph, pairs):
+    """Find shortest paths between all (s, t) pairs.
+
+    Returns (num_pairs, num_valid, nodes, node_counts, edges, edge_counts) with
+    counts of each node (excluding endpoints) and edge on these paths. Edges are
+    keys u * num_nodes + v (with u < v for undirected graphs).
+    """
+    num_nodes = graph.numberOfNodes()
+    path_nodes = []
+    path_sources = []
+    path_targets = []
+    num_valid = 0
+    for s, t in pairs.tolist():
+        if s == t:
+            continue
+        bd = nk.distance.BidirectionalDijkstra(graph, s, t, storePred=True)
+        bd.run()
+        # If nodes are in different components, distance is infinite.
+        if bd.getDistance() >= 1e20:
+            continue
+        num_valid += 1
+        # getPath() returns intermediate nodes only (which is what betweenness
+        # counts). Edge betweenness counts the full path including endpoints.
+        path = bd.getPath()
+        path_nodes.extend(path)
+        full_path = [s] + path + [t]
+        path_sources.extend(full_path[:-1])
+        path_targets.extend(full_path[1:])
+
+    nodes, node_counts = np.unique(np.array(path_nodes, dtype=np.int64),
+                                   return_counts=True)
+    sources = np.array(path_sources, dtype=np.int64)
+    targets = np.array(path_targets, dtype=np.int64)
+    if not graph.isDirected():
+        sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+    edges, edge_counts = np.unique(sources * num_nodes + targets,
+                                   return_counts=True)
+    return len(pairs), num_valid, nodes, node_counts, edges, edge_counts
+
+def sample_chunk(pairs):
+    """Worker: sample_paths() using this worker's graph."""
+    return sample_paths(_graph, pairs)
+
+def confidence_half_width(scores, num_samples, z):
+    """Half width of normal approximation confidence interval for node scores
+    (sums of num_samples Bernoulli indicators)."""
+    p = scores / max(num_samples, 1)
+    return z * np.sqrt(num_samples * p * (1 - p))
+
+def top_nodes(scores, top_n):
+    """Indexes of the top_n highest scores (in decreasing order)."""
+    top_n = min(top_n, len(scores))
+    top = np.argpartition(scores, -top_n)[-top_n:]
+    return top[np.argsort(scores[top], kind="stable")[::-1]]
+
+def is_separated(scores, half_widths, top_n):
+    """Are the top_n nodes' scores confidently above all others?"""
+    if top_n >= len(scores):
+        return True
+    top = top_nodes(scores, top_n + 1)
+    last_in, first_out = top[top_n - 1], top[top_n]
+    return (scores[last_in] - half_widths[last_in] >
+            scores[first_out] + half_widths[first_out])
+
 def main():
     parser = argparse.ArgumentParser(description="Monte Carlo Weighted Betweenness")
     parser.add_argument("in_graph", help="Input graph file")
@@ -17,130 +102,107 @@ def main():
     parser.add_argument("--out_nodes", default="top_weighted_nodes.csv")
     parser.add_argument("--out_edges", default="top_weighted_edges.csv")
     parser.add_argument("--samples", type=int, default=100000, help="Number of path samples")
+    parser.add_argument("--top_n", type=int, default=100, help="Number of top nodes/edges to save")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes to sample paths in.")
+    parser.add_argument("--chunk_size", type=int, default=1000,
+                        help="Number of pairs sampled per worker task.")
+    parser.add_argument("--seed", type=int, help="Random seed for sampling pairs")
+    parser.add_argument("--z", type=float, default=1.96,
+                        help="z-score of confidence intervals (1.96 = 95%%)")
+    parser.add_argument("--stop_when_converged", action="store_true",
+                        help="Stop before --samples once the top_n ranking is unchanged "
+                             "since the last check and confidently separated from the rest.")
+    parser.add_argument("--check_every", type=int, default=10000,
+                        help="Number of samples between progress logs/convergence checks")
     args = parser.parse_args()
 
     utils.log(f"Reading graph from {args.in_graph}")
-    Gnx = graph_tools.load_graph(args.in_graph)
-    
-    utils.log("Creating node conversion mappings")
-    name2index = {node: index for index, node in enumerate(Gnx.nodes())}
-    index2name = {index: node for node, index in name2index.items()}
-    
-    utils.log("Converting graph to NetworKit")
-    is_directed = Gnx.is_directed()
-    is_weighted = graph_tools.is_weighted(Gnx)
-    
-    Gnk = nk.Graph(Gnx.number_of_nodes(), directed=is_directed, weighted=is_weighted)
-    
-    # Track edges
-    added_edges = {}
-    for u, v, data in Gnx.edges(data=True):
-        u_idx, v_idx = name2index[u], name2index[v]
-        if not is_directed and u_idx > v_idx:
-            u_idx, v_idx = v_idx, u_idx
-            
-        weight = data.get('weight', 1.0)
-        edge_key = (u_idx, v_idx)
-        
-        # Collapse parallel edges by taking minimum weight
-        if edge_key not in added_edges or weight < added_edges[edge_key]:
-            added_edges[edge_key] = weight
-
-    for (u_idx, v_idx), weight in added_edges.items():
-        if is_weighted:
-            Gnk.addEdge(u_idx, v_idx, w=weight)
-        else:
-            Gnk.addEdge(u_idx, v_idx)
-            
+    # Collapse parallel edges by taking minimum weight
+    Gnk, index2name = graph_tools.load_graph_nk_collapsed(args.in_graph)
+    num_nodes = Gnk.numberOfNodes()
+    utils.log(f"Loaded graph: {num_nodes:_} nodes, {Gnk.numberOfEdges():_} edges")
+
     utils.log("Loading node weights from " + args.collapse_csv)
-    # Default weight is 1 (the core node itself)
-    node_weights = {idx: 1 for idx in name2index.values()}
-    
-    with open(args.collapse_csv, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            core_name = row['core_node']
-            if core_name in name2index:
-                # Add 1 for every node that was collapsed into this core node
-                node_weights[name2index[core_name]] += 1
-                
-    # Prepare arrays for fast weighted sampling
-    nodes = list(node_weights.keys())
-    weights = [node_weights[n] for n in nodes]
-    
-    utils.log(f"Starting Monte Carlo Weighted Betweenness ({args.samples:_} samples)...")
-    
-    node_scores = defaultdict(float)
-    edge_scores = defaultdict(float)
-    
-    start_time = time.time()
+    core_nodes = pd.read_csv(args.collapse_csv, usecols=["core_node"],
+                             dtype=str)["core_node"]
+    core_indexes = pd.Index(index2name).get_indexer(core_nodes)
+    # Default weight is 1 (the core node itself). Add 1 for every node that was
+    # collapsed into this core node.
+    node_weights = 1 + np.bincount(core_indexes[core_indexes >= 0],
+                                   minlength=num_nodes)
+    probs = node_weights / node_weights.sum()
+
+    rng = np.random.default_rng(args.seed)
+    def chunks():
+        for start in range(0, args.samples, args.chunk_size):
+            # Sample pairs of nodes based on their exact collapsed mass
+            size = min(args.chunk_size, args.samples - start)
+            yield rng.choice(num_nodes, size=(size, 2), p=probs)
+
+    if args.workers > 1:
+        results = utils.parallel_imap(sample_chunk, chunks(), args.workers,
+                                      initializer=init_worker,
+                                      initargs=(args.in_graph,))
+    else:
+        results = (sample_paths(Gnk, pairs) for pairs in chunks())
+
+    utils.log(f"Starting Monte Carlo Weighted Betweenness ({args.samples:_} samples, {args.workers} workers)...")
+    node_scores = np.zeros(num_nodes, dtype=np.int64)
+    edge_scores = collections.Counter()
+    num_samples = 0
     valid_paths = 0
-    log_steps = args.samples // 20
-    
-    for i in range(args.samples):
-        if i % log_steps == 0 and i > 0:
+    next_check = args.check_every
+    prev_top = None
+    start_time = time.time()
+    for num_pairs, num_valid, nodes, node_counts, edges, edge_counts in results:
+        num_samples += num_pairs
+        valid_paths += num_valid
+        node_scores[nodes] += node_counts
+        edge_scores.update(dict(zip(edges.tolist(), edge_counts.tolist())))
+
+        if num_samples >= next_check:
+            next_check += args.check_every
             elapsed = time.time() - start_time
-            utils.log(f"  Processed {i:_} samples ({elapsed:.1f}s)")
-            
-        # Sample two nodes based on their exact collapsed mass
-        s, t = random.choices(nodes, weights=weights, k=2)
-        if s == t:
-            continue
-            
-        # Find shortest path
-        bd = nk.distance.BidirectionalDijkstra(Gnk, s, t, storePred=True)
-        bd.run()
-        path = bd.getPath()
-        
-        # If nodes are in different components, path will be empty and distance infinite
-        # networkit getPath returns empty list if no path or if path is just one edge. 
-        # But wait, if s and t are adjacent, getPath() is empty. 
-        # Let's check distance to be sure.
-        if bd.getDistance() >= 1e20:
-            continue
-            
-        valid_paths += 1
-        
-        # getPath() returns intermediate nodes only. 
-        # So we increment node_scores for them (Betweenness doesn't count endpoints).
-        for node in path:
-            node_scores[node] += 1.0
-            
-        # Edge betweenness counts the full path including endpoints
-        full_path = [s] + path + [t]
-        for u, v in zip(full_path[:-1], full_path[1:]):
-            edge = tuple(sorted([u, v])) if not is_directed else (u, v)
-            edge_scores[edge] += 1.0
+            utils.log(f"  Processed {num_samples:_} samples ({elapsed:.1f}s, {num_samples / elapsed:_.0f} samples/s)")
+            top = top_nodes(node_scores, args.top_n)
+            if args.stop_when_converged and prev_top is not None and \
+               np.array_equal(top, prev_top) and \
+               is_separated(node_scores, confidence_half_width(node_scores, num_samples, args.z), args.top_n):
+                utils.log(f"  Top {args.top_n} converged, stopping early")
+                break
+            prev_top = top
+
+    utils.log(f"Finished sampling. Samples: {num_samples:_}  Valid paths found: {valid_paths:_}")
 
-    utils.log(f"Finished sampling. Valid paths found: {valid_paths:_}")
-    
     # Sort and output nodes
-    scored_nodes = [(index2name[n], score) for n, score in node_scores.items()]
-    scored_nodes.sort(key=lambda x: x[1], reverse=True)
-    
+    half_widths = confidence_half_width(node_scores, num_samples, args.z)
+    top = top_nodes(node_scores, args.top_n)
+    top = top[node_scores[top] > 0]
     with open(args.out_nodes, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(["NodeName", "WeightedNodeBetweenness"])
-        for node_name, score in scored_nodes[:100]:
-            writer.writerow([node_name, score])
+        writer.writerow(["NodeName", "WeightedNodeBetweenness", "ConfidenceLow", "ConfidenceHigh"])
+        for n in top.tolist():
+            writer.writerow([index2name[n], node_scores[n],
+                             node_scores[n] - half_widths[n],
+                             node_scores[n] + half_widths[n]])
 
     # Sort and output edges
-    scored_edges = [((index2name[u], index2name[v]), score) for (u, v), score in edge_scores.items()]
-    scored_edges.sort(key=lambda x: x[1], reverse=True)
-    
+    scored_edges = [(divmod(edge, num_nodes), score)
+                    for edge, score in edge_scores.most_common(args.top_n)]
     with open(args.out_edges, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(["Node1", "Node2", "WeightedEdgeBetweenness"])
-        for (u_idx, v_idx), score in scored_edges[:100]:
-            writer.writerow([u_idx, v_idx, score])
+        for (u, v), score in scored_edges:
+            writer.writerow([index2name[u], index2name[v], score])
 
     utils.log("Done! Top 5 Nodes:")
-    for n, s in scored_nodes[:5]:
-        utils.log(f"  {n}: {s}")
-        
+    for n in top[:5].tolist():
+        utils.log(f"  {index2name[n]}: {node_scores[n]} ± {half_widths[n]:.1f}")
+
     utils.log("Top 5 Edges:")
     for (u, v), s in scored_edges[:5]:
-        utils.log(f"  {u} <-> {v}: {s}")
+        utils.log(f"  {index2name[u]} <-> {index2name[v]}: {s}")
 
 
 if __name__ == "__main__":
@@ -3,7 +3,6 @@ import csv
 import time
 
 import networkit as nk
-import networkx as nx
 
 import graph_tools
 import utils
@@ -16,33 +15,8 @@ def main():
     args = parser.parse_args()
 
     utils.log(f"Reading graph from {args.in_graph}")
-    Gnx = graph_tools.load_graph(args.in_graph)
-    
-    utils.log("Creating node conversion mappings")
-    name2index = {node: index for index, node in enumerate(Gnx.nodes())}
-    index2name = {index: node for node, index in name2index.items()}
-    
-    is_directed = Gnx.is_directed()
-    is_weighted = graph_tools.is_weighted(Gnx)
-    
-    utils.log("Converting graph to NetworKit")
-    Gnk = nk.Graph(Gnx.number_of_nodes(), directed=is_directed, weighted=is_weighted)
-    
-    added_edges = {}
-    for u, v, data in Gnx.edges(data=True):
-        u_idx, v_idx = name2index[u], name2index[v]
-        if not is_directed and u_idx > v_idx:
-            u_idx, v_idx = v_idx, u_idx
-        weight = data.get('weight', 1.0)
-        edge_key = (u_idx, v_idx)
-        if edge_key not in added_edges or weight < added_edges[edge_key]:
-            added_edges[edge_key] = weight
-
-    for (u_idx, v_idx), weight in added_edges.items():
-        if is_weighted:
-            Gnk.addEdge(u_idx, v_idx, w=weight)
-        else:
-            Gnk.addEdge(u_idx, v_idx)
+    Gnk, index2name = graph_tools.load_graph_nk_collapsed(args.in_graph)
+    utils.log(f"Loaded graph: {Gnk.numberOfNodes():_} nodes, {Gnk.numberOfEdges():_} edges")
 
     Gnk.removeSelfLoops()
 
@@ -34,7 +34,9 @@ from pathlib import Path
 import time
 
 import networkx as nx
+import numpy as np
 
+import csr_tools
 import graph_tools
 import utils
 
@@ -107,7 +109,9 @@ def ContractGraph(graph : nx.Graph, rep_nodes : dict[Node, set[Node]]) -> bool:
   return len(to_delete) > 0
 
 def FindCore(graph : nx.Graph) -> tuple[nx.MultiGraph, dict[Node, set[Node]]]:
-  """Iteratively contract the graph until we reach the core."""
+  """Iteratively contract the graph until we reach the core.
+
+  Reference implementation, FindCoreArrays() is much faster on big graphs."""
   # Convert to weighted multigraph.
   graph = nx.MultiGraph(graph)
   nx.set_edge_attributes(graph, values = 1, name = 'weight')
@@ -118,6 +122,146 @@ def FindCore(graph : nx.Graph) -> tuple[nx.MultiGraph, dict[Node, set[Node]]]:
   return graph, rep_nodes
 
 
+def FindCoreArrays(num_nodes : int, sources : np.ndarray, targets : np.ndarray
+                   ) -> tuple[np.ndarray,
+                              tuple[np.ndarray, np.ndarray, np.ndarray],
+                              tuple[np.ndarray, np.ndarray]]:
+  """Array version of FindCore() for an undirected (multi)graph given as
+  parallel arrays of edge end node indexes.
+
+  Instead of repeatedly scanning all nodes, we:
+   1) Strip rays by peeling degree <= 1 nodes in waves (worklist of nodes
+      whose degree just dropped). Each stripped node forwards to the neighbor
+      it was attached to, like union-find parent pointers.
+   2) Lift all paths at once: Lifting never changes the degree of the ends,
+      so after (1) every chain of degree 2 nodes (found with union-find)
+      becomes a single edge between its two (degree >= 3) ends.
+  Every node collapses into the core node(s) that its forwards lead to.
+
+  Returns (core_nodes, (core_sources, core_targets, core_weights),
+  (rep_cores, rep_subs)) where core_nodes are sorted node indexes and
+  rep_cores[i] is a core node that node rep_subs[i] collapses into (sorted by
+  core node, then sub node).
+  """
+  sources = np.asarray(sources, dtype=np.int64)
+  targets = np.asarray(targets, dtype=np.int64)
+  # Symmetric CSR: Every edge is listed from both ends (self-loops count
+  # twice in the degree, like networkx).
+  slot_nodes = np.concatenate([sources, targets])
+  order = np.argsort(slot_nodes, kind="stable")
+  neighbors = np.concatenate([targets, sources])[order]
+  offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+  np.cumsum(np.bincount(slot_nodes, minlength=num_nodes), out=offsets[1:])
+  degree = np.diff(offsets)
+  del slot_nodes, order
+
+  # (1) Strip rays.
+  alive = np.ones(num_nodes, dtype=bool)
+  # Node that each stripped node was attached to (self if none).
+  parent = np.arange(num_nodes)
+  frontier = np.flatnonzero(degree <= 1)
+  while len(frontier):
+    alive[frontier] = False
+    frontier, positions = csr_tools.expand_slots(offsets, frontier)
+    attached = neighbors[positions]
+    keep = alive[attached]
+    # Note: Each node has at most one alive neighbor left.
+    frontier, attached = frontier[keep], attached[keep]
+    parent[frontier] = attached
+    attached, counts = np.unique(attached, return_counts=True)
+    degree[attached] -= counts
+    frontier = attached[degree[attached] <= 1]
+
+  # (2) Lift paths.
+  is_path = alive & (degree == 2)
+  is_core = alive & ~is_path
+  path_nodes = np.flatnonzero(is_path)
+  path_nodes, positions = csr_tools.expand_slots(offsets, path_nodes)
+  path_neighbors = neighbors[positions]
+  keep = alive[path_neighbors]
+  path_nodes, path_neighbors = path_nodes[keep], path_neighbors[keep]
+  inner = is_path[path_neighbors]
+  labels = np.arange(num_nodes)
+  csr_tools.union_labels(labels, path_nodes[inner], path_neighbors[inner])
+  # Each path has exactly 2 slots out to its ends (cycles have none).
+  path_labels = labels[path_nodes[~inner]]
+  path_ends = path_neighbors[~inner]
+  order = np.argsort(path_labels, kind="stable")
+  path_labels, path_ends = path_labels[order], path_ends[order]
+  assert np.array_equal(path_labels[0::2], path_labels[1::2]), "Unexpected path"
+  path_labels = path_labels[0::2]
+  end_a = np.full(num_nodes, -1)
+  end_b = np.full(num_nodes, -1)
+  end_a[path_labels] = path_ends[0::2]
+  end_b[path_labels] = path_ends[1::2]
+  path_lens = np.bincount(labels[np.flatnonzero(is_path)], minlength=num_nodes)
+
+  core_edges = is_core[sources] & is_core[targets]
+  core_sources = np.concatenate([sources[core_edges], end_a[path_labels]])
+  core_targets = np.concatenate([targets[core_edges], end_b[path_labels]])
+  # All original edges have weight 1, so lifted edge weight is # edges in path.
+  core_weights = np.concatenate([np.ones(core_edges.sum(), dtype=np.int64),
+                                 path_lens[path_labels] + 1])
+
+  # Follow forwards: stripped nodes -> ... -> core node or path.
+  while True:
+    grand_parent = parent[parent]
+    if np.array_equal(grand_parent, parent):
+      break
+    parent = grand_parent
+  subs = np.arange(num_nodes)
+  to_core = is_core[parent]
+  # Path nodes collapse into both ends (only once if both ends are the same).
+  on_path = is_path[parent]
+  path_subs = subs[on_path]
+  path_a = end_a[labels[parent[path_subs]]]
+  path_b = end_b[labels[parent[path_subs]]]
+  # Note: Cycles (path_a == -1) and stripped components collapse into nothing.
+  keep_a = path_a >= 0
+  keep_b = keep_a & (path_b != path_a)
+  rep_cores = np.concatenate([parent[to_core], path_a[keep_a], path_b[keep_b]])
+  rep_subs = np.concatenate([subs[to_core], path_subs[keep_a], path_subs[keep_b]])
+  order = np.lexsort((rep_subs, rep_cores))
+
+  return (np.flatnonzero(is_core), (core_sources, core_targets, core_weights),
+          (rep_cores[order], rep_subs[order]))
+
+def FindCoreGraph(graph : nx.Graph
+                  ) -> tuple[nx.MultiGraph, list[Node], tuple[np.ndarray, np.ndarray]]:
+  """FindCore() using FindCoreArrays(). Returns (core graph, list of node
+  names by index, (rep_cores, rep_subs) node indexes)."""
+  nodes = list(graph.nodes)
+  node_index = {node: i for i, node in enumerate(nodes)}
+  num_edges = graph.number_of_edges()
+  sources = np.fromiter((node_index[u] for u, _ in graph.edges()),
+                        dtype=np.int64, count=num_edges)
+  targets = np.fromiter((node_index[v] for _, v in graph.edges()),
+                        dtype=np.int64, count=num_edges)
+  del node_index
+
+  core_nodes, (core_sources, core_targets, core_weights), reps = \
+    FindCoreArrays(len(nodes), sources, targets)
+  core = nx.MultiGraph()
+  core.add_nodes_from(nodes[i] for i in core_nodes.tolist())
+  core.add_weighted_edges_from(zip(
+    (nodes[i] for i in core_sources.tolist()),
+    (nodes[i] for i in core_targets.tolist()),
+    core_weights.tolist()))
+  return core, nodes, reps
+
+def write_collapse(filename : Path, nodes : list[Node],
+                   rep_cores : np.ndarray, rep_subs : np.ndarray,
+                   chunk_size : int = 1_000_000) -> None:
+  """Stream (core_node, sub_node) rows to CSV."""
+  with open(filename, "w") as f:
+    csv_out = csv.writer(f)
+    csv_out.writerow(["core_node", "sub_node"])
+    for start in range(0, len(rep_cores), chunk_size):
+      csv_out.writerows(zip(
+        (nodes[i] for i in rep_cores[start:start + chunk_size].tolist()),
+        (nodes[i] for i in rep_subs[start:start + chunk_size].tolist())))
+
+
 def RemoveRays(graph : nx.Graph) -> nx.Graph:
   """Remove all rays from graph."""
   points = set()
@@ -160,6 +304,10 @@ def num_dup_edges(graph : nx.MultiGraph) -> int:
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument("graph_in", type=Path)
+  parser.add_argument("--binary", action="store_true",
+                      help="Write output graphs in binary .csr format.")
+  parser.add_argument("--nx-core", action="store_true",
+                      help="Use (slow) networkx FindCore() reference implementation.")
   args = parser.parse_args()
 
   graph_dir = args.graph_in.parent
@@ -174,7 +322,7 @@ def main():
   utils.log(degree_distr_str(graph))
 
   basename = graph_dir / "connect"
-  filename = graph_tools.write_graph(graph, basename)
+  filename = graph_tools.write_graph(graph, basename, binary=args.binary)
   utils.log(f"  Saved main component to {str(filename)}")
 
   graph = graph_tools.largest_bicomponent(graph)
@@ -182,28 +330,34 @@ def main():
   utils.log(degree_distr_str(graph))
 
   basename = graph_dir / "biconnect"
-  filename = graph_tools.write_graph(graph, basename)
+  filename = graph_tools.write_graph(graph, basename, binary=args.binary)
   utils.log(f"  Saved main bicomponent to {str(filename)}")
 
-  # Map: core nodes -> nodes that collapse into this core node
-  graph, rep_nodes = FindCore(graph)
+  if args.nx_core:
+    # Map: core nodes -> nodes that collapse into this core node
+    graph, rep_nodes = FindCore(graph)
+  else:
+    graph, nodes, (rep_cores, rep_subs) = FindCoreGraph(graph)
   utils.log(f"Topological Core:  {len(graph.nodes):_} Nodes / {len(graph.edges):_} Edges / {num_dup_edges(graph):_} Duplicate edges / {nx.number_of_selfloops(graph):_} Selfloops")
   utils.log(degree_distr_str(graph))
 
   basename = graph_dir / "topo"
-  filename = graph_tools.write_graph(graph, basename)
+  filename = graph_tools.write_graph(graph, basename, binary=args.binary)
   utils.log(f"  Saved topo to {str(filename)}")
 
   filename = graph_dir / "topo.collapse.csv"
-  with open(filename, "w") as f:
-    csv_out = csv.DictWriter(f, ["core_node", "sub_node"])
-    csv_out.writeheader()
-    for core_node in rep_nodes:
-      for sub_node in rep_nodes[core_node]:
-        csv_out.writerow({
-          "core_node": core_node,
-          "sub_node": sub_node,
-        })
+  if args.nx_core:
+    with open(filename, "w") as f:
+      csv_out = csv.DictWriter(f, ["core_node", "sub_node"])
+      csv_out.writeheader()
+      for core_node in rep_nodes:
+        for sub_node in rep_nodes[core_node]:
+          csv_out.writerow({
+            "core_node": core_node,
+            "sub_node": sub_node,
+          })
+  else:
+    write_collapse(filename, nodes, rep_cores, rep_subs)
   utils.log(f"  Saved node collapse info to {str(filename)}")
 
 
@@ -1,9 +1,21 @@
+import argparse
 import pandas as pd
 import numpy as np
 import time
 from pathlib import Path
 import csv
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
+import networkx as nx
+
+import csr_tools
+import graph_core
+import utils
+
 def get_bipartite_edges(data_dir):
     print("Loading people...", flush=True)
     people = pd.read_parquet(data_dir / "people.parquet",
@@ -60,46 +72,37 @@ def get_bipartite_edges(data_dir):
     
     return edges, num_nodes, max_person, family_uniques
 
-def compute_topo_core(edges, num_nodes, max_person, family_uniques):
-    print("Building adjacency list...", flush=True)
+def build_adjacency(edges, num_nodes):
+    """Symmetric CSR of edges: Neighbors of u are adj[head[u]:head[u+1]],
+    in the order of the edges they came from."""
+    # Interleave (u, v) and (v, u) so that a stable sort keeps edge order.
+    ends = edges.ravel()
+    others = edges[:, ::-1].ravel()
+    order = np.argsort(ends, kind="stable")
     head = np.zeros(num_nodes + 1, dtype=np.int64)
-    for i in range(len(edges)):
-        u, v = edges[i]
-        head[u+1] += 1
-        head[v+1] += 1
-    
-    np.cumsum(head, out=head)
-    
-    adj = np.zeros(head[-1], dtype=np.int32)
-    cur_head = head[:-1].copy()
-    for i in range(len(edges)):
-        u, v = edges[i]
-        adj[cur_head[u]] = v
-        cur_head[u] += 1
-        adj[cur_head[v]] = u
-        cur_head[v] += 1
-        
-    print("Pruning leaves...", flush=True)
-    degree = np.zeros(num_nodes, dtype=np.int32)
-    for i in range(num_nodes):
-        degree[i] = head[i+1] - head[i]
-        
-    leaf_parent = np.full(num_nodes, -1, dtype=np.int32)
-    path_end1 = np.full(num_nodes, -1, dtype=np.int32)
-    path_end2 = np.full(num_nodes, -1, dtype=np.int32)
-        
+    np.cumsum(np.bincount(ends, minlength=num_nodes), out=head[1:])
+    adj = others[order].astype(np.int32)
+    return head, adj
+
+
+# Contraction kernels. Written as plain loops so that Numba can compile
+# them. Without Numba we use the vectorized NumPy versions below instead
+# (running these loops in the interpreter would be far too slow).
+
+def _prune_leaves_loop(head, adj, degree, leaf_parent):
+    num_nodes = len(degree)
     queue = np.zeros(num_nodes, dtype=np.int32)
     front, back = 0, 0
     for i in range(num_nodes):
         if degree[i] <= 1:
             queue[back] = i
             back += 1
-            
+
     while front < back:
         u = queue[front]
         front += 1
         degree[u] = 0
-        
+
         for idx in range(head[u], head[u+1]):
             v = adj[idx]
             if degree[v] > 0:
@@ -109,30 +112,36 @@ def compute_topo_core(edges, num_nodes, max_person, family_uniques):
                     queue[back] = v
                     back += 1
 
-    print("Collapsing paths (tracing from degree >= 3)...", flush=True)
-    core_edges = []
-    visited = np.zeros(num_nodes, dtype=bool)
-    
+def _collapse_paths_loop(head, adj, degree, path_end1, path_end2,
+                         core_u, core_v, core_w):
+    """Writes core edges into core_* arrays and returns number of them."""
+    num_nodes = len(degree)
+    num_core_edges = 0
+    visited = np.zeros(num_nodes, dtype=np.bool_)
+
     for u in range(num_nodes):
         if degree[u] >= 3:
             for idx in range(head[u], head[u+1]):
                 v = adj[idx]
                 if degree[v] == 0:
                     continue
-                
+
                 if degree[v] >= 3:
                     if u <= v:
-                        core_edges.append((u, v, 1))
-                        
+                        core_u[num_core_edges] = u
+                        core_v[num_core_edges] = v
+                        core_w[num_core_edges] = 1
+                        num_core_edges += 1
+
                 elif degree[v] == 2:
                     if visited[v]:
                         continue
-                    
+
                     prev = u
                     curr = v
                     path_len = 1
                     path_nodes = []
-                    
+
                     while degree[curr] == 2:
                         visited[curr] = True
                         path_nodes.append(curr)
@@ -142,20 +151,134 @@ def compute_topo_core(edges, num_nodes, max_person, family_uniques):
                             if n != prev and degree[n] > 0:
                                 next_node = n
                                 break
-                                
+
                         if next_node == -1:
                             break
                         prev = curr
                         curr = next_node
                         path_len += 1
-                        
+
                     if degree[curr] >= 3:
                         w = curr
-                        core_edges.append((u, w, path_len))
+                        core_u[num_core_edges] = u
+                        core_v[num_core_edges] = w
+                        core_w[num_core_edges] = path_len
+                        num_core_edges += 1
                         for x in path_nodes:
                             path_end1[x] = u
                             path_end2[x] = w
-                        
+    return num_core_edges
+
+if numba is not None:
+    _prune_leaves_loop = numba.njit(cache=True)(_prune_leaves_loop)
+    _collapse_paths_loop = numba.njit(cache=True)(_collapse_paths_loop)
+
+
+def _prune_leaves_numpy(head, adj, degree, leaf_parent):
+    """Vectorized _prune_leaves_loop: Peel all current leaves at once in waves.
+    Only differs in which of two adjacent last leaves is the parent (both
+    end up in a degree 0 root which is ignored)."""
+    # Note: Isolated nodes (Ex: unused user_nums) have nothing to peel.
+    alive = degree > 0
+    frontier = np.flatnonzero(degree == 1)
+    while len(frontier):
+        alive[frontier] = False
+        degree[frontier] = 0
+        nodes, positions = csr_tools.expand_slots(head, frontier)
+        attached = adj[positions]
+        keep = alive[attached]
+        nodes, attached = nodes[keep], attached[keep]
+        leaf_parent[nodes] = attached
+        attached, counts = np.unique(attached, return_counts=True)
+        degree[attached] -= counts
+        frontier = attached[degree[attached] <= 1]
+
+def _collapse_paths_numpy(head, adj, degree, path_end1, path_end2,
+                          core_u, core_v, core_w):
+    """Vectorized _collapse_paths_loop: Find all paths (chains of degree 2
+    nodes) at once with union-find. Core edges are listed in the same order."""
+    num_nodes = len(degree)
+    slot_nodes = np.repeat(np.arange(num_nodes), np.diff(head))
+    positions = np.arange(len(adj))
+    alive = (degree[slot_nodes] > 0) & (degree[adj] > 0)
+    is_path = degree == 2
+    is_core = degree >= 3
+
+    direct = alive & is_core[slot_nodes] & is_core[adj] & (slot_nodes <= adj)
+
+    # Union-find over just the path nodes (node ids are very sparse).
+    path_nodes = np.flatnonzero(is_path)
+    inner = alive & is_path[slot_nodes] & is_path[adj]
+    compact_labels = np.arange(len(path_nodes))
+    csr_tools.union_labels(compact_labels,
+                           np.searchsorted(path_nodes, slot_nodes[inner]),
+                           np.searchsorted(path_nodes, adj[inner]))
+    labels = np.full(num_nodes, -1)
+    labels[path_nodes] = path_nodes[compact_labels]
+    path_sizes = np.bincount(labels[path_nodes], minlength=num_nodes)
+    # Every path has two slots into it from core nodes. The loop version
+    # walks each path starting from the first of these.
+    entry = alive & is_core[slot_nodes] & is_path[adj]
+    entry_pos = positions[entry]
+    entry_labels = labels[adj[entry]]
+    order = np.lexsort((entry_pos, entry_labels))
+    entry_pos, entry_labels = entry_pos[order], entry_labels[order]
+    assert np.array_equal(entry_labels[0::2], entry_labels[1::2]), "Unexpected path"
+    path_labels = entry_labels[0::2]
+    path_start = entry_pos[0::2]
+    u = slot_nodes[path_start]
+    w = slot_nodes[entry_pos[1::2]]
+    # A single node with both edges to the same core node is a dead end.
+    keep = ~((path_sizes[path_labels] == 1) & (u == w))
+    path_labels, path_start, u, w = path_labels[keep], path_start[keep], u[keep], w[keep]
+
+    end1 = np.full(num_nodes, -1, dtype=path_end1.dtype)
+    end2 = np.full(num_nodes, -1, dtype=path_end2.dtype)
+    end1[path_labels] = u
+    end2[path_labels] = w
+    path_end1[path_nodes] = end1[labels[path_nodes]]
+    path_end2[path_nodes] = end2[labels[path_nodes]]
+
+    sort_keys = np.concatenate([positions[direct], path_start])
+    order = np.argsort(sort_keys, kind="stable")
+    num_core_edges = len(order)
+    core_u[:num_core_edges] = np.concatenate([slot_nodes[direct], u])[order]
+    core_v[:num_core_edges] = np.concatenate([adj[direct], w])[order]
+    core_w[:num_core_edges] = np.concatenate([
+        np.ones(direct.sum(), dtype=np.int64), path_sizes[path_labels] + 1])[order]
+    return num_core_edges
+
+
+def compute_topo_core(edges, num_nodes, max_person, family_uniques, use_numba=True):
+    """Returns (core_edges, leaf_parent, path_end1, path_end2, degree), where
+    core_edges is an array of (u, v, path_len) rows."""
+    if use_numba and numba is not None:
+        prune_leaves, collapse_paths = _prune_leaves_loop, _collapse_paths_loop
+    else:
+        prune_leaves, collapse_paths = _prune_leaves_numpy, _collapse_paths_numpy
+
+    print("Building adjacency list...", flush=True)
+    head, adj = build_adjacency(edges, num_nodes)
+
+    print("Pruning leaves...", flush=True)
+    degree = np.diff(head).astype(np.int32)
+    leaf_parent = np.full(num_nodes, -1, dtype=np.int32)
+    path_end1 = np.full(num_nodes, -1, dtype=np.int32)
+    path_end2 = np.full(num_nodes, -1, dtype=np.int32)
+    prune_leaves(head, adj, degree, leaf_parent)
+
+    print("Collapsing paths (tracing from degree >= 3)...", flush=True)
+    # There are never more core edges than adjacency slots (self-loops are
+    # listed from both of their slots).
+    core_u = np.zeros(len(adj), dtype=np.int64)
+    core_v = np.zeros(len(adj), dtype=np.int64)
+    core_w = np.zeros(len(adj), dtype=np.int64)
+    num_core_edges = collapse_paths(head, adj, degree, path_end1, path_end2,
+                                    core_u, core_v, core_w)
+    core_edges = np.column_stack((core_u[:num_core_edges],
+                                  core_v[:num_core_edges],
+                                  core_w[:num_core_edges]))
+
     print(f"Topological Core Edges Found: {len(core_edges)}")
     return core_edges, leaf_parent, path_end1, path_end2, degree
 
@@ -171,15 +294,60 @@ def node_to_str(node_id, max_person, family_uniques):
         else:
             return f"Union/{min_p}/{max_p}"
 
+def benchmark(edges, num_nodes, max_person, family_uniques):
+    """Time each topo core implementation on the same graph."""
+    results = {}
+    implementations = [("numpy", False)]
+    if numba is not None:
+        # Compile (or load cached) kernels before timing.
+        compute_topo_core(edges[:10], num_nodes, max_person, family_uniques)
+        implementations.insert(0, ("numba", True))
+    for name, use_numba in implementations:
+        t = time.time()
+        results[name] = compute_topo_core(edges, num_nodes, max_person, family_uniques,
+                                          use_numba=use_numba)[0]
+        print(f"compute_topo_core ({name}): {time.time()-t:.2f}s", flush=True)
+    if "numba" in results:
+        assert np.array_equal(results["numba"], results["numpy"])
+
+    t = time.time()
+    # FindCoreArrays expects dense node indexes.
+    nodes, dense_edges = np.unique(edges, return_inverse=True)
+    dense_edges = dense_edges.reshape(edges.shape)
+    _, (core_sources, _, _), _ = graph_core.FindCoreArrays(
+        len(nodes), dense_edges[:, 0], dense_edges[:, 1])
+    print(f"graph_core.FindCoreArrays: {time.time()-t:.2f}s ({len(core_sources)} core edges)", flush=True)
+
+    t = time.time()
+    graph = nx.MultiGraph()
+    graph.add_edges_from(edges.tolist())
+    print(f"Built networkx graph: {time.time()-t:.2f}s", flush=True)
+    t = time.time()
+    core, _ = graph_core.FindCore(graph)
+    print(f"graph_core.FindCore: {time.time()-t:.2f}s ({len(core.edges)} core edges)", flush=True)
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--version", help="Data version (defaults to most recent).")
+    parser.add_argument("--no-numba", action="store_true",
+                        help="Use the NumPy kernels even if Numba is installed.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare against graph_core instead of writing output.")
+    args = parser.parse_args()
+
     t0 = time.time()
-    data_dir = Path("data/version/default")
+    data_dir = utils.data_version_dir(args.version)
     edges, num_nodes, max_person, family_uniques = get_bipartite_edges(data_dir)
     print(f"Bipartite Graph: {num_nodes} nodes, {len(edges)} edges", flush=True)
     print(f"Time to parse edges: {time.time()-t0:.2f}s", flush=True)
-    
+
+    if args.benchmark:
+        benchmark(edges, num_nodes, max_person, family_uniques)
+        return
+
     t1 = time.time()
-    core_edges, leaf_parent, path_end1, path_end2, degree = compute_topo_core(edges, num_nodes, max_person, family_uniques)
+    core_edges, leaf_parent, path_end1, path_end2, degree = compute_topo_core(
+        edges, num_nodes, max_person, family_uniques, use_numba=not args.no_numba)
     print(f"Time to compute core: {time.time()-t1:.2f}s", flush=True)
     
     out_dir = data_dir / "graphs" / "bipartite"
@@ -90,6 +90,9 @@ def main():
   basename = graph_dir / "all"
   filename = graph_tools.write_graph(graph, basename)
   utils.log(f"Saved graph to {str(filename)}")
+  # Binary copy which loads much faster (Ex: for graph_core.py).
+  filename = graph_tools.write_graph(graph, basename, binary=True)
+  utils.log(f"Saved graph to {str(filename)}")
 
   utils.log("Finished")
 
@@ -16,11 +16,12 @@ def main():
   Gnk, names_db = graph_tools.load_graph_nk(args.in_graph)
 
   utils.log("Converting graph")
+  names = names_db.all_index2names()
   Gnx = nx.Graph()
   for node in Gnk.iterNodes():
-    Gnx.add_node(names_db.index2name(node))
+    Gnx.add_node(names[node])
   for (node_a, node_b) in Gnk.iterEdges():
-    Gnx.add_edge(names_db.index2name(node_a), names_db.index2name(node_b))
+    Gnx.add_edge(names[node_a], names[node_b])
 
   utils.log("Writing graph")
   graph_tools.write_graph(Gnx, args.out_graph)
@@ -30,11 +30,8 @@ def main():
   nk.graphio.writeGraph(Gnk, args.out_graph, nk.Format.METIS)
 
   utils.log("Writing node names")
-  names_db = graph_tools.NamesDb(f"{args.out_graph}.names.db")
-  names_db.create_table()
-  for node_name, index in name2index.items():
-    names_db.insert(index, node_name)
-  names_db.commit()
+  # Note: name2index is in index order.
+  graph_tools.write_names(name2index.keys(), args.out_graph)
 
   utils.log("Finished")
 
@@ -4,6 +4,11 @@ import sqlite3
 
 import networkit as nk
 import networkx as nx
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import index_tools
 
 
 class NamesDb:
@@ -16,6 +21,9 @@ class NamesDb:
 
   def create_table(self):
     cursor = self.conn.cursor()
+    # We always write the whole table at once, no need for durability.
+    cursor.execute("PRAGMA journal_mode = OFF")
+    cursor.execute("PRAGMA synchronous = OFF")
     cursor.execute("DROP TABLE IF EXISTS nodes")
     cursor.execute("""CREATE TABLE nodes (
       graph_index INT,
@@ -26,6 +34,10 @@ class NamesDb:
     cursor = self.conn.cursor()
     cursor.execute("INSERT INTO nodes VALUES (?,?)", (graph_index, node_name))
 
+  def insert_mult(self, rows):
+    """Insert many (graph_index, node_name) rows."""
+    self.conn.executemany("INSERT INTO nodes VALUES (?,?)", rows)
+
   def commit(self):
     self.conn.commit()
 
@@ -45,6 +57,11 @@ class NamesDb:
     assert len(rows) == 1, (node_name, rows)
     return rows[0]["graph_index"]
 
+  def index2names(self, graph_indexes):
+    """Bulk index2name."""
+    all_names = self.all_index2names()
+    return [all_names[graph_index] for graph_index in graph_indexes]
+
   def all_index2names(self):
     cursor = self.conn.cursor()
     cursor.execute("SELECT graph_index, node_name FROM nodes")
@@ -52,18 +69,293 @@ class NamesDb:
     return {row["graph_index"]: row["node_name"] for row in rows}
 
 
+def _names_location(graph_filename):
+  """(directory, prefix) of the names StringTable for graph_filename.
+  .csr graphs are directories and keep their names inside."""
+  graph_filename = Path(graph_filename)
+  if ".csr" in graph_filename.suffixes:
+    return graph_filename, "names"
+  return graph_filename.parent, f"{graph_filename.name}.names"
+
+class NamesTable:
+  """Memory-mapped array-backed node names sidecar ({graph}.names.*.npy).
+
+  Same interface as NamesDb, but index2name is an O(1) array lookup and
+  name2index is a hash lookup (see index_tools.StringTable), so it is cheap
+  to call inside loops over millions of nodes.
+  """
+  def __init__(self, graph_filename):
+    self.table = index_tools.StringTable(*_names_location(graph_filename))
+
+  @staticmethod
+  def exists(graph_filename):
+    directory, prefix = _names_location(graph_filename)
+    return Path(directory, f"{prefix}.offsets.npy").exists()
+
+  @staticmethod
+  def write(graph_filename, names):
+    directory, prefix = _names_location(graph_filename)
+    index_tools.StringTable.write(Path(directory), prefix,
+                                  pa.array(list(names), pa.string()))
+
+  def index2name(self, graph_index):
+    name = self.table.get(graph_index)
+    assert name is not None, graph_index
+    return name
+
+  def name2index(self, node_name):
+    return self.table.index_of(node_name)
+
+  def index2names(self, graph_indexes):
+    """Bulk index2name."""
+    return self.table.get_mult(graph_indexes)
+
+  def names2indexes(self, node_names):
+    """Bulk name2index. Unknown names are mapped to -1."""
+    return self.table.indexes_of(node_names)
+
+  def all_index2names(self):
+    return dict(enumerate(self.table.get_mult(range(len(self.table)))))
+
+
+def write_names(names, graph_filename, sqlite_export=True):
+  """Write node names (in graph index order) for graph_filename.
+  Optionally also write the (slower) legacy SQLite NamesDb."""
+  names = list(names)
+  NamesTable.write(graph_filename, names)
+  if sqlite_export:
+    names_db = NamesDb(f"{graph_filename}.names.db")
+    names_db.create_table()
+    names_db.insert_mult(enumerate(names))
+    names_db.commit()
+
+def load_names(graph_filename):
+  """Load NamesTable if available, otherwise fall back to NamesDb."""
+  if NamesTable.exists(graph_filename):
+    return NamesTable(graph_filename)
+  return NamesDb(f"{graph_filename}.names.db")
+
+
+class CsrGraph:
+  """Memory-mapped binary graph ({basename}[.di][.multi][.weight].csr/).
+
+  A directory of flat .npy arrays, edges grouped by source node:
+   * offsets.npy: int64 [num_nodes + 1]. Edges out of node i are
+     targets[offsets[i]:offsets[i+1]] (and weights[...] if weighted).
+   * targets.npy: int32 node index of each edge's other end.
+   * weights.npy: float32 edge weights (only for weighted graphs). NaN for
+     edges without a weight (see is_weighted()).
+   * names.*.npy: NamesTable of node names by node index.
+  Undirected edges are stored once (in the direction they were written).
+  """
+  def __init__(self, filename):
+    self.filename = Path(filename)
+    self.directed = ".di" in self.filename.suffixes
+    self.multi = ".multi" in self.filename.suffixes
+    self.offsets = np.load(self.filename / "offsets.npy", mmap_mode="r")
+    self.targets = np.load(self.filename / "targets.npy", mmap_mode="r")
+    if (self.filename / "weights.npy").exists():
+      self.weights = np.load(self.filename / "weights.npy", mmap_mode="r")
+    else:
+      self.weights = None
+    self.names = NamesTable(self.filename)
+
+  @property
+  def num_nodes(self):
+    return len(self.offsets) - 1
+
+  @property
+  def num_edges(self):
+    return len(self.targets)
+
+  def sources(self):
+    """int32 source node index of each edge (parallel to targets)."""
+    return np.repeat(np.arange(self.num_nodes, dtype=np.int32),
+                     np.diff(self.offsets))
+
+  def node_names(self):
+    return self.names.index2names(range(self.num_nodes))
+
+  def to_nx(self, g_type=None):
+    if g_type is None:
+      g_type = {(False, False): nx.Graph, (True, False): nx.DiGraph,
+                (False, True): nx.MultiGraph, (True, True): nx.MultiDiGraph
+                }[self.directed, self.multi]
+    graph = g_type()
+    names = self.node_names()
+    # Add all nodes first to keep isolated nodes and node order.
+    graph.add_nodes_from(names)
+    sources = [names[i] for i in self.sources().tolist()]
+    targets = [names[i] for i in self.targets.tolist()]
+    if self.weights is not None:
+      graph.add_edges_from(
+        (u, v, {"weight": w} if w == w else {})  # w != w for NaN
+        for u, v, w in zip(sources, targets,
+                           self.weights.astype(np.float64).tolist()))
+    else:
+      graph.add_edges_from(zip(sources, targets))
+    return graph
+
+  def to_nk(self):
+    weighted = self.weights is not None
+    weights = np.ones(self.num_edges, dtype=np.float64)
+    if weighted:
+      weights = np.nan_to_num(np.asarray(self.weights, dtype=np.float64), nan=1.0)
+    return nk.GraphFromCoo(
+      (weights, (self.sources().astype(np.uint64),
+                 self.targets.astype(np.uint64))),
+      n=self.num_nodes, weighted=weighted, directed=self.directed)
+
+  @staticmethod
+  def write_arrays(filename, names, sources, targets, weights=None):
+    """Write graph given node names and parallel edge arrays (node indexes)."""
+    filename = Path(filename)
+    filename.mkdir(parents=True, exist_ok=True)
+    names = list(names)
+    sources = np.asarray(sources, dtype=np.int32)
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(names)), out=offsets[1:])
+
+    np.save(filename / "targets.npy", np.asarray(targets, dtype=np.int32)[order])
+    if weights is not None:
+      np.save(filename / "weights.npy", np.asarray(weights, dtype=np.float32)[order])
+    else:
+      (filename / "weights.npy").unlink(missing_ok=True)
+    NamesTable.write(filename, names)
+    # Written last so that readers only see complete graphs.
+    np.save(filename / "offsets.npy", offsets)
+
+  @staticmethod
+  def write(graph, filename):
+    """Write nx graph. Node names are str() of the nx nodes."""
+    nodes = list(graph.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    # Each undirected edge is listed once by graph.edges.
+    edges = graph.edges(data="weight", default=np.nan)
+    num_edges = graph.number_of_edges()
+    sources = np.fromiter((node_index[u] for u, _, _ in edges),
+                          dtype=np.int32, count=num_edges)
+    targets = np.fromiter((node_index[v] for _, v, _ in edges),
+                          dtype=np.int32, count=num_edges)
+    weights = None
+    if ".weight" in Path(filename).suffixes:
+      weights = np.fromiter((w for _, _, w in edges),
+                            dtype=np.float32, count=num_edges)
+    CsrGraph.write_arrays(filename, (str(node) for node in nodes),
+                          sources, targets, weights)
+
+
 def load_graph_nk(filename):
   """Returns pair (G, names_db) of graph and the tool for converting
   node indexes to names."""
   filename = Path(filename)
-  if ".graph" in filename.suffixes:
+  if ".csr" in filename.suffixes:
+    csr = CsrGraph(filename)
+    return csr.to_nk(), csr.names
+
+  elif ".graph" in filename.suffixes:
     # TODO: Submit bug to nk team about accepting Path as arg.
     return (nk.graphio.readGraph(str(filename), nk.Format.METIS),
-            NamesDb(f"{filename}.names.db"))
+            load_names(filename))
+
+  else:
+    raise Exception(f"Invalid graph filename: {filename}")
+
+def _read_adjlist_arrays(filename):
+  """Read nx adjacency list file. Returns (names, sources, targets)."""
+  tokens = []
+  line_lengths = []
+  with open(filename) as f:
+    for line in f:
+      # Same parsing as nx.read_adjlist
+      line_tokens = line.split("#", 1)[0].split()
+      if line_tokens:
+        tokens.extend(line_tokens)
+        line_lengths.append(len(line_tokens))
+  # Node indexes in order of first appearance (like nx).
+  codes, names = pd.factorize(np.array(tokens, dtype=object))
+  line_lengths = np.array(line_lengths, dtype=np.int64)
+  is_head = np.zeros(len(codes), dtype=bool)
+  is_head[np.cumsum(line_lengths) - line_lengths] = True
+  sources = np.repeat(codes[is_head], line_lengths - 1)
+  return list(names), sources, codes[~is_head]
+
+def _read_edgelist_arrays(filename):
+  """Read nx weighted edge list file. Returns (names, sources, targets, weights)."""
+  edges = pd.read_csv(filename, sep=" ", header=None, names=["u", "v", "weight"],
+                      dtype={"u": str, "v": str, "weight": np.float64},
+                      comment="#")
+  # Node indexes in order of first appearance (like nx).
+  codes, names = pd.factorize(
+    np.column_stack([edges["u"].to_numpy(), edges["v"].to_numpy()]).ravel())
+  codes = codes.reshape(-1, 2)
+  return list(names), codes[:, 0], codes[:, 1], edges["weight"].to_numpy()
+
+def load_edge_arrays(filename):
+  """Load graph as parallel edge arrays (without building an nx graph).
+
+  Returns (names, sources, targets, weights) where names is the list of node
+  names by node index and weights is None for unweighted graphs. In weighted
+  graphs, edges without a weight have NaN weight.
+  """
+  filename = Path(filename)
+  if ".csr" in filename.suffixes:
+    csr = CsrGraph(filename)
+    weights = None
+    if csr.weights is not None:
+      weights = np.asarray(csr.weights, dtype=np.float64)
+    return csr.node_names(), csr.sources(), np.asarray(csr.targets), weights
+
+  elif ".adj" in filename.suffixes:
+    return _read_adjlist_arrays(filename) + (None,)
+
+  elif ".edges" in filename.suffixes:
+    return _read_edgelist_arrays(filename)
 
   else:
     raise Exception(f"Invalid graph filename: {filename}")
 
+def collapse_parallel_edges(sources, targets, weights, directed):
+  """Keep only one edge (with minimum weight) between each pair of nodes.
+  Returns (sources, targets, weights)."""
+  sources = np.asarray(sources, dtype=np.int64)
+  targets = np.asarray(targets, dtype=np.int64)
+  if not directed:
+    sources, targets = np.minimum(sources, targets), np.maximum(sources, targets)
+  num_nodes = max(sources.max(initial=-1), targets.max(initial=-1)) + 1
+  keys = sources * num_nodes + targets
+  # Sort by pair, then weight, so the first edge of each pair is the minimum.
+  order = np.lexsort((weights, keys))
+  keys = keys[order]
+  first = np.ones(len(keys), dtype=bool)
+  first[1:] = keys[1:] != keys[:-1]
+  order = order[first]
+  return sources[order], targets[order], weights[order]
+
+def load_graph_nk_collapsed(filename):
+  """Load graph as a simple (non-multi) networkit graph, collapsing parallel
+  edges to the one with minimum weight (which is all shortest path algorithms
+  care about). Built directly from edge arrays, no nx graph is created.
+
+  Returns pair (G, names) where names is the list of node names by index.
+  """
+  filename = Path(filename)
+  directed = ".di" in filename.suffixes
+  names, sources, targets, weights = load_edge_arrays(filename)
+  weighted = weights is not None
+  if weighted:
+    # Edges without weights count as weight 1 (like nx).
+    weights = np.nan_to_num(weights, nan=1.0)
+  else:
+    weights = np.ones(len(sources), dtype=np.float64)
+  sources, targets, weights = collapse_parallel_edges(
+    sources, targets, weights, directed)
+  graph = nk.GraphFromCoo(
+    (weights, (sources.astype(np.uint64), targets.astype(np.uint64))),
+    n=len(names), weighted=weighted, directed=directed)
+  return graph, names
+
 def load_graph(filename : Path) -> nx.Graph:
   """Load a graph from various formats depending on the extensions."""
   filename = Path(filename)
@@ -80,7 +372,10 @@ def load_graph(filename : Path) -> nx.Graph:
     else:
       g_type = nx.Graph
 
-  if ".adj" in filename.suffixes:
+  if ".csr" in filename.suffixes:
+    return CsrGraph(filename).to_nx(g_type)
+
+  elif ".adj" in filename.suffixes:
     return nx.read_adjlist(filename, create_using=g_type)
 
   elif ".edges" in filename.suffixes:
@@ -89,8 +384,10 @@ def load_graph(filename : Path) -> nx.Graph:
   else:
     raise Exception(f"Invalid graph filename: {filename}")
 
-def write_graph(graph : nx.Graph, basename_path : Path) -> Path:
-  """Write a graph into various formats depending on Type."""
+def write_graph(graph : nx.Graph, basename_path : Path,
+                binary : bool = False) -> Path:
+  """Write a graph into various formats depending on Type.
+  If binary, write a memory-mappable .csr graph (see CsrGraph)."""
   basename = str(basename_path)
 
   if graph.is_directed():
@@ -99,7 +396,13 @@ def write_graph(graph : nx.Graph, basename_path : Path) -> Path:
   if graph.is_multigraph():
     basename += ".multi"
 
-  if is_weighted(graph):
+  if binary:
+    if is_weighted(graph):
+      basename += ".weight"
+    filename = Path(basename + ".csr")
+    CsrGraph.write(graph, filename)
+
+  elif is_weighted(graph):
     filename = Path(basename + ".weight.edges.nx")
     nx.write_weighted_edgelist(graph, filename)
 
@@ -114,12 +417,14 @@ def write_graph_nk(graph, names, filename):
   if ".graph" in filename.suffixes:
     # TODO: Submit bug to nk team about accepting Path as arg.
     nk.graphio.writeGraph(graph, str(filename), nk.Format.METIS)
-    # Write names into sibling db file.
-    names_db = NamesDb(f"{filename}.names.db")
-    names_db.create_table()
-    for index, node_name in enumerate(names):
-      names_db.insert(index, node_name)
-    names_db.commit()
+    # Write names into sibling files.
+    write_names(names, filename)
+
+  elif ".csr" in filename.suffixes:
+    edges = np.array([(u, v, w) for u, v, w in graph.iterEdgesWeights()],
+                     dtype=np.float64).reshape(-1, 3)
+    CsrGraph.write_arrays(filename, names, edges[:, 0], edges[:, 1],
+                          edges[:, 2] if graph.isWeighted() else None)
 
   else:
     raise Exception(f"Invalid graph filename: {filename}")
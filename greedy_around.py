@@ -6,9 +6,10 @@ import time
 import data_reader
 import distances
 
-def greedy_path(db, start, visited):
+def greedy_path(db, start, visited, output=print):
   """Use greedy algorithm to find a local minimum for (average distance to other
-  people in graph) starting at a specific person."""
+  people in graph) starting at a specific person.
+  Progress lines are passed to output."""
   person = start
   if person in visited:
     return
@@ -17,7 +18,7 @@ def greedy_path(db, start, visited):
 
   best_mean = d_mean
   while person:
-    print("Best neighbor\t%s\t%s\t%s" % (
+    output("Best neighbor\t%s\t%s\t%s" % (
             db.name_of(person), db.num2id(person), best_mean))
     best_neigh = None
     for neigh in db.neighbors_of(person):
@@ -25,7 +26,7 @@ def greedy_path(db, start, visited):
         visited.add(neigh)
         start_time = time.time()
         d_mean, d_max = distances.get_mean_dists(db, neigh)
-        print(" - Person\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % (
+        output(" - Person\t%s\t%s\t%s\t%s\t%s\t%s\t%s" % (
                 len(visited), db.name_of(neigh), db.num2id(neigh),
                 start_dists[neigh], d_mean, d_max, time.time() - start_time))
         if d_mean < best_mean:
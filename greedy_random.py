@@ -1,24 +1,97 @@
+import argparse
+from pathlib import Path
 import random
 import sys
+import tempfile
+
+import numpy as np
 
 import data_reader
 from distances import get_distances
 import greedy_around
+import utils
+
+
+class VisitedBitmap:
+  """Set of visited people shared by all worker processes: a memory-mapped
+  file with one byte per dense person index of the adjacency snapshot.
+  Note: Two walks may occasionally both evaluate the same person (add is not
+  atomic with the check), which is harmless."""
+  def __init__(self, adjacency, filename : Path, create : bool = False) -> None:
+    self.adjacency = adjacency
+    self.visited = np.memmap(filename, dtype=bool, shape=(adjacency.num_people,),
+                             mode=("w+" if create else "r+"))
+
+  def __contains__(self, person : int) -> bool:
+    return bool(self.visited[self.adjacency.index_of(person)])
+
+  def add(self, person : int) -> None:
+    self.visited[self.adjacency.index_of(person)] = True
+
+  def __len__(self) -> int:
+    return int(np.count_nonzero(self.visited))
+
+
+# Database and visited people for each worker process (see init_worker).
+_db = None
+_visited = None
+
+def init_worker(version, visited_filename):
+  global _db, _visited
+  # Note: The adjacency snapshot is memory-mapped, so all workers share the
+  # same pages of it.
+  _db = data_reader.Database(version)
+  _visited = VisitedBitmap(_db.adjacency, visited_filename)
+
+def greedy_walk(start):
+  """Worker: Run greedy_path from start. Returns output lines."""
+  lines = []
+  greedy_around.greedy_path(_db, start, _visited, output=lines.append)
+  return lines
 
 def main():
-  db = data_reader.Database()
-  db.load_connections()
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="Number of greedy walks to run in parallel processes.")
+  args = parser.parse_args()
+
+  db = data_reader.Database(args.version)
+  if args.workers > 1:
+    assert db.adjacency, "--workers requires adjacency snapshot (run csr_tools.py)"
+  elif not db.adjacency:
+    db.load_connections()
 
   anchor_id = "Tudor-4"  # King Henry
   anchor = db.id2num(anchor_id)
 
   main_tree, _, anchor_mean, anchor_max = get_distances(db, anchor)
   print(anchor_id, "{:,}".format(len(main_tree)), "\t", anchor_mean, anchor_max)
+  main_people = list(main_tree)
+
+  if args.workers > 1:
+    with tempfile.TemporaryDirectory() as temp_dir:
+      visited_filename = Path(temp_dir, "visited.bin")
+      visited = VisitedBitmap(db.adjacency, visited_filename, create=True)
+      def starts():
+        # Each person is tried once, in random order, so we never start two
+        # walks from the same person (even if the first is still running).
+        for person in random.sample(main_people, len(main_people)):
+          if person not in visited:
+            yield person
+
+      for lines in utils.parallel_imap(
+          greedy_walk, starts(), args.workers,
+          initializer=init_worker, initargs=(args.version, visited_filename)):
+        print("\n".join(lines))
+        sys.stdout.flush()
 
-  visited = set()
-  while len(visited) < len(main_tree):
-    person = random.choice(main_tree.keys())
-    if person not in visited:
-      greedy_around.greedy_path(db, person, visited)
+  else:
+    visited = set()
+    while len(visited) < len(main_people):
+      person = random.choice(main_people)
+      if person not in visited:
+        greedy_around.greedy_path(db, person, visited)
 
-main()
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,243 @@
+"""
+Canonical dense person index shared by the adjacency snapshot (csr_tools),
+array BFS, partitions and circles.
+
+Note: Graph files (graph_tools) are keyed by node names which are not always
+people (Ex: family union nodes), so they keep their own name tables (built
+on the StringTable below) rather than using this index.
+
+Built once per dump from people.parquet and rel_all.parquet. Every person
+(anyone with a profile or mentioned in a relationship) gets a dense index
+0..N-1 in user_num order. All arrays are memory-mapped, so lookups do not
+need SQLite and whole arrays can be translated at once in either direction.
+
+Files (in data/version/{version}/index/):
+ * user_nums.npy: sorted int32 user_nums. Position = dense person index.
+ * wikitree_ids.*.npy: StringTable of wikitree_id by dense index.
+"""
+
+import argparse
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from sqlite_reader import UserNum, WikiId
+import utils
+
+
+# Number of strings to hash at once while building (bounds memory of the
+# temporary Python objects).
+HASH_CHUNK_SIZE = 1_000_000
+
+def hash_strings(strings : Sequence[str] | np.ndarray) -> np.ndarray:
+  """Stable uint64 hash of each string."""
+  return pd.util.hash_array(np.asarray(strings, dtype=object), categorize=False)
+
+
+class StringTable:
+  """Memory-mapped read-only table of strings by dense index, with hashed
+  lookup from string back to index.
+
+  Files ({prefix}.*.npy):
+   * offsets: int64 [N + 1]. String i is bytes[offsets[i]:offsets[i+1]].
+   * bytes: uint8 UTF-8 data.
+   * hashes: sorted uint64 hash_strings() of all strings.
+   * order: int32 index of the string with each of hashes.
+  Empty strings are used for missing values and are never found by lookup.
+  """
+  def __init__(self, directory : Path, prefix : str) -> None:
+    self.directory = Path(directory)
+    self.prefix = prefix
+    self.offsets = self._load("offsets")
+    self.bytes = self._load("bytes")
+    self.hashes = self._load("hashes")
+    self.order = self._load("order")
+
+  def _load(self, name : str) -> np.ndarray:
+    return np.load(self.directory / f"{self.prefix}.{name}.npy", mmap_mode="r")
+
+  def __len__(self) -> int:
+    return len(self.offsets) - 1
+
+  def get(self, index : int) -> str | None:
+    start, end = self.offsets[index], self.offsets[index + 1]
+    if start == end:
+      return None
+    return self.bytes[start:end].tobytes().decode("utf-8")
+
+  def get_mult(self, indexes : Iterable[int]) -> list[str | None]:
+    return [self.get(index) for index in indexes]
+
+  def index_of(self, string : str) -> int:
+    """Raises KeyError if string is not in table."""
+    index = int(self.indexes_of([string])[0])
+    if index < 0:
+      raise KeyError(string)
+    return index
+
+  def indexes_of(self, strings : Sequence[str]) -> np.ndarray:
+    """Vectorized index_of. Missing strings are mapped to -1."""
+    strings = list(strings)
+    indexes = np.full(len(strings), -1, dtype=np.int64)
+    if not strings or not len(self.hashes):
+      return indexes
+    hashes = hash_strings(strings)
+    positions = np.searchsorted(self.hashes, hashes)
+    for i, (string, hash, pos) in enumerate(zip(strings, hashes, positions.tolist())):
+      # Check all strings with this hash (almost always exactly one).
+      while pos < len(self.hashes) and self.hashes[pos] == hash:
+        if self.get(self.order[pos]) == string:
+          indexes[i] = self.order[pos]
+          break
+        pos += 1
+    return indexes
+
+  @staticmethod
+  def write(directory : Path, prefix : str,
+            strings : pa.Array | pa.ChunkedArray) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    if isinstance(strings, pa.ChunkedArray):
+      strings = strings.combine_chunks()
+    strings = strings.fill_null("").cast(pa.large_string())
+    _, offsets_buf, data_buf = strings.buffers()
+    assert offsets_buf is not None
+    offsets = np.frombuffer(memoryview(offsets_buf), dtype=np.int64)[
+      strings.offset:strings.offset + len(strings) + 1]
+    data = np.frombuffer(memoryview(data_buf), dtype=np.uint8) if data_buf \
+           else np.empty(0, dtype=np.uint8)
+    data = data[offsets[0]:offsets[-1]]
+    offsets = offsets - offsets[0]
+
+    hashes = np.concatenate([np.empty(0, dtype=np.uint64)] + [
+      hash_strings(strings.slice(start, HASH_CHUNK_SIZE).to_numpy(zero_copy_only=False))
+      for start in range(0, len(strings), HASH_CHUNK_SIZE)])
+    # Drop missing (empty) strings from the lookup index.
+    present = np.flatnonzero(np.diff(offsets) > 0)
+    order = present[np.argsort(hashes[present], kind="stable")]
+
+    np.save(directory / f"{prefix}.bytes.npy", data)
+    np.save(directory / f"{prefix}.hashes.npy", hashes[order])
+    np.save(directory / f"{prefix}.order.npy", order.astype(np.int32))
+    # Written last so that readers only see complete tables.
+    np.save(directory / f"{prefix}.offsets.npy", offsets)
+
+
+def index_dir(data_dir : Path) -> Path:
+  return Path(data_dir, "index")
+
+
+class IndexMap:
+  """Memory-mapped user_num <-> dense index <-> wikitree_id mapping."""
+  def __init__(self, directory : Path) -> None:
+    self.directory = Path(directory)
+    self.user_nums = np.load(self.directory / "user_nums.npy", mmap_mode="r")
+    self.wikitree_ids = StringTable(self.directory, "wikitree_ids")
+
+  @property
+  def num_people(self) -> int:
+    return len(self.user_nums)
+
+  def index_of(self, user_num : UserNum) -> int:
+    """Dense index of user_num. Raises KeyError if unknown."""
+    index = int(np.searchsorted(self.user_nums, user_num))
+    if index >= len(self.user_nums) or self.user_nums[index] != user_num:
+      raise KeyError(user_num)
+    return index
+
+  def indexes_of(self, user_nums : Iterable[UserNum]) -> np.ndarray:
+    """Vectorized index_of. Unknown user_nums are mapped to -1."""
+    user_nums = np.asarray(user_nums, dtype=np.int64)
+    if not len(self.user_nums):
+      return np.full(len(user_nums), -1, dtype=np.int64)
+    indexes = np.searchsorted(self.user_nums, user_nums)
+    indexes = np.minimum(indexes, len(self.user_nums) - 1)
+    return np.where(self.user_nums[indexes] == user_nums, indexes, -1)
+
+  def index_of_id(self, wikitree_id : WikiId) -> int:
+    """Raises KeyError if unknown."""
+    return self.wikitree_ids.index_of(wikitree_id)
+
+  def indexes_of_ids(self, wikitree_ids : Sequence[WikiId]) -> np.ndarray:
+    """Unknown wikitree_ids are mapped to -1."""
+    return self.wikitree_ids.indexes_of(wikitree_ids)
+
+  def id2num(self, wikitree_id : WikiId) -> UserNum:
+    """Raises KeyError if unknown."""
+    return int(self.user_nums[self.index_of_id(wikitree_id)])
+
+  def ids2nums(self, wikitree_ids : Sequence[WikiId]) -> np.ndarray:
+    """Unknown wikitree_ids are mapped to -1."""
+    indexes = self.indexes_of_ids(wikitree_ids)
+    return np.where(indexes >= 0, self.user_nums[indexes], -1)
+
+  def num2id(self, user_num : UserNum) -> WikiId | None:
+    """Raises KeyError if unknown. None for people without a profile row."""
+    return self.wikitree_ids.get(self.index_of(user_num))
+
+  def nums2ids(self, user_nums : Iterable[UserNum]) -> list[WikiId | None]:
+    """None for unknown user_nums."""
+    indexes = self.indexes_of(user_nums)
+    return [self.wikitree_ids.get(index) if index >= 0 else None
+            for index in indexes.tolist()]
+
+
+def load_index(version : str) -> IndexMap | None:
+  """Load index for version if it has been built."""
+  directory = index_dir(utils.data_version_dir(version))
+  if (directory / "wikitree_ids.offsets.npy").exists():
+    return IndexMap(directory)
+  return None
+
+
+def build_index(data_dir : Path) -> IndexMap:
+  utils.log("Loading people")
+  people = pq.read_table(Path(data_dir, "people.parquet"),
+                         columns=["user_num", "wikitree_id"])
+  utils.log(f"  Loaded {people.num_rows:_} people")
+  rels = pq.read_table(Path(data_dir, "rel_all.parquet"),
+                       columns=["user_num", "relative_num"])
+  utils.log(f"  Loaded {rels.num_rows:_} relationships")
+
+  people_nums = people.column("user_num").to_numpy()
+  # Some relationships refer to people not in the people table (Ex: private
+  # spouses), so index everyone mentioned anywhere.
+  user_nums = np.unique(np.concatenate([
+    people_nums,
+    rels.column("user_num").to_numpy(),
+    rels.column("relative_num").to_numpy()]))
+  del rels
+  assert len(user_nums) == 0 or user_nums[-1] < 2**31, user_nums[-1]
+  user_nums = user_nums.astype(np.int32)
+  utils.log(f"Indexed {len(user_nums):_} people")
+
+  # If a user_num is listed twice, use the first (like csv_to_sqlite).
+  # Note: people_nums[first] is sorted.
+  _, first = np.unique(people_nums, return_index=True)
+  ids = pc.replace_with_mask(
+    pa.nulls(len(user_nums), pa.string()),
+    pa.array(np.isin(user_nums, people_nums[first])),
+    people.column("wikitree_id").combine_chunks().take(first))
+
+  out_dir = index_dir(data_dir)
+  out_dir.mkdir(parents=True, exist_ok=True)
+  np.save(out_dir / "user_nums.npy", user_nums)
+  StringTable.write(out_dir, "wikitree_ids", ids)
+  utils.log(f"Wrote index to {str(out_dir)}")
+  return IndexMap(out_dir)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  args = parser.parse_args()
+
+  data_dir = utils.data_version_dir(args.version)
+  build_index(data_dir)
+
+if __name__ == "__main__":
+  main()
@@ -13,11 +13,12 @@ def main():
 
   db = data_reader.Database(args.version)
 
-  for id_or_num in args.people:
-    user_num = db.get_person_num(id_or_num)
-    print(db.num2id(user_num), user_num, db.name_of(user_num),
-          db.birth_date_of(user_num), db.get(user_num, "birth_location"),
-          db.death_date_of(user_num), db.get(user_num, "death_location"), sep="\t")
+  user_nums = [db.get_person_num(id_or_num) for id_or_num in args.people]
+  attributes = ["wikitree_id", "user_num", "birth_name",
+                "birth_date", "birth_location", "death_date", "death_location"]
+  info = db.get_mult(user_nums, attributes)
+  for i in range(len(user_nums)):
+    print(*(info[attribute][i] for attribute in attributes), sep="\t")
 
 if __name__ == "__main__":
   main()
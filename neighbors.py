@@ -23,11 +23,13 @@ def main():
     neighbors = [(db.relationship_type(user_num, neigh), neigh)
                  for neigh in db.neighbors_of(user_num)]
     neighbors.sort()
-    for rel_type, neigh in neighbors:
+    info = db.get_mult([neigh for _, neigh in neighbors],
+                       ["wikitree_id", "birth_name"])
+    for i, (rel_type, neigh) in enumerate(neighbors):
       if args.only_ids:
-        print(db.num2id(neigh))
+        print(info["wikitree_id"][i])
       else:
-        print(f" - {rel_type:10} {db.name_of(neigh):30} {db.num2id(neigh):20} {neigh:10}")
+        print(f" - {rel_type:10} {info['birth_name'][i]:30} {info['wikitree_id'][i]:20} {neigh:10}")
     print()
 
 if __name__ == "__main__":
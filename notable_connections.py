@@ -5,7 +5,7 @@ Find closest connected people in the "Notables" or any other category.
 import argparse
 import collections
 import itertools
-from typing import Iterable, Iterator
+from typing import Collection, Iterable, Iterator
 
 import bfs_tools
 import category_tools
@@ -13,7 +13,7 @@ import data_reader
 from data_reader import UserNum
 
 
-def EnumConnections(bfs : Iterable[bfs_tools.BfsNode], targets : list[UserNum]
+def EnumConnections(bfs : Iterable[bfs_tools.BfsNode], targets : Collection[UserNum]
                     ) -> Iterator[bfs_tools.BfsNode]:
   for node in bfs:
     if node.person in targets:
@@ -2,72 +2,139 @@
 Tool for reading and writing partitions (groupings) of people.
 
 Examples: connected trees, genetic connected trees, sibling-in-laws.
+
+Each partition type is stored as memory-mapped arrays keyed by the dense
+person index from index_tools. The representative (rep) of each partition is
+its member with the smallest index (= smallest user_num).
+
+Files (in data/version/{version}/partitions/{table}/):
+ * rep.npy: int32 [num_people]. Index of the rep of each person's partition
+   (-1 for people not in any partition).
+ * reps.npy: sorted int32 indexes of all reps.
+ * offsets.npy: int64 [num_reps + 1]. Members of partition reps[i] are
+   members[offsets[i]:offsets[i+1]].
+ * members.npy: int32 indexes (sorted within each partition).
 """
 
 import argparse
-from collections.abc import Sequence
+from collections.abc import Iterable
 from pathlib import Path
-import sqlite3
 from typing import Iterator
 
+import numpy as np
+
 import data_reader
+import index_tools
+from sqlite_reader import UserNum
 import utils
 
 
+def partitions_dir(data_dir : Path) -> Path:
+  return Path(data_dir, "partitions")
+
+
+class Partition:
+  """Memory-mapped arrays of one partition type."""
+  def __init__(self, directory : Path) -> None:
+    self.directory = Path(directory)
+    self.rep = np.load(self.directory / "rep.npy", mmap_mode="r")
+    self.reps = np.load(self.directory / "reps.npy", mmap_mode="r")
+    self.offsets = np.load(self.directory / "offsets.npy", mmap_mode="r")
+    self.members = np.load(self.directory / "members.npy", mmap_mode="r")
+
+  def members_of(self, rep_index : int) -> np.ndarray:
+    """Sorted indexes of all members of rep_index's partition."""
+    i = int(np.searchsorted(self.reps, rep_index))
+    if i >= len(self.reps) or self.reps[i] != rep_index:
+      return np.empty(0, dtype=np.int32)
+    return self.members[self.offsets[i]:self.offsets[i + 1]]
+
+  @staticmethod
+  def write(directory : Path, rep : np.ndarray) -> None:
+    """Write partition given rep index for every person (-1 if none)."""
+    directory.mkdir(parents=True, exist_ok=True)
+    rep = np.asarray(rep, dtype=np.int32)
+    # Note: Stable sort keeps members in index order within each partition.
+    members = np.argsort(rep, kind="stable")
+    members = members[rep[members] >= 0]
+    reps, counts = np.unique(rep[members], return_counts=True)
+    offsets = np.zeros(len(reps) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    np.save(directory / "reps.npy", reps.astype(np.int32))
+    np.save(directory / "offsets.npy", offsets)
+    np.save(directory / "members.npy", members.astype(np.int32))
+    # Written last so that readers only see complete partitions.
+    np.save(directory / "rep.npy", rep)
+
+
 class PartitionDb:
   def __init__(self, version : str) -> None:
-    self.filename = Path(utils.data_version_dir(version), "partitions.db")
-    self.conn = sqlite3.connect(self.filename)
-    self.conn.row_factory = sqlite3.Row
+    self.directory = partitions_dir(utils.data_version_dir(version))
+    index = index_tools.load_index(version)
+    assert index, "Requires person index (run csr_tools.py)"
+    self.index : index_tools.IndexMap = index
+    self.partitions : dict[str, Partition] = {}
+
+  def partition(self, table : str) -> Partition:
+    if table not in self.partitions:
+      self.partitions[table] = Partition(self.directory / table)
+    return self.partitions[table]
 
   # Readers
-  def find_partition_rep(self, table : str, person : int) -> int:
-    cursor = self.conn.cursor()
-    cursor.execute(f"SELECT rep FROM {table} WHERE user_num=?",
-                   (person,))
-    rows = cursor.fetchall()
-    assert len(rows) == 1, (person, rows)
-    return rows[0]["rep"]
-
-  def list_partition(self, table : str, rep : int) -> frozenset[int]:
-    cursor = self.conn.cursor()
-    cursor.execute(f"SELECT user_num FROM {table} WHERE rep=?", (rep,))
-    return frozenset(row["user_num"] for row in cursor.fetchall())
-
-  def main_component_rep(self, table : str) -> int:
+  def find_partition_rep(self, table : str, person : UserNum) -> UserNum:
+    rep_index = int(self.partition(table).rep[self.index.index_of(person)])
+    assert rep_index >= 0, (table, person)
+    return int(self.index.user_nums[rep_index])
+
+  def partition_indexes(self, table : str, rep : UserNum) -> np.ndarray:
+    """Sorted dense indexes of all members of rep's partition."""
+    return self.partition(table).members_of(self.index.index_of(rep))
+
+  def partition_user_nums(self, table : str, rep : UserNum) -> np.ndarray:
+    """Sorted user_nums of all members of rep's partition."""
+    return self.index.user_nums[self.partition_indexes(table, rep)]
+
+  def partition_mask(self, table : str, rep : UserNum) -> np.ndarray:
+    """Boolean array over dense indexes of membership in rep's partition."""
+    return self.partition(table).rep == self.index.index_of(rep)
+
+  def list_partition(self, table : str, rep : UserNum) -> frozenset[UserNum]:
+    return frozenset(self.partition_user_nums(table, rep).tolist())
+
+  def main_component_rep(self, table : str) -> UserNum:
     # Note: I just pick the component that Samuel Lothrop (Lothrop-29) belongs
     # to. He is one of the most central profiles on WikiTree. This is certainly
     # the correct component for the `connected` graph. For other partitions,
     # it may not be the largest component ...
     return self.find_partition_rep(table, 142891)  # Lothrop-29
 
-  def enum_all(self, table : str) -> Iterator:
-    cursor = self.conn.cursor()
-    cursor.execute(f"SELECT user_num, rep FROM {table}")
-    while row := cursor.fetchone():
-      yield row
+  def enum_all(self, table : str) -> Iterator[dict[str, UserNum]]:
+    partition = self.partition(table)
+    user_nums = self.index.user_nums
+    for index in np.flatnonzero(np.asarray(partition.rep) >= 0).tolist():
+      yield {"user_num": int(user_nums[index]),
+             "rep": int(user_nums[partition.rep[index]])}
 
 
   # Writers
+  def write_partition_reps(self, table : str, rep : np.ndarray) -> None:
+    """Bulk write partition given the rep index of every person's partition
+    (-1 if none). Reps should be the smallest index in each partition."""
+    assert len(rep) == self.index.num_people, (len(rep), self.index.num_people)
+    Partition.write(self.directory / table, rep)
+    self.partitions.pop(table, None)
+
   def write_partition(self, table : str,
-                      partitions : dict[int, Sequence[int]]) -> None:
-    # TODO: Maybe restructure this so that all partitions use the same table with a partition_type field.
-    cursor = self.conn.cursor()
-    cursor.execute(f"DROP TABLE IF EXISTS {table}")
-    cursor.execute(f"CREATE TABLE {table} (user_num INT, rep INT, PRIMARY KEY (user_num))")
-
-    i = 0
-    for rep in partitions:
-      for person in partitions[rep]:
-        cursor.execute(f"INSERT INTO {table} VALUES (?,?)",
-                  (person, rep))
-        i += 1
-        if i % 1000000 == 0:
-          self.conn.commit()
-    self.conn.commit()
-
-    cursor.execute(f"CREATE INDEX idx_{table}_rep ON {table} (rep)")
-    self.conn.commit()
+                      partitions : dict[UserNum, Iterable[UserNum]]) -> None:
+    rep = np.full(self.index.num_people, -1, dtype=np.int32)
+    for rep_num, members in partitions.items():
+      member_indexes = self.index.indexes_of(
+        np.fromiter(members, dtype=np.int64))
+      if not len(member_indexes):
+        continue
+      assert (member_indexes >= 0).all(), f"Unindexed people in {rep_num}"
+      rep[member_indexes] = member_indexes.min()
+    self.write_partition_reps(table, rep)
 
 
 if __name__ == "__main__":
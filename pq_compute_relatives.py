@@ -1,6 +1,20 @@
+"""
+Compute all relationships (rel_all.parquet) from parents & marriages.
+
+Also writes:
+ * rel_parents.parquet: Only parent relationships.
+ * rel_couples.parquet: Spouse & coparent relationships (without duplicates).
+ * families.parquet: Nuclear families (father_num, mother_num -> children).
+   Either parent may be null (unknown).
+"""
+
 import argparse
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 import utils
 
@@ -12,24 +26,84 @@ def format_rels(df, column1, column2, relationship):
     "relationship": relationship,
   })
 
+# Max number of pairs to materialize at once in iter_common_pairs().
+PAIRS_CHUNK_SIZE = 10_000_000
+
+def iter_common_pairs(members, keys, chunk_size=PAIRS_CHUNK_SIZE):
+  """Yield chunks of (a, b) arrays of distinct members which share a key.
+  Ex: siblings are children (members) who share a parent (key).
+
+  Instead of a self-merge, we sort (key, member) edges so that each key's
+  members are contiguous and emit all pairs within each group, a chunk of
+  groups at a time. If every member has <= 2 keys (Ex: children have at most
+  2 parents), each pair is only emitted from the smallest key they share, so
+  no global de-duplication is needed. Otherwise, chunks may contain pairs
+  already emitted in previous chunks.
+  """
+  members = np.asarray(members, dtype=np.int64)
+  keys = np.asarray(keys, dtype=np.int64)
+  # Sort by member and remove duplicate edges (Ex: father == mother).
+  order = np.lexsort((keys, members))
+  members, keys = members[order], keys[order]
+  keep = np.ones(len(members), dtype=bool)
+  keep[1:] = (members[1:] != members[:-1]) | (keys[1:] != keys[:-1])
+  members, keys = members[keep], keys[keep]
+
+  # The other key of each member (if it has exactly 2).
+  same_as_prev = np.zeros(len(members), dtype=bool)
+  same_as_prev[1:] = members[1:] == members[:-1]
+  same_as_next = np.roll(same_as_prev, -1)
+  at_most_two_keys = not np.any(same_as_prev[1:] & same_as_prev[:-1])
+  other_keys = np.where(same_as_prev, np.roll(keys, 1),
+                        np.where(same_as_next, np.roll(keys, -1), 0))
+  has_other = same_as_prev | same_as_next
+
+  # Group by key.
+  order = np.lexsort((members, keys))
+  members, keys = members[order], keys[order]
+  other_keys, has_other = other_keys[order], has_other[order]
+  group_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+  group_sizes = np.diff(np.r_[group_starts, len(keys)])
+  # Number of pairs (including self-pairs) produced by each group.
+  group_pairs = group_sizes.astype(np.int64) ** 2
+
+  start_group = 0
+  while start_group < len(group_starts):
+    # Take as many groups as fit in chunk_size (but at least one).
+    end_group = start_group + max(1, int(np.searchsorted(
+      np.cumsum(group_pairs[start_group:]), chunk_size, side="right")))
+    starts = group_starts[start_group:end_group]
+    sizes = group_sizes[start_group:end_group]
+    # Each edge in these groups is paired with every edge in its group.
+    edges = np.arange(starts[0], starts[-1] + sizes[-1])
+    edge_sizes = np.repeat(sizes, sizes)
+    edge_starts = np.repeat(starts, sizes)
+    a = np.repeat(edges, edge_sizes)
+    b = (np.arange(len(a)) - np.repeat(np.cumsum(edge_sizes) - edge_sizes, edge_sizes)
+         + np.repeat(edge_starts, edge_sizes))
+    keep = (a != b)
+    if at_most_two_keys:
+      # Skip pairs which also share a smaller key.
+      keep &= ~(has_other[a] & has_other[b] & (other_keys[a] == other_keys[b])
+                & (other_keys[a] < keys[a]))
+    yield members[a[keep]], members[b[keep]]
+    start_group = end_group
+
 def find_common(old, relationship):
   """Return df of distinct user_nums who share the same relative_num.
   Ex: siblings are people who share parents."""
   utils.log(f"Computing {relationship}")
-  new = old.merge(old, on="relative_num")
+  chunks = list(iter_common_pairs(old.user_num, old.relative_num))
   new = pd.DataFrame({
-    "user_num": new.user_num_x,
-    "relative_num": new.user_num_y,
+    "user_num": np.concatenate([a for a, _ in chunks] + [np.empty(0, np.int64)]),
+    "relative_num": np.concatenate([b for _, b in chunks] + [np.empty(0, np.int64)]),
     "relationship": relationship,
   })
-  utils.log(f"  Merged to {len(new):_} {relationship} relationships")
-  new = new.loc[new.user_num != new.relative_num]
-  utils.log(f"  Removed self-relationships: {len(new):_} {relationship} relationships")
   new = new.drop_duplicates()
-  utils.log(f"  Removed duplicates: {len(new):_} {relationship} relationships")
+  utils.log(f"  Computed {len(new):_} {relationship} relationships")
   return new
 
-def compute_relatives(data_dir):
+def load_spouse_rels(data_dir):
   utils.log("Loading Marriages")
   mar_df = pd.read_parquet(data_dir / "marriages.parquet",
                            columns = ["spouse1", "spouse2"])
@@ -37,47 +111,162 @@ def compute_relatives(data_dir):
   mar1 = format_rels(mar_df, "spouse1", "spouse2", "spouse")
   mar2 = format_rels(mar_df, "spouse2", "spouse1", "spouse")
   utils.log(f"  Computed {len(mar1)+len(mar2):_} spouse relationships")
+  return pd.concat([mar1, mar2], ignore_index=True)
 
+def load_parents(data_dir):
   utils.log("Loading Parents")
   ppl_df = pd.read_parquet(data_dir / "people.parquet",
                            columns=["user_num", "mother_num", "father_num"],
                            # Support NA parent_nums without coercing to DOUBLE.
                            dtype_backend="numpy_nullable")
   utils.log(f"  Loaded {len(ppl_df):_} people")
+  return ppl_df
+
+def parent_rels(ppl_df):
   parent = pd.concat([
     format_rels(ppl_df, "user_num", "mother_num", "parent"),
     format_rels(ppl_df, "user_num", "father_num", "parent"),
     ], ignore_index=True)
   # Drop parental relationship where parent is unknown.
-  parent = parent.dropna()
-  utils.log(f"  Computed {len(parent):_} parent relationships")
-  child = format_rels(parent, "relative_num", "user_num", "child")
-  utils.log(f"  Computed {len(child):_} child relationships")
+  return parent.dropna()
+
+def child_rels(parent):
+  return format_rels(parent, "relative_num", "user_num", "child")
+
+def compute_families(ppl_df):
+  """Table of nuclear families: parent pair -> list of children."""
+  has_parent = ppl_df.mother_num.notna() | ppl_df.father_num.notna()
+  table = pa.Table.from_pandas(ppl_df.loc[has_parent], preserve_index=False)
+  families = table.group_by(["father_num", "mother_num"]) \
+    .aggregate([("user_num", "list")])
+  families = pa.table({
+    "father_num": families.column("father_num"),
+    "mother_num": families.column("mother_num"),
+    "children": families.column("user_num_list"),
+  })
+  order = pc.sort_indices(families, sort_keys=[("father_num", "ascending"),
+                                               ("mother_num", "ascending")])
+  return families.take(order)
 
-  sibling = find_common(parent, "sibling")
-  utils.log(f"Computed {len(sibling):_} sibling relationships")
+def write_families(ppl_df, data_dir):
+  families = compute_families(ppl_df)
+  pq.write_table(families, data_dir / "families.parquet")
+  utils.log(f"Wrote {families.num_rows:_} families")
+  return families
 
-  coparent = find_common(child, "coparent")
-  utils.log(f"Computed {len(coparent):_} coparent relationships")
+def coparent_pairs(families):
+  """Coparents are the parents of any family with 2 (distinct) parents."""
+  fathers = families.column("father_num")
+  mothers = families.column("mother_num")
+  couples = families.filter(pc.and_(pc.is_valid(fathers), pc.is_valid(mothers)))
+  fathers = couples.column("father_num").to_numpy()
+  mothers = couples.column("mother_num").to_numpy()
+  # Normalize pair order, since rarely someone is listed as both a father and
+  # a mother (and so a couple could appear as (A, B) and (B, A)).
+  low, high = np.minimum(fathers, mothers), np.maximum(fathers, mothers)
+  order = np.lexsort((high, low))
+  low, high = low[order], high[order]
+  keep = (low != high)
+  keep[1:] &= (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+  low, high = low[keep], high[keep]
+  return np.concatenate([low, high]), np.concatenate([high, low])
+
+
+REL_FIELDS : list[pa.Field] = [
+  pa.field("user_num", pa.int64()),
+  pa.field("relative_num", pa.int64()),
+  pa.field("relationship", pa.string()),
+]
+REL_SCHEMA = pa.schema(REL_FIELDS)
+
+def rel_table(user_nums, relative_nums, relationship):
+  # Note: Dictionary decode avoids building a Python list of n strings.
+  relationships = pa.DictionaryArray.from_arrays(
+    np.zeros(len(user_nums), dtype=np.int8), [relationship]).cast(pa.string())
+  return pa.Table.from_arrays(
+    [pa.array(user_nums, pa.int64()), pa.array(relative_nums, pa.int64()),
+     relationships], schema=REL_SCHEMA)
+
+class RelativesWriter:
+  """Stream relationships to rel_all.parquet and the derived
+  rel_parents.parquet & rel_couples.parquet."""
+  def __init__(self, data_dir):
+    self.data_dir = data_dir
+    self.all_writer = pq.ParquetWriter(data_dir / "rel_all.parquet", REL_SCHEMA)
+    self.parents_writer = pq.ParquetWriter(data_dir / "rel_parents.parquet", REL_SCHEMA)
+    self.couples = []
+    self.num_rels = 0
+    self.num_parents = 0
+
+  def write_pairs(self, user_nums, relative_nums, relationship):
+    self.write_table(rel_table(user_nums, relative_nums, relationship), relationship)
+
+  def write_df(self, df):
+    for relationship, group in df.groupby("relationship", sort=False):
+      self.write_pairs(group.user_num.to_numpy(dtype=np.int64),
+                       group.relative_num.to_numpy(dtype=np.int64), relationship)
+
+  def write_table(self, table, relationship):
+    self.all_writer.write_table(table)
+    self.num_rels += table.num_rows
+    if relationship == "parent":
+      self.parents_writer.write_table(table)
+      self.num_parents += table.num_rows
+    elif relationship in ("spouse", "coparent"):
+      self.couples.append(table)
+
+  def close(self):
+    self.all_writer.close()
+    utils.log(f"Wrote all {self.num_rels:_} relationships")
+    self.parents_writer.close()
+    utils.log(f"Wrote {self.num_parents:_} parent relationships")
+
+    # Write only "couples" (spouses or coparents) without duplication.
+    # rel_all will store two relationships for the same couple if they are
+    # both married and have children.
+    couples = pa.concat_tables(self.couples).to_pandas() \
+      .drop_duplicates(subset=["user_num", "relative_num"])
+    couples.to_parquet(self.data_dir / "rel_couples.parquet", index=False)
+    utils.log(f"Wrote {len(couples):_} couple relationships")
+
+
+def compute_relatives(data_dir):
+  writer = RelativesWriter(data_dir)
+  # Note: Order of relationship types matters: csv_to_sqlite keeps this order
+  # and relationship_type() prefers earlier ones (Ex: spouse over coparent).
+  writer.write_df(load_spouse_rels(data_dir))
+
+  ppl_df = load_parents(data_dir)
+  parent = parent_rels(ppl_df)
+  utils.log(f"  Computed {len(parent):_} parent relationships")
+  parent_users = parent.user_num.to_numpy(dtype=np.int64)
+  parent_relatives = parent.relative_num.to_numpy(dtype=np.int64)
+  del parent
+  writer.write_pairs(parent_users, parent_relatives, "parent")
+  writer.write_pairs(parent_relatives, parent_users, "child")
+  utils.log(f"  Computed {len(parent_users):_} child relationships")
 
-  df = pd.concat([mar1, mar2, parent, child, sibling, coparent], ignore_index=True)
-  assert df.isna().sum().sum() == 0, df.isna().sum()
-  utils.log(f"Combined into {len(df):_} total relationships")
+  utils.log("Computing sibling")
+  num_siblings = 0
+  for a, b in iter_common_pairs(parent_users, parent_relatives):
+    writer.write_pairs(a, b, "sibling")
+    num_siblings += len(a)
+  utils.log(f"Computed {num_siblings:_} sibling relationships")
+  del parent_users, parent_relatives
 
-  df.to_parquet(data_dir / "rel_all.parquet")
-  utils.log(f"Wrote all {len(df):_} relationships")
+  families = write_families(ppl_df, data_dir)
+  del ppl_df
 
-  parents = df.loc[df.relationship == "parent"]
-  parents.to_parquet(data_dir / "rel_parents.parquet")
-  utils.log(f"Wrote {len(parents):_} parent relationships")
+  a, b = coparent_pairs(families)
+  writer.write_pairs(a, b, "coparent")
+  utils.log(f"Computed {len(a):_} coparent relationships")
+  writer.close()
 
-  # Write only "couples" (spouses or coparents) without duplication.
-  # rel_all will store two relationships for the same couple if they are
-  # both married and have children.
-  couples = df.loc[df.relationship.isin(["spouse", "coparent"])] \
-    .drop_duplicates(subset=["user_num", "relative_num"])
-  couples.to_parquet(data_dir / "rel_couples.parquet")
-  utils.log(f"Wrote {len(couples):_} couple relationships")
+def write_relatives(df, data_dir):
+  """Write rel_all and the derived rel_parents & rel_couples."""
+  writer = RelativesWriter(data_dir)
+  writer.write_df(df)
+  writer.close()
 
 
 def main():
@@ -0,0 +1,272 @@
+"""
+Long-running HTTP/JSON query server which keeps the graph warm.
+
+Instead of reopening the DB (or rebuilding load_connections()) for every
+one-shot CLI invocation, load it once and answer many queries concurrently.
+
+Endpoints (all GET, all respond with JSON):
+ * /lookup?id=Lothrop-29
+ * /neighbors?id=Lothrop-29
+ * /circles?id=Lothrop-29&num_circles=7[&list=1]
+ * /connection?from=Lothrop-29&to=Ligocki-7[&max_paths=10][&max_dist=40]
+               [&rel_types=parent,child]
+   Same JSON as `connection.py --format=json` (plus "from" and "to").
+ * /metrics: Request counts and latency histograms per endpoint.
+
+Ex:
+  python3 query_server.py --port=8080 --workers=8
+  curl 'localhost:8080/connection?from=Lothrop-29&to=Ligocki-7'
+"""
+
+import argparse
+import bisect
+import concurrent.futures
+import http.server
+import itertools
+import json
+import threading
+import time
+import urllib.parse
+
+import circles_tools
+import connection
+import data_reader
+import utils
+
+
+# Upper bounds (in ms) of latency histogram buckets. Last bucket is +inf.
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500,
+                      1_000, 2_000, 5_000, 10_000, 30_000]
+
+
+class LatencyHistogram:
+  """Thread-safe request counts and latency histogram per endpoint."""
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.counts : dict[str, list[int]] = {}
+    self.total_ms : dict[str, float] = {}
+    self.errors : dict[str, int] = {}
+
+  def record(self, endpoint : str, latency_ms : float, is_error : bool) -> None:
+    bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+    with self.lock:
+      if endpoint not in self.counts:
+        self.counts[endpoint] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms[endpoint] = 0.0
+        self.errors[endpoint] = 0
+      self.counts[endpoint][bucket] += 1
+      self.total_ms[endpoint] += latency_ms
+      self.errors[endpoint] += int(is_error)
+
+  def to_json(self) -> dict:
+    with self.lock:
+      return {
+        "buckets_ms": LATENCY_BUCKETS_MS + ["inf"],
+        "endpoints": {
+          endpoint: {
+            "count": sum(counts),
+            "errors": self.errors[endpoint],
+            "mean_ms": self.total_ms[endpoint] / sum(counts),
+            "histogram": counts,
+          } for endpoint, counts in self.counts.items()},
+      }
+
+
+class QueryError(Exception):
+  def __init__(self, status : int, message : str) -> None:
+    super().__init__(message)
+    self.status = status
+
+
+class Queries:
+  """Query implementations. Each worker thread gets its own Database
+  (SQLite connections cannot be shared between threads), but the adjacency
+  snapshot is memory-mapped so its pages are shared."""
+  def __init__(self, version : str) -> None:
+    self.version = version
+    self.local = threading.local()
+
+  def db(self) -> data_reader.Database:
+    if not hasattr(self.local, "db"):
+      self.local.db = data_reader.Database(self.version)
+    return self.local.db
+
+  def person_num(self, id_or_num : str | None) -> int:
+    if not id_or_num:
+      raise QueryError(400, "Missing person id")
+    try:
+      return self.db().get_person_num(id_or_num)
+    except AssertionError:
+      raise QueryError(404, f"Unknown person {id_or_num}")
+
+  def person_json(self, user_num : int) -> dict:
+    db = self.db()
+    return {
+      "user_num": user_num,
+      "wikitree_id": db.num2id(user_num),
+      "name": db.name_of(user_num),
+    }
+
+  def lookup(self, params : dict[str, str]) -> dict:
+    db = self.db()
+    user_num = self.person_num(params.get("id"))
+    info = self.person_json(user_num)
+    for attribute in ["birth_date", "death_date",
+                      "birth_location", "death_location"]:
+      info[attribute] = db.get(user_num, attribute)
+    return info
+
+  def neighbors(self, params : dict[str, str]) -> dict:
+    db = self.db()
+    user_num = self.person_num(params.get("id"))
+    # Bulk lookups, since some people have hundreds of relatives.
+    neighbor_nums = sorted(db.neighbors_of(user_num))
+    info = db.get_mult(neighbor_nums, ["wikitree_id", "birth_name"])
+    rel_types = db.relationship_types([(user_num, neigh) for neigh in neighbor_nums])
+    neighbors = [{
+      "user_num": neigh,
+      "wikitree_id": wikitree_id,
+      "name": name,
+      "relationship": rel_type,
+    } for neigh, wikitree_id, name, rel_type in zip(
+      neighbor_nums, info["wikitree_id"], info["birth_name"], rel_types)]
+    return {"person": self.person_json(user_num), "neighbors": neighbors}
+
+  def circles(self, params : dict[str, str]) -> dict:
+    db = self.db()
+    user_num = self.person_num(params.get("id"))
+    num_circles = int(params.get("num_circles", 7))
+    circles = circles_tools.load_circles(db, user_num, num_circles)
+    response : dict = {
+      "person": self.person_json(user_num),
+      "sizes": [len(circle) for circle in circles],
+    }
+    if params.get("list"):
+      response["circles"] = [sorted(circle) for circle in circles]
+    return response
+
+  def connection(self, params : dict[str, str]) -> dict:
+    db = self.db()
+    start_num = self.person_num(params.get("from"))
+    end_num = self.person_num(params.get("to"))
+    max_paths = int(params.get("max_paths", 10))
+    max_dist = int(params["max_dist"]) if "max_dist" in params else None
+    if "rel_types" in params:
+      rel_types = frozenset(params["rel_types"].split(","))
+    else:
+      rel_types = frozenset(["parent", "child", "sibling", "spouse"])
+
+    connections = connection.search_connections(
+      db, start_num, end_num, rel_types, max_dist, verbose=False)
+    # Same schema as `connection.py --format=json` (plus from and to).
+    response = connection.connections_json(
+      connections.num_paths,
+      list(connection.iter_steps(db, itertools.islice(connections, max_paths))))
+    response["from"] = self.person_json(start_num)
+    response["to"] = self.person_json(end_num)
+    return response
+
+
+def make_handler(queries : Queries,
+                 executor : concurrent.futures.ThreadPoolExecutor,
+                 slots : threading.BoundedSemaphore,
+                 histogram : LatencyHistogram,
+                 timeout : float) -> type:
+  endpoints = {
+    "/lookup": queries.lookup,
+    "/neighbors": queries.neighbors,
+    "/circles": queries.circles,
+    "/connection": queries.connection,
+  }
+
+  class Handler(http.server.BaseHTTPRequestHandler):
+    def send_json(self, status : int, data) -> None:
+      body = json.dumps(data).encode("utf-8")
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      # Allow the web apps (apps/*.js) to query us directly.
+      self.send_header("Access-Control-Allow-Origin", "*")
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self) -> None:
+      url = urllib.parse.urlparse(self.path)
+      params = dict(urllib.parse.parse_qsl(url.query))
+      if url.path == "/metrics":
+        self.send_json(200, histogram.to_json())
+        return
+      if url.path not in endpoints:
+        self.send_json(404, {"error": f"Unknown endpoint {url.path}"})
+        return
+
+      start_time = time.time()
+      status = 200
+      # Bound the number of queued + running queries so that a burst of
+      # requests fails fast rather than piling up unbounded.
+      if not slots.acquire(blocking=False):
+        status, response = 503, {"error": "Server busy"}
+      else:
+        # Release the slot when the query actually finishes (not when we stop
+        # waiting for it), so timed out queries still count against the limit.
+        future = executor.submit(endpoints[url.path], params)
+        future.add_done_callback(lambda _: slots.release())
+        try:
+          response = future.result(timeout=timeout)
+        except QueryError as e:
+          status, response = e.status, {"error": str(e)}
+        except ValueError as e:
+          status, response = 400, {"error": str(e)}
+        except concurrent.futures.TimeoutError:
+          # Drop the query if it has not started yet.
+          future.cancel()
+          status, response = 504, {"error": "Query timed out"}
+        except Exception as e:
+          utils.log(f"Error processing {self.path}: {e!r}")
+          status, response = 500, {"error": repr(e)}
+      self.send_json(status, response)
+      histogram.record(url.path, (time.time() - start_time) * 1000,
+                       is_error=(status != 200))
+
+    def log_message(self, format, *args) -> None:
+      utils.log(format % args)
+
+  return Handler
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--version", help="Data version (defaults to most recent).")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument("--workers", type=int, default=8,
+                      help="Number of queries to evaluate concurrently.")
+  parser.add_argument("--max-queue", type=int, default=64,
+                      help="Max number of queries waiting for a worker before we respond 503.")
+  parser.add_argument("--timeout", type=float, default=60.0,
+                      help="Max number of seconds to wait for a query.")
+  args = parser.parse_args()
+
+  queries = Queries(args.version)
+  utils.log("Loading DB")
+  db = queries.db()
+  if not db.adjacency:
+    utils.log("WARNING: No adjacency snapshot (run csr_tools.py), queries will be slow.")
+
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+  slots = threading.BoundedSemaphore(args.workers + args.max_queue)
+  histogram = LatencyHistogram()
+  handler = make_handler(queries, executor, slots, histogram, args.timeout)
+  server = http.server.ThreadingHTTPServer((args.host, args.port), handler)
+  utils.log(f"Serving on http://{args.host}:{args.port}/")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    executor.shutdown(wait=False, cancel_futures=True)
+  utils.log("Done")
+
+if __name__ == "__main__":
+  main()
@@ -1,4 +1,4 @@
-from collections.abc import Container, Sequence
+from collections.abc import Container, Iterable, Sequence
 import datetime
 from pathlib import Path
 import sqlite3
@@ -11,6 +11,17 @@ UserNum = int
 WikiId = str
 IdOrNum = WikiId | UserNum
 
+# Max number of user_nums to query with a single `IN (...)` clause.
+# (SQLite limits the number of host parameters, 999 in older versions.)
+IN_QUERY_CHUNK_SIZE = 900
+# Queries for more than this many people use a temp table join instead.
+TEMP_TABLE_MIN_SIZE = 50_000
+
+def _parse_date(date_str : str | None) -> datetime.date | None:
+  if date_str:
+    return datetime.date.fromisoformat(date_str)
+  return None
+
 class Database(object):
   def __init__(self, version : str) -> None:
     self.filename = Path(utils.data_version_dir(version), "wikitree_dump.db")
@@ -29,6 +40,50 @@ class Database(object):
       assert len(rows) == 1, (user_num, attribute, rows)
       return rows[0][0]
 
+  def get_mult(self, user_nums : Iterable[UserNum], attributes : Sequence[str]
+               ) -> dict[str, list]:
+    """Bulk version of get(): Fetch attributes for many people in a handful
+    of queries (instead of one query per person per attribute).
+
+    Returns columns {attribute: [value for each of user_nums]} in the same
+    order as user_nums (None for people not in the DB).
+    """
+    user_nums = [int(user_num) for user_num in user_nums]
+    unique_nums = list(set(user_nums))
+    columns = ", ".join(attributes)
+    rows_by_num : dict[UserNum, sqlite3.Row] = {}
+    if len(unique_nums) < TEMP_TABLE_MIN_SIZE:
+      for i in range(0, len(unique_nums), IN_QUERY_CHUNK_SIZE):
+        chunk = unique_nums[i:i + IN_QUERY_CHUNK_SIZE]
+        self.cursor.execute(
+          f"SELECT user_num, {columns} FROM people WHERE user_num IN ({','.join('?' * len(chunk))})",
+          chunk)
+        for row in self.cursor.fetchall():
+          rows_by_num[row[0]] = row
+    else:
+      self.cursor.execute("DROP TABLE IF EXISTS temp.query_nums")
+      self.cursor.execute("CREATE TEMP TABLE query_nums (user_num INT PRIMARY KEY)")
+      self.cursor.executemany("INSERT INTO temp.query_nums VALUES (?)",
+                              ((user_num,) for user_num in unique_nums))
+      self.cursor.execute(
+        f"SELECT user_num, {columns} FROM temp.query_nums JOIN people USING (user_num)")
+      for row in self.cursor.fetchall():
+        rows_by_num[row[0]] = row
+      self.cursor.execute("DROP TABLE temp.query_nums")
+
+    results : dict[str, list] = {}
+    for i, attribute in enumerate(attributes, start=1):
+      results[attribute] = [
+        rows_by_num[user_num][i] if user_num in rows_by_num else None
+        for user_num in user_nums]
+    return results
+
+  def birth_dates_of(self, user_nums : Iterable[UserNum]
+                     ) -> list[datetime.date | None]:
+    """Bulk version of birth_date_of()."""
+    date_strs = self.get_mult(user_nums, ["birth_date"])["birth_date"]
+    return [_parse_date(date_str) for date_str in date_strs]
+
   def get_person_num(self, id_or_num : str) -> UserNum:
     try:
       return int(id_or_num)
@@ -142,6 +197,21 @@ class Database(object):
     assert len(rows) >= 1, (user_num, relative_num, rows)
     return rows[0]["relationship_type"]
 
+  def relationship_types(self, pairs : Sequence[tuple[UserNum, UserNum]]
+                         ) -> list[str | None]:
+    """Bulk version of relationship_type() for many (user_num, relative_num)
+    pairs (None for pairs which are not related)."""
+    user_nums = list({user_num for user_num, _ in pairs})
+    types : dict[tuple[UserNum, UserNum], str] = {}
+    for i in range(0, len(user_nums), IN_QUERY_CHUNK_SIZE):
+      chunk = user_nums[i:i + IN_QUERY_CHUNK_SIZE]
+      self.cursor.execute(
+        f"SELECT user_num, relative_num, relationship_type FROM relationships WHERE user_num IN ({','.join('?' * len(chunk))})",
+        chunk)
+      for row in self.cursor.fetchall():
+        types.setdefault((row[0], row[1]), row[2])
+    return [types.get(pair) for pair in pairs]
+
   def enum_connections(self) -> Iterator[tuple[int, int, str]]:
     cursor = self.conn.cursor()
     cursor.execute("SELECT user_num, relative_num, relationship_type FROM relationships")
@@ -1,6 +1,9 @@
 """General utilities."""
 
+from collections.abc import Callable, Iterable, Iterator
+import concurrent.futures
 import datetime
+import itertools
 from pathlib import Path
 import sys
 from typing import Any
@@ -10,7 +13,7 @@ def log(*messages) -> None:
   print(f"{datetime.datetime.now().isoformat()} ", *messages, file=sys.stderr)
   sys.stderr.flush()
 
-def data_version_dir(version : str) -> Path:
+def data_version_dir(version : str | None) -> Path:
   """In order to allow using multiple version of data at the same time, we
   allow putting them in separate data dirs."""
   if version:
@@ -18,6 +21,29 @@ def data_version_dir(version : str) -> Path:
   else:
     return Path("data", "version", "default")
 
+def parallel_imap(func : Callable, items : Iterable, num_workers : int,
+                  initializer : Callable | None = None,
+                  initargs : tuple = ()) -> Iterator:
+  """Evaluate func(item) for all items in a pool of worker processes.
+  Results are yielded in the order they finish.
+
+  items may be infinite (Ex: random samples), only about 2 * num_workers
+  are submitted at a time.
+  """
+  items = iter(items)
+  with concurrent.futures.ProcessPoolExecutor(
+      num_workers, initializer=initializer, initargs=initargs) as executor:
+    pending : set[concurrent.futures.Future] = set()
+    while True:
+      for item in itertools.islice(items, 2 * num_workers - len(pending)):
+        pending.add(executor.submit(func, item))
+      if not pending:
+        return
+      done, pending = concurrent.futures.wait(
+        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        yield future.result()
+
 class TopN:
   """Data structure which only keeps top N items."""
   def __init__(self, size : int) -> None:
@@ -53,7 +53,9 @@ def main():
     assert js[0]["watchlistCount"] == len(js[0]["watchlist"])
     watchlist = frozenset(x["Id"] for x in js[0]["watchlist"])
   utils.log(f"Loaded watchlist. Size: {len(watchlist):_}")
-  watchlist = frozenset(x for x in watchlist if db.num2id(x))
+  watchlist_list = list(watchlist)
+  watchlist_ids = db.get_mult(watchlist_list, ["wikitree_id"])["wikitree_id"]
+  watchlist = frozenset(x for x, id in zip(watchlist_list, watchlist_ids) if id)
   utils.log(f"Filtered watchlist down to: {len(watchlist):_}")
 
   dists, _, _, _ = distances.get_distances(